@@ -0,0 +1,191 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    asyncio entry points for embedding reductions in an event loop.
+
+    CPU bound work is run in chunks on a managed executor so the loop stays free for
+    instrument I/O. cancelling a task or closing an async iterator cancels all chunks
+    that have not started; a chunk that is already running finishes in its worker,
+    so ``chunk_size`` bounds the cancellation latency.
+
+    async with AsyncReducer(max_workers=4) as r:
+        async for i, result in r.iter_calculate_F(isotopes, decay_times, production_ratios=pr):
+            publish(i, result)
+
+    requires python 3.7+
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+# ============= local library imports  ==========================
+
+
+def _calculate_F_chunk(pairs, production_ratios, arar_constants):
+    """
+        pairs: list of (isotopes, decay_time). isotopes are five ufloats or
+            (value, error) pairs a40, a39, a38, a37, a36
+
+        return list of dicts of value and ``_err`` quantities, one per analysis
+    """
+    from uncertainties import nominal_value, std_dev
+    from numpy import asarray
+
+    isos = [[(nominal_value(i), std_dev(i)) if not isinstance(i, tuple) else i for i in isotopes]
+            for isotopes, _ in pairs]
+    isos = asarray(isos, dtype=float).reshape(len(pairs), 5, 2)
+    decay_times = asarray([dt for _, dt in pairs], dtype=float)
+
+    cols = _calculate_F_array_chunk(isos[:, :, 0], isos[:, :, 1], decay_times, production_ratios,
+                                    arar_constants)
+    names = list(cols.keys())
+    return [dict((k, float(cols[k][i])) for k in names) for i in range(len(pairs))]
+
+
+def _calculate_F_array_chunk(values, errors, decay_times, production_ratios, arar_constants):
+    from ararpy.interferences import compile_production_ratios
+    cpr = compile_production_ratios(production_ratios, arar_constants)
+    return cpr.calculate_F(values, errors, decay_times)
+
+
+def _fit_chunk(measurements):
+    from ararpy.fitting import fit_measurements_shared
+    return fit_measurements_shared(measurements)
+
+
+def _isochron(analyses):
+    from ararpy.isochron import IncrementalIsochron
+    iso = IncrementalIsochron.from_analyses(analyses)
+    iso.solve()
+    return iso
+
+
+def _chunks(seq, size):
+    for i in range(0, len(seq), size):
+        yield i, seq[i:i + size]
+
+
+class AsyncReducer(object):
+    """
+        kind: 'thread' or 'process'. threads avoid pickling and are sufficient when
+        the work is dominated by numpy. processes sidestep the GIL for large
+        chunks
+    """
+
+    def __init__(self, max_workers=None, kind='thread', executor=None, chunk_size=256, prefetch=2):
+        self._own_executor = executor is None
+        if executor is None:
+            klass = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+            executor = klass(max_workers=max_workers)
+
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.shutdown()
+
+    def shutdown(self, wait=False):
+        if self._own_executor:
+            self.executor.shutdown(wait=wait)
+
+    async def run(self, func, *args, **kw):
+        """
+            run ``func`` on the executor and await its result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kw))
+
+    # ===============================================================================
+    # single shot
+    # ===============================================================================
+    async def calculate_F(self, isotopes, decay_time, production_ratios=None, arar_constants=None):
+        """
+            isotopes: five ufloats or (value, error) pairs a40, a39, a38, a37, a36
+
+            return dict of value and ``_err`` quantities named as ararpy.results.F_QUANTITIES
+        """
+        results = await self.run(_calculate_F_chunk, [(isotopes, decay_time)], production_ratios,
+                                 arar_constants)
+        return results[0]
+
+    async def calculate_F_array(self, values, errors, decay_times, production_ratios, arar_constants=None):
+        """
+            vectorized reduction, see ararpy.interferences.CompiledProductionRatios.calculate_F
+        """
+        return await self.run(_calculate_F_array_chunk, values, errors, decay_times,
+                              production_ratios, arar_constants)
+
+    async def calculate_isochron(self, analyses):
+        """
+            return a solved ararpy.isochron.IncrementalIsochron
+        """
+        return await self.run(_isochron, analyses)
+
+    async def fit_measurements(self, measurements):
+        """
+            return list of (intercept, error) for each IsotopicMeasurement, see
+            ararpy.fitting.fit_measurements_shared
+        """
+        results = []
+        async for _, r in self._iter(_fit_chunk, list(measurements)):
+            results.append(r)
+        return results
+
+    # ===============================================================================
+    # streaming
+    # ===============================================================================
+    def iter_calculate_F(self, isotopes, decay_times, production_ratios=None, arar_constants=None):
+        """
+            async iterator of (index, ``calculate_F`` result) in input order. each chunk
+            is reduced in one vectorized call
+        """
+        return self._iter(_calculate_F_chunk, list(zip(isotopes, decay_times)), production_ratios,
+                          arar_constants)
+
+    def iter_fit_measurements(self, measurements):
+        return self._iter(_fit_chunk, list(measurements))
+
+    async def _iter(self, func, items, *args):
+        loop = asyncio.get_running_loop()
+        pending = []
+        chunks = _chunks(items, self.chunk_size)
+
+        def submit():
+            for start, chunk in chunks:
+                pending.append((start, loop.run_in_executor(self.executor, partial(func, chunk, *args))))
+                return True
+
+        try:
+            for _ in range(max(1, self.prefetch)):
+                if not submit():
+                    break
+
+            while pending:
+                start, fut = pending.pop(0)
+                results = await fut
+                submit()
+                for i, r in enumerate(results):
+                    yield start + i, r
+        finally:
+            for _, fut in pending:
+                fut.cancel()
+
+# ============= EOF =============================================
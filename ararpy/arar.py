@@ -20,14 +20,15 @@
 import math
 from copy import deepcopy
 
-from numpy import asarray, average, array
+from numpy import asarray, average, array, where, log
 from uncertainties import ufloat, umath
 
 
 # ============= local library imports  ==========================
-from constants import ArArConstants
-from plateau import Plateau
-from stats import calculate_weighted_mean
+from ararpy.constants import ArArConstants
+from ararpy.plateau import Plateau
+from ararpy.profiling import profile_stage
+from ararpy.stats import calculate_weighted_mean
 
 
 def calculate_F_ratio(m4039, m3739, m3639, pr):
@@ -47,6 +48,7 @@ def calculate_F_ratio(m4039, m3739, m3639, pr):
     return F
 
 
+@profile_stage('arar.calculate_flux')
 def calculate_flux(f, age, arar_constants=None):
     """
         #rad40: radiogenic 40Ar
@@ -83,6 +85,7 @@ def calculate_decay_time(dc, f):
     return math.log(f) / dc
 
 
+@profile_stage('arar.calculate_decay_factor')
 def calculate_decay_factor(dc, segments):
     """
         McDougall and Harrison
@@ -137,6 +140,7 @@ def apply_fixed_k3739(a39, pr, fixed_k3739):
     return ca37, ca39, k37, k39
 
 
+@profile_stage('arar.interference_corrections')
 def interference_corrections(a40, a39, a38, a37, a36,
                              production_ratios,
                              arar_constants=None,
@@ -174,6 +178,7 @@ def interference_corrections(a40, a39, a38, a37, a36,
     return k37, k38, k39, ca36, ca37, ca38, ca39
 
 
+@profile_stage('arar.atmospheric_correction')
 def calculate_atmospheric(a38, a36, k38, ca38, ca36, decay_time,
                           production_ratios=None,
                           arar_constants=None):
@@ -202,6 +207,7 @@ def calculate_atmospheric(a38, a36, k38, ca38, ca36, decay_time,
     return atm36, cl36
 
 
+@profile_stage('arar.calculate_F')
 def calculate_F(isotopes,
                 decay_time,
                 interferences=None,
@@ -223,7 +229,7 @@ def calculate_F(isotopes,
         arar_constants = ArArConstants()
 
     #make local copy of interferences
-    pr = dict(((k, v.__copy__()) for k, v in interferences.iteritems()))
+    pr = dict(((k, v.__copy__()) for k, v in interferences.items()))
 
     #for k,v in pr.iteritems():
     #    print k, v
@@ -271,13 +277,14 @@ def calculate_F(isotopes,
                                   Ar37=a37,  #- ca37 - k37,
                                   Ar36=atm36)
     ##clear errors in irrad
-    for pp in pr.itervalues():
+    for pp in pr.values():
         pp.std_dev = 0
     f_wo_irrad = f
 
     return rf, f_wo_irrad, non_ar_isotopes, computed, interference_corrected
 
 
+@profile_stage('arar.age_equation')
 def age_equation(j, f,
                  include_decay_error=False,
                  arar_constants=None):
@@ -303,6 +310,36 @@ def age_equation(j, f,
         return ufloat(0, 0)
 
 
+def calculate_ages(j, j_err, f, f_err, include_decay_error=False, arar_constants=None):
+    """
+        vectorized age_equation
+
+        j, j_err, f, f_err: scalars or arrays
+
+        return ages, errors in arar_constants.age_units. invalid ages (1+j*f<=0) are 0+/-0
+    """
+    if arar_constants is None:
+        arar_constants = ArArConstants()
+
+    j, j_err, f, f_err = [asarray(a, dtype=float) for a in (j, j_err, f, f_err)]
+    scalar = float(arar_constants.age_scalar)
+    lk = arar_constants.lambda_k
+    lkv = lk.nominal_value
+
+    x = 1 + j * f
+    valid = x > 0
+    x = where(valid, x, 1)
+    ln = log(x)
+    ages = ln / lkv
+
+    # first order propagation of f, j and optionally lambda_k
+    var = ((j * f_err) ** 2 + (f * j_err) ** 2) / (lkv * x) ** 2
+    if include_decay_error:
+        var = var + (ages / lkv * lk.std_dev) ** 2
+
+    return where(valid, ages / scalar, 0), where(valid, var ** 0.5 / scalar, 0)
+
+
 #===============================================================================
 # non-recursive
 #===============================================================================
@@ -0,0 +1,399 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    batch reduction over a work queue.
+
+    a project is split into chunks of analyses that share an irradiation, production
+    ratios and constants. chunks are pushed to a queue backend and reduced by any
+    number of workers, on any node that can reach the queue, with
+    ``pipeline.StreamingReducer``. results are merged in submission order.
+
+    a claimed chunk carries a lease. if a worker dies its chunks are handed out again
+    once the lease expires; finished chunks are never reprocessed, so a crashed run
+    is resumed by starting workers again.
+
+        runner = DistributedRunner(SQLiteQueue('project.queue'))
+        runner.submit(analyses, chunk_size=500)
+
+        # on every node
+        python -m ararpy.distributed worker project.queue
+
+        runner.merge('project.npz')
+
+    SQLiteQueue is meant for a single machine or a reliable shared filesystem. other
+    brokers implement the ``QueueBackend`` methods
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import argparse
+import hashlib
+import os
+import pickle
+import socket
+import sqlite3
+import time
+import traceback
+
+from numpy import asarray, argsort, concatenate
+# ============= local library imports  ==========================
+
+INDEX_COLUMN = 'index'
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+class QueueBackend(object):
+    """
+        interface of a chunk queue. payloads and results are opaque bytes
+    """
+
+    def put(self, key, seq, payload):
+        """
+            add a chunk. chunks whose key already exists are left untouched
+        """
+        raise NotImplementedError
+
+    def claim(self, worker, lease):
+        """
+            return (key, payload) of a pending or lease expired chunk, or None
+        """
+        raise NotImplementedError
+
+    def complete(self, key, worker, result):
+        raise NotImplementedError
+
+    def fail(self, key, worker, error, max_attempts):
+        """
+            release a chunk claimed by ``worker`` after an error. the chunk is failed
+            for good after ``max_attempts`` errors
+        """
+        raise NotImplementedError
+
+    def status(self):
+        """
+            return dict of state: count
+        """
+        raise NotImplementedError
+
+    def keys(self):
+        raise NotImplementedError
+
+    def remove(self, keys):
+        raise NotImplementedError
+
+    def results(self):
+        """
+            iterate (key, result) of every chunk in submission order
+        """
+        raise NotImplementedError
+
+
+class SQLiteQueue(QueueBackend):
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.timeout = timeout
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS chunks (
+                                key TEXT PRIMARY KEY,
+                                seq INTEGER,
+                                payload BLOB,
+                                state TEXT,
+                                worker TEXT,
+                                lease_expires REAL,
+                                attempts INTEGER DEFAULT 0,
+                                result BLOB,
+                                error TEXT)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS chunks_state ON chunks (state, seq)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return _Transaction(conn)
+
+    def put(self, key, seq, payload):
+        with self._connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO chunks (key, seq, payload, state) VALUES (?, ?, ?, ?)',
+                         (key, seq, sqlite3.Binary(payload), PENDING))
+
+    def claim(self, worker, lease):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('''SELECT key, payload FROM chunks
+                                  WHERE state=? OR (state=? AND lease_expires<?)
+                                  ORDER BY seq LIMIT 1''', (PENDING, RUNNING, now)).fetchone()
+            if row:
+                conn.execute('UPDATE chunks SET state=?, worker=?, lease_expires=? WHERE key=?',
+                             (RUNNING, worker, now + lease, row[0]))
+                return row[0], bytes(row[1])
+
+    def complete(self, key, worker, result):
+        with self._connect() as conn:
+            # a chunk reclaimed after a lease expired may finish twice, keep the first
+            conn.execute('''UPDATE chunks SET state=?, result=?, error=NULL, lease_expires=NULL
+                            WHERE key=? AND state!=?''',
+                         (DONE, sqlite3.Binary(result), key, DONE))
+
+    def fail(self, key, worker, error, max_attempts):
+        with self._connect() as conn:
+            # only the worker holding the lease may fail a chunk. a worker whose lease
+            # expired and whose chunk was reclaimed must not reset the new claim
+            conn.execute('''UPDATE chunks SET attempts=attempts+1, error=?, lease_expires=NULL,
+                            state=CASE WHEN attempts+1>=? THEN ? ELSE ? END
+                            WHERE key=? AND worker=? AND state=?''',
+                         (error, max_attempts, FAILED, PENDING, key, worker, RUNNING))
+
+    def status(self):
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT state, COUNT(*) FROM chunks GROUP BY state').fetchall())
+
+    def keys(self):
+        with self._connect() as conn:
+            return [k for (k,) in conn.execute('SELECT key FROM chunks')]
+
+    def remove(self, keys):
+        with self._connect() as conn:
+            conn.executemany('DELETE FROM chunks WHERE key=?', [(k,) for k in keys])
+
+    def results(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            for key, state, result in conn.execute('SELECT key, state, result FROM chunks ORDER BY seq'):
+                yield key, state, bytes(result) if result is not None else None
+        finally:
+            conn.close()
+
+
+class _Transaction(object):
+    """
+        connection context that holds a write lock for the duration of the block so
+        claims from concurrent workers are serialized
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, *args):
+        try:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.conn.close()
+
+
+def default_group_key(analysis):
+    """
+        analyses in one chunk share irradiation, production ratios and constants
+    """
+    return (analysis.get('irradiation', ''),
+            repr(sorted((analysis.get('production_ratios') or {}).items())),
+            repr(sorted((analysis.get('arar_constants') or {}).items())))
+
+
+def split_project(analyses, chunk_size=500, group_key=default_group_key):
+    """
+        return list of (indices, analyses) chunks. every chunk holds analyses with the
+        same group key and their positions in ``analyses``. groups keep the order in
+        which they first appear; order within a group is kept
+    """
+    order = {}
+    groups = {}
+    for i, a in enumerate(analyses):
+        k = group_key(a)
+        if k not in groups:
+            order[k] = len(order)
+            groups[k] = []
+        groups[k].append((i, a))
+
+    chunks = []
+    for k in sorted(groups, key=order.get):
+        ans = groups[k]
+        for i in range(0, len(ans), chunk_size):
+            idx, chunk = zip(*ans[i:i + chunk_size])
+            chunks.append((list(idx), list(chunk)))
+    return chunks
+
+
+def reduce_chunk(payload):
+    """
+        worker side reduction of one chunk. return identifiers, columns
+    """
+    from ararpy.constants import ArArConstants
+    from ararpy.pipeline import StreamingReducer
+
+    analyses = payload['analyses']
+    ref = analyses[0]
+    ac = ArArConstants(**(ref.get('arar_constants') or {}))
+    r = StreamingReducer(ref.get('production_ratios'), ac, **payload.get('options', {}))
+    cols = r.reduce_chunk(analyses)
+    cols[INDEX_COLUMN] = asarray(payload['indices'], dtype=int)
+    return [a.get('identifier', '') for a in analyses], cols
+
+
+class DistributedRunner(object):
+    def __init__(self, queue, max_attempts=3):
+        if isinstance(queue, str):
+            queue = SQLiteQueue(queue)
+        self.queue = queue
+        self.max_attempts = max_attempts
+
+    def submit(self, analyses, chunk_size=500, group_key=default_group_key, options=None, replace=False):
+        """
+            analyses: raw analyses in the ``pipeline`` format. optional keys
+                irradiation, production_ratios, arar_constants (ArArConstants kwargs)
+            options: StreamingReducer keyword arguments
+
+            chunks are keyed by their content. submitting the same project again only
+            adds missing chunks. if the queue holds chunks that are not part of this
+            submission, e.g. the project changed, a ValueError is raised unless
+            ``replace`` is set, in which case they are removed. return number of chunks
+        """
+        chunks = split_project(analyses, chunk_size, group_key)
+        payloads = []
+        for indices, chunk in chunks:
+            payload = pickle.dumps(dict(analyses=chunk, indices=indices, options=options or {}),
+                                   protocol=2)
+            payloads.append((hashlib.sha1(payload).hexdigest(), payload))
+
+        stale = set(self.queue.keys()) - set(k for k, _ in payloads)
+        if stale:
+            if not replace:
+                raise ValueError('queue holds {} chunks from a different submission. '
+                                 'use replace=True to discard them'.format(len(stale)))
+            self.queue.remove(stale)
+
+        for i, (key, payload) in enumerate(payloads):
+            self.queue.put(key, i, payload)
+        return len(chunks)
+
+    def work(self, worker=None, lease=600, poll=1, idle_timeout=None, max_chunks=None):
+        """
+            claim and reduce chunks until the queue is drained
+
+            idle_timeout: seconds to keep polling for chunks released by crashed
+                workers before exiting. None waits until no chunk is running, i.e. every
+                lease held by another worker has completed or expired and been redone
+            return number of chunks completed
+        """
+        if worker is None:
+            worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+        n = 0
+        idle_since = None
+        while max_chunks is None or n < max_chunks:
+            job = self.queue.claim(worker, lease)
+            if job is None:
+                st = self.queue.status()
+                now = time.time()
+                if idle_since is None:
+                    idle_since = now
+                if not st.get(RUNNING) or (idle_timeout is not None and now - idle_since >= idle_timeout):
+                    break
+                time.sleep(poll)
+                continue
+
+            idle_since = None
+            key, payload = job
+            try:
+                result = reduce_chunk(pickle.loads(payload))
+            except Exception:
+                self.queue.fail(key, worker, traceback.format_exc(), self.max_attempts)
+            else:
+                self.queue.complete(key, worker, pickle.dumps(result, protocol=2))
+                n += 1
+        return n
+
+    def status(self):
+        return self.queue.status()
+
+    def iter_results(self):
+        """
+            yield identifiers, columns per chunk in submission order. raise
+            RuntimeError if any chunk is not done
+        """
+        for key, state, result in self.queue.results():
+            if state != DONE:
+                raise RuntimeError('chunk {} is {}'.format(key, state))
+            yield pickle.loads(result)
+
+    def merge(self, path=None, id_width=32):
+        """
+            merge every chunk's results in submitted order. the ``index`` column holds
+            each analysis' position in the submitted list
+
+            write to the bulk result format at ``path`` and return path, or return a
+            dict of columns and an ``identifier`` list
+        """
+        from ararpy.results import ResultWriter, ID_COLUMN
+
+        ids, parts = [], []
+        for i, cols in self.iter_results():
+            ids.extend(i)
+            parts.append(cols)
+
+        if parts:
+            merged = dict((k, concatenate([p[k] for p in parts])) for k in parts[0])
+            order = argsort(merged[INDEX_COLUMN], kind='mergesort')
+            merged = dict((k, v[order]) for k, v in merged.items())
+            ids = [ids[i] for i in order]
+        else:
+            merged = {}
+
+        if path:
+            with ResultWriter(path, id_width=id_width) as w:
+                if merged:
+                    w.write(merged, identifiers=ids)
+            return path
+
+        merged[ID_COLUMN] = ids
+        return merged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ararpy work queue')
+    sub = parser.add_subparsers(dest='command')
+
+    w = sub.add_parser('worker', help='reduce chunks until the queue is drained')
+    w.add_argument('queue')
+    w.add_argument('--lease', type=float, default=600)
+    w.add_argument('--idle-timeout', type=float, default=None)
+
+    s = sub.add_parser('status')
+    s.add_argument('queue')
+
+    m = sub.add_parser('merge')
+    m.add_argument('queue')
+    m.add_argument('output')
+
+    args = parser.parse_args(argv)
+    runner = DistributedRunner(args.queue)
+    if args.command == 'worker':
+        n = runner.work(lease=args.lease, idle_timeout=args.idle_timeout)
+        print('completed {} chunks'.format(n))
+    elif args.command == 'status':
+        for k, v in sorted(runner.status().items()):
+            print('{:<10s} {}'.format(k, v))
+    elif args.command == 'merge':
+        runner.merge(args.output)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
+
+# ============= EOF =============================================
@@ -0,0 +1,190 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import re
+from bisect import bisect_left
+from collections import OrderedDict
+
+from numpy import array, asarray, inf, arange, searchsorted, where, ones, full
+# ============= local library imports  ==========================
+from ararpy.fitting import batch_polyfit, batch_predict, fit_degree
+
+FIT_BLOCK_REGEX = re.compile(r'\([\w\d\s,]*\)')
+
+
+def is_fit_block(fit):
+    return bool(FIT_BLOCK_REGEX.match(fit))
+
+
+def parse_fit_blocks(fit):
+    """
+        fit: str e.g. (,10,average)(10,,linear)
+
+        return list of (start, end, fit). an empty start is -1 and an empty end is Inf
+    """
+    fs = []
+    for m in FIT_BLOCK_REGEX.finditer(fit):
+        a = m.group(0)[1:-1]
+        s, e, f = [x.strip() for x in a.split(',')]
+
+        s = -1 if s == '' else int(s)
+        e = inf if e == '' else int(e)
+        fs.append((s, e, f))
+    return fs
+
+
+class FitBlockSpec(object):
+    """
+        a compiled set of fit blocks.
+
+        the block edges are flattened into a sorted ``boundaries`` array and the
+        answer for every boundary and every interval between boundaries is
+        resolved once, using the same rules as a linear scan (first block with
+        start < cnt < end wins). looking up a count is then a binary search.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = list(blocks)
+        self.fits = []
+        for _, _, f in self.blocks:
+            if f not in self.fits:
+                self.fits.append(f)
+
+        bs = sorted(set([s for s, _, _ in self.blocks] + [e for _, e, _ in self.blocks]))
+        self.boundaries = array(bs, dtype=float)
+
+        # point_idx[k] answer at boundaries[k]
+        # interval_idx[k] answer in the open interval (boundaries[k-1], boundaries[k])
+        self.point_idx = array([self._scan(b) for b in bs], dtype=int)
+        reps = [bs[0] - 1] if bs else [0]
+        for lo, hi in zip(bs[:-1], bs[1:]):
+            reps.append(lo + 1 if hi == inf else (lo + hi) / 2.0)
+        if bs:
+            reps.append(bs[-1] + 1)
+        self.interval_idx = array([self._scan(r) for r in reps], dtype=int)
+
+        self.last_idx = self._fit_index(self.blocks[-1][2]) if self.blocks else -1
+
+    def lookup(self, cnt):
+        """
+            return the fit for ``cnt`` or None. a negative ``cnt`` returns the fit of
+            the last block
+        """
+        if cnt < 0:
+            idx = self.last_idx
+        else:
+            bs = self.boundaries
+            k = bisect_left(bs, cnt)
+            if k < len(bs) and bs[k] == cnt:
+                idx = self.point_idx[k]
+            else:
+                idx = self.interval_idx[k]
+
+        if idx >= 0:
+            return self.fits[idx]
+
+    def lookup_indices(self, cnts):
+        """
+            vectorized ``lookup``. return index into ``fits`` per count, -1 if no
+            block applies
+        """
+        cnts = asarray(cnts, dtype=float)
+        bs = self.boundaries
+        if not len(bs):
+            return full(cnts.shape, -1, dtype=int)
+
+        k = searchsorted(bs, cnts, side='left')
+        kk = k.clip(0, len(bs) - 1)
+        idx = where(bs[kk] == cnts, self.point_idx[kk], self.interval_idx[k])
+        return where(cnts < 0, self.last_idx, idx)
+
+    def _scan(self, cnt):
+        for s, e, f in self.blocks:
+            if s < cnt < e:
+                return self._fit_index(f)
+        return -1
+
+    def _fit_index(self, f):
+        return self.fits.index(f)
+
+
+_specs = OrderedDict()
+FIT_BLOCK_CACHE_SIZE = 256
+
+
+def compile_fit_blocks(fit):
+    """
+        return the shared FitBlockSpec for the fit block string ``fit``. the least
+        recently used specs are dropped once ``FIT_BLOCK_CACHE_SIZE`` are cached
+    """
+    key = fit.replace(' ', '')
+    try:
+        spec = _specs.pop(key)
+    except KeyError:
+        spec = FitBlockSpec(parse_fit_blocks(fit))
+        if len(_specs) >= FIT_BLOCK_CACHE_SIZE:
+            _specs.popitem(last=False)
+    _specs[key] = spec
+    return spec
+
+
+def clear_fit_block_specs():
+    _specs.clear()
+
+
+def fit_blocks_batch(spec, xs, ys, mask=None):
+    """
+        fit every block of ``spec`` to all series at once.
+
+        xs, ys: (n_series, n_points) arrays, e.g. from ararpy.fitting.pad_series.
+        the count of a point is its (0 based) column index
+
+        return list of (block, coeffs) where coeffs is (n_series, degree+1). points whose
+        count falls in no block are not fit, matching IsotopicMeasurement.get_fit_block
+    """
+    xs = asarray(xs, dtype=float)
+    ys = asarray(ys, dtype=float)
+    if mask is None:
+        mask = ones(xs.shape, dtype=bool)
+
+    cnts = arange(xs.shape[1])
+    results = []
+    for block in spec.blocks:
+        s, e, f = block
+        sel = (s < cnts) & (cnts < e)
+        coeffs = batch_polyfit(xs, ys, mask & sel, fit_degree(f))
+        results.append((block, coeffs))
+    return results
+
+
+def predict_fit_blocks(results, xs):
+    """
+        evaluate the piecewise fit returned by ``fit_blocks_batch`` at every point of xs.
+        each point uses the block that owns its count
+    """
+    xs = asarray(xs, dtype=float)
+    cnts = arange(xs.shape[1])
+    ys = xs * 0
+    assigned = cnts < 0
+    for (s, e, f), coeffs in results:
+        sel = (s < cnts) & (cnts < e) & ~assigned
+        ys[:, sel] = batch_predict(coeffs, xs[:, sel])
+        assigned = assigned | sel
+    return ys
+
+# ============= EOF =============================================
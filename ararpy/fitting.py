@@ -0,0 +1,411 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import hashlib
+from collections import OrderedDict
+
+from numpy import zeros, ones, eye, asarray, arange, einsum, sqrt, abs as nabs, where, unique, \
+    ascontiguousarray, packbits
+from numpy.linalg import solve, qr, inv
+# ============= local library imports  ==========================
+
+FIT_DEGREES = {'average': 0, 'linear': 1, 'parabolic': 2, 'cubic': 3}
+
+
+def fit_degree(fit):
+    """
+        fit: str e.g. linear, parabolic or an int degree
+    """
+    if isinstance(fit, int):
+        return fit
+    return FIT_DEGREES.get(fit.lower(), 1)
+
+
+def pad_series(xs, ys):
+    """
+        xs: list of 1d arrays
+        ys: list of 1d arrays
+
+        return xs, ys, mask as (n_series, max_len) arrays. padded slots are 0 and
+        masked out (mask==False)
+    """
+    lens = asarray([len(x) for x in xs], dtype=int)
+    m = lens.max() if len(lens) else 0
+    n = len(xs)
+
+    pxs = zeros((n, m))
+    pys = zeros((n, m))
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        pxs[i, :len(x)] = x
+        pys[i, :len(y)] = y
+
+    mask = arange(m) < lens[:, None]
+    return pxs, pys, mask
+
+
+def vandermonde(xs, degree):
+    """
+        return (..., len(xs), degree+1) design matrix with increasing powers
+    """
+    xs = asarray(xs, dtype=float)
+    return xs[..., None] ** arange(degree + 1)
+
+
+def batch_polyfit(xs, ys, mask, degree):
+    """
+        least squares fit a polynomial of ``degree`` to every row of xs, ys
+        using only the points where mask is True.
+
+        return coefficients as (n_series, degree+1) in increasing powers
+        i.e. coeffs[:, 0] is the intercept
+    """
+    scale = _row_scale(xs, mask)
+    v, a = _normal_matrix(xs / scale[:, None], mask, degree)
+    b = einsum('nmi,nm->ni', v, ys * mask)
+
+    coeffs = solve(a, b[..., None])[..., 0]
+    return coeffs / scale[:, None] ** arange(degree + 1)
+
+
+def _row_scale(xs, mask):
+    """
+        per row max |x|. fitting in x/scale keeps the normal equations well conditioned
+    """
+    scale = nabs(where(mask, xs, 0)).max(axis=1) if xs.shape[1] else zeros(xs.shape[0])
+    scale[scale == 0] = 1
+    return scale
+
+
+def _normal_matrix(xs, mask, degree):
+    v = vandermonde(xs, degree) * mask[..., None]
+    a = einsum('nmi,nmj->nij', v, v)
+
+    # guard rows without enough points so the batched solve does not fail
+    singular = mask.sum(axis=1) <= degree
+    if singular.any():
+        a[singular] = a[singular] + eye(degree + 1)
+    return v, a
+
+
+def batch_intercepts(xs, ys, mask, degree):
+    """
+        return intercepts and their standard errors, (n_series,) arrays, of a polynomial
+        fit of ``degree`` to every row. for degree 0 the error is the SEM
+    """
+    coeffs = batch_polyfit(xs, ys, mask, degree)
+    resid = where(mask, ys - batch_predict(coeffs, xs), 0)
+    n = mask.sum(axis=1)
+    dof = (n - degree - 1).clip(1)
+    var = (resid ** 2).sum(axis=1) / dof
+
+    # (A'A)^-1[0, 0] does not depend on the scaling of the higher order columns
+    _, a = _normal_matrix(xs / _row_scale(xs, mask)[:, None], mask, degree)
+    e0 = zeros((xs.shape[0], degree + 1))
+    e0[:, 0] = 1
+    a00 = solve(a, e0[..., None])[:, 0, 0]
+    return coeffs[:, 0], sqrt(var * a00)
+
+
+def batch_predict(coeffs, xs):
+    degree = coeffs.shape[-1] - 1
+    return einsum('nmi,ni->nm', vandermonde(xs, degree), coeffs)
+
+
+def batch_filter_outliers(xs, ys, mask=None, degree=1, iterations=1, std_devs=2):
+    """
+        iterative sigma clipping of many series at once.
+
+        xs, ys: (n_series, n_points) arrays e.g. from ``pad_series``
+        mask: bool array of valid points, default all valid
+        degree: int or sequence of per series fit degrees
+        iterations: number of fit/clip passes
+        std_devs: reject points whose residual is > std_devs * std(residuals)
+
+        return mask of retained points
+    """
+    xs = asarray(xs, dtype=float)
+    ys = asarray(ys, dtype=float)
+    if mask is None:
+        mask = ones(xs.shape, dtype=bool)
+    else:
+        mask = asarray(mask, dtype=bool)
+
+    degrees = asarray(degree, dtype=int)
+    if degrees.ndim == 0:
+        degrees = degrees.repeat(xs.shape[0])
+
+    valid = mask.copy()
+    for _ in range(iterations):
+        residuals = zeros(xs.shape)
+        for d in unique(degrees):
+            sel = degrees == d
+            coeffs = batch_polyfit(xs[sel], ys[sel], valid[sel], d)
+            residuals[sel] = ys[sel] - batch_predict(coeffs, xs[sel])
+
+        residuals = where(valid, residuals, 0)
+        n = valid.sum(axis=1)
+        sd = sqrt((residuals ** 2).sum(axis=1) / (n - 1).clip(1))
+        valid = valid & (nabs(residuals) <= std_devs * sd[:, None])
+
+    return valid
+
+
+def batch_slopes(xs, ys, mask, n=-1):
+    """
+        closed form least squares slope of every row of xs, ys.
+
+        n: if not -1 only use the last ``n`` valid points of each row
+
+        return (n_series,) array. rows with fewer than 2 distinct x values return 0
+    """
+    xs = asarray(xs, dtype=float)
+    ys = asarray(ys, dtype=float)
+    mask = asarray(mask, dtype=bool)
+    if n != -1:
+        lens = mask.sum(axis=1)
+        mask = mask & (arange(xs.shape[1]) >= (lens - n)[:, None])
+
+    w = mask.astype(float)
+    cnt = w.sum(axis=1).clip(1)
+
+    # center x per row so the sums do not cancel for large time values
+    dx = w * (xs - ((w * xs).sum(axis=1) / cnt)[:, None])
+    sxx = (dx * dx).sum(axis=1)
+    sxy = (dx * ys).sum(axis=1)
+
+    valid = sxx > 0
+    return where(valid, sxy, 0) / where(valid, sxx, 1)
+
+
+class SharedDesign(object):
+    """
+        QR factorization of the design matrix of one (timebase, degree, mask). every
+        isotope measured on the timebase is fit with one matrix multiply
+
+        use ``get_shared_design`` to reuse factorizations across analyses
+    """
+
+    def __init__(self, xs, degree, mask=None):
+        xs = asarray(xs, dtype=float)
+        if mask is None:
+            mask = ones(xs.shape, dtype=bool)
+        self.mask = asarray(mask, dtype=bool)
+        self.degree = degree
+        self.n = int(self.mask.sum())
+
+        x = xs[self.mask]
+        scale = nabs(x).max() if len(x) else 1
+        scale = scale or 1
+        d = 1. / scale ** arange(degree + 1)
+
+        if self.n < degree + 1:
+            raise ValueError('{} points cannot be fit with degree {}'.format(self.n, degree))
+
+        q, r = qr(vandermonde(x / scale, degree))
+        rinv = inv(r)
+        # coefficients = ys.dot(operator.T), in unscaled powers of x
+        self.operator = (rinv.dot(q.T)) * d[:, None]
+        # (A'A)^-1 in unscaled powers of x
+        self.xtx_inv = rinv.dot(rinv.T) * d[:, None] * d[None, :]
+        self._design = vandermonde(x, degree)
+
+    def fit(self, ys):
+        """
+            ys: (n_isotopes, len(xs)) signals on the timebase
+
+            return coefficients (n_isotopes, degree+1) in increasing powers and
+            covariance (n_isotopes, degree+1, degree+1)
+        """
+        ys = asarray(ys, dtype=float)[:, self.mask]
+        coeffs = ys.dot(self.operator.T)
+
+        resid = ys - coeffs.dot(self._design.T)
+        dof = max(self.n - self.degree - 1, 1)
+        var = (resid ** 2).sum(axis=1) / dof
+        return coeffs, var[:, None, None] * self.xtx_inv
+
+    def intercepts(self, ys):
+        """
+            return intercepts and their standard errors
+        """
+        coeffs, cov = self.fit(ys)
+        return coeffs[:, 0], sqrt(cov[:, 0, 0])
+
+
+_designs = OrderedDict()
+SHARED_DESIGN_CACHE_SIZE = 256
+
+
+def get_shared_design(xs, degree, mask=None):
+    """
+        return a cached SharedDesign for this timebase, degree and mask
+    """
+    xs = ascontiguousarray(xs, dtype=float)
+    h = hashlib.md5(xs.tobytes())
+    if mask is not None:
+        h.update(packbits(asarray(mask, dtype=bool)).tobytes())
+    key = (h.hexdigest(), len(xs), degree, mask is None)
+
+    try:
+        design = _designs.pop(key)
+    except KeyError:
+        design = SharedDesign(xs, degree, mask)
+        if len(_designs) >= SHARED_DESIGN_CACHE_SIZE:
+            _designs.popitem(last=False)
+    _designs[key] = design
+    return design
+
+
+def clear_shared_designs():
+    _designs.clear()
+
+
+def fit_shared_timebase(xs, ys, degree, masks=None):
+    """
+        fit every row of ``ys`` measured at the common times ``xs``
+
+        xs: (m,) timebase
+        ys: (n_isotopes, m)
+        degree: int or per isotope sequence of fit degrees
+        masks: optional (n_isotopes, m) bool outlier masks
+
+        return intercepts (n,), errors (n,) and covariances as a list of
+        (degree+1, degree+1) arrays. isotopes that share a degree and mask share one
+        factorization and are fit together
+    """
+    ys = asarray(ys, dtype=float)
+    n = ys.shape[0]
+    degrees = asarray(degree, dtype=int)
+    if degrees.ndim == 0:
+        degrees = degrees.repeat(n)
+
+    groups = {}
+    for i in range(n):
+        mkey = None if masks is None else packbits(asarray(masks[i], dtype=bool)).tobytes()
+        groups.setdefault((degrees[i], mkey), []).append(i)
+
+    intercepts, errors = zeros(n), zeros(n)
+    covariances = [None] * n
+    for (d, mkey), idx in groups.items():
+        design = get_shared_design(xs, d, None if mkey is None else masks[idx[0]])
+        coeffs, cov = design.fit(ys[idx])
+        intercepts[idx] = coeffs[:, 0]
+        errors[idx] = sqrt(cov[:, 0, 0])
+        for i, c in zip(idx, cov):
+            covariances[i] = c
+
+    return intercepts, errors, covariances
+
+
+def _shared_fittable(mi):
+    """
+        True if ``mi`` is an ordinary SEM polynomial fit the shared factorization
+        reproduces
+    """
+    if getattr(mi, 'use_static', False) or getattr(mi, 'user_defined_value', False) or \
+            getattr(mi, 'user_defined_error', False):
+        return False
+    if getattr(mi, 'fit_blocks', None):
+        return False
+    if (getattr(mi, 'error_type', None) or 'SEM').upper() != 'SEM':
+        return False
+
+    fit = mi.fit or 'linear'
+    if not isinstance(fit, int) and fit.lower() not in FIT_DEGREES:
+        return False
+
+    mask = getattr(mi, 'outlier_mask', None)
+    if mask is None:
+        fod = getattr(mi, 'filter_outliers_dict', None) or {}
+        if fod.get('filter_outliers'):
+            return False
+        n = len(mi.xs)
+    else:
+        n = int(asarray(mask, dtype=bool).sum())
+    return n > fit_degree(fit)
+
+
+def fit_measurements_shared(measurements):
+    """
+        intercepts of many ``IsotopicMeasurement`` objects, fitting all measurements
+        with the same ``offset_xs`` against one cached factorization
+
+        measurements with user defined or static values, fit blocks, a non SEM
+        error type, outlier filtering without a mask, an unknown fit or too few
+        points use their own ``value`` and ``error``
+
+        return list of (intercept, error)
+    """
+    results = [None] * len(measurements)
+    groups = {}
+    for i, mi in enumerate(measurements):
+        if not _shared_fittable(mi):
+            results[i] = (mi.value, mi.error)
+            continue
+
+        xs = ascontiguousarray(mi.offset_xs, dtype=float)
+        groups.setdefault(hashlib.md5(xs.tobytes()).hexdigest(), []).append(i)
+
+    for idx in groups.values():
+        ms = [measurements[i] for i in idx]
+        masks = [getattr(mi, 'outlier_mask', None) for mi in ms]
+        if any(m is None for m in masks):
+            masks = None if all(m is None for m in masks) else \
+                [ones(len(mi.xs), dtype=bool) if m is None else m for mi, m in zip(ms, masks)]
+
+        vs, es, _ = fit_shared_timebase(ms[0].offset_xs, [mi.ys for mi in ms],
+                                        [fit_degree(mi.fit or 'linear') for mi in ms], masks)
+        for i, v, e in zip(idx, vs, es):
+            results[i] = (v, e)
+    return results
+
+
+def calculate_slopes(measurements, n=-1):
+    """
+        slopes of many ``BaseMeasurement`` objects in one vectorized call.
+        equivalent to ``[m.get_slope(n) for m in measurements]``
+    """
+    xs, ys, mask = pad_series([mi.xs for mi in measurements],
+                              [mi.ys for mi in measurements])
+    return batch_slopes(xs, ys, mask, n)
+
+
+def filter_measurements(measurements):
+    """
+        sigma clip every ``IsotopicMeasurement`` in ``measurements`` with
+        filter_outliers enabled, grouped by (iterations, std_devs).
+
+        the resulting masks are stored on each measurement as ``outlier_mask``
+        so that ``get_filtered_data`` does not have to refit
+    """
+    groups = {}
+    for mi in measurements:
+        fod = mi.filter_outliers_dict
+        if not fod.get('filter_outliers') or not len(mi.xs):
+            continue
+        key = (int(fod.get('iterations', 1)), float(fod.get('std_devs', 2)))
+        groups.setdefault(key, []).append(mi)
+
+    for (iterations, std_devs), ms in groups.items():
+        xs, ys, mask = pad_series([mi.offset_xs for mi in ms], [mi.ys for mi in ms])
+        degrees = [fit_degree(mi.fit or 'linear') for mi in ms]
+        valid = batch_filter_outliers(xs, ys, mask, degrees, iterations, std_devs)
+        for mi, vi, n in zip(ms, valid, mask.sum(axis=1)):
+            mi.outlier_mask = vi[:n]
+
+# ============= EOF =============================================
@@ -0,0 +1,164 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import hashlib
+
+from numpy import asarray, exp, where, column_stack, ones_like, einsum, sqrt, ascontiguousarray
+from numpy.linalg import lstsq, pinv
+# ============= local library imports  ==========================
+from ararpy.constants import ArArConstants
+
+SURFACE_MODELS = ('plane', 'bowl')
+
+
+def calculate_fluxes(f, f_err, age, age_err, arar_constants=None):
+    """
+        vectorized ``arar.calculate_flux``
+
+        f, f_err: F (rad40Ar/39ArK) of each monitor
+        age, age_err: monitor age in years, scalar or per monitor
+
+        return j, j_err arrays. monitors with F==0 return j=1, j_err=0
+    """
+    if arar_constants is None:
+        arar_constants = ArArConstants()
+
+    lk = arar_constants.lambda_k.nominal_value
+    f = asarray(f, dtype=float)
+    f_err = asarray(f_err, dtype=float)
+    age = asarray(age, dtype=float)
+    age_err = asarray(age_err, dtype=float)
+
+    valid = f != 0
+    fs = where(valid, f, 1)
+    e = exp(age * lk)
+    j = (e - 1) / fs
+
+    # first order propagation. dj/df=-j/f, dj/dage=lk*e/f
+    j_err = sqrt((j / fs * f_err) ** 2 + (lk * e / fs * age_err) ** 2)
+    return where(valid, j, 1), where(valid, j_err, 0)
+
+
+def surface_design(x, y, model='plane'):
+    """
+        plane: j = a + b*x + c*y
+        bowl: j = a + b*x + c*y + d*x^2 + e*y^2 + f*x*y
+    """
+    x = asarray(x, dtype=float)
+    y = asarray(y, dtype=float)
+    cols = [ones_like(x), x, y]
+    if model == 'bowl':
+        cols.extend((x * x, y * y, x * y))
+    elif model != 'plane':
+        raise ValueError('invalid flux surface model "{}". use one of {}'.format(model, SURFACE_MODELS))
+    return column_stack(cols)
+
+
+class FluxSurface(object):
+    """
+        weighted least squares J surface for one irradiation level
+    """
+
+    def __init__(self, x, y, j, j_err, model='plane'):
+        """
+            j_err: 1 sigma J errors. monitors are weighted by 1/j_err, so every error
+            must be positive
+        """
+        self.model = model
+        a = surface_design(x, y, model)
+        j = asarray(j, dtype=float)
+        j_err = asarray(j_err, dtype=float)
+
+        bad = ~(j_err > 0)
+        if bad.any():
+            raise ValueError('monitor J errors must be positive. {} of {} are not, e.g. index {}'.format(
+                bad.sum(), len(j_err), bad.nonzero()[0][0]))
+
+        w = 1 / j_err
+
+        aw = a * w[:, None]
+        self.coefficients = lstsq(aw, j * w, rcond=None)[0]
+        self.covariance = pinv(aw.T.dot(aw))
+
+        n, p = a.shape
+        resid = (j - a.dot(self.coefficients)) * w
+        self.mswd = (resid ** 2).sum() / (n - p) if n > p else 0
+
+    def predict(self, x, y):
+        return surface_design(x, y, self.model).dot(self.coefficients)
+
+    def predict_error(self, x, y):
+        a = surface_design(x, y, self.model)
+        return sqrt(einsum('ij,jk,ik->i', a, self.covariance, a))
+
+    def evaluate(self, x, y):
+        """
+            return j, j_err at every (x, y)
+        """
+        return self.predict(x, y), self.predict_error(x, y)
+
+
+def _digest(*arrays):
+    h = hashlib.md5()
+    for a in arrays:
+        h.update(ascontiguousarray(a, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+class FluxModel(object):
+    """
+        caches one FluxSurface per (level, model). a level is refit only if its
+        monitor positions or J values change
+
+        fm = FluxModel()
+        j, je = calculate_fluxes(f, fe, monitor_age, monitor_age_err)
+        fm.fit_level('NM-200A', mx, my, j, je, model='bowl')
+        uj, uje = fm.evaluate('NM-200A', ux, uy)
+    """
+
+    def __init__(self):
+        self._surfaces = {}
+
+    def fit_level(self, level, x, y, j, j_err, model='plane'):
+        digest = _digest(x, y, j, j_err)
+        key = (level, model)
+        try:
+            d, surface = self._surfaces[key]
+            if d == digest:
+                return surface
+        except KeyError:
+            pass
+
+        surface = FluxSurface(x, y, j, j_err, model)
+        self._surfaces[key] = (digest, surface)
+        return surface
+
+    def get_surface(self, level, model='plane'):
+        return self._surfaces[(level, model)][1]
+
+    def evaluate(self, level, x, y, model='plane'):
+        return self.get_surface(level, model).evaluate(x, y)
+
+    def clear(self, level=None):
+        if level is None:
+            self._surfaces = {}
+        else:
+            for k in [k for k in self._surfaces if k[0] == level]:
+                self._surfaces.pop(k)
+
+# ============= EOF =============================================
@@ -0,0 +1,231 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    relative probability (ideogram) curves. each age contributes a normal
+    distribution with its 1sigma error.
+
+    two evaluation methods
+
+        direct: exact sum of gaussians, chunked so memory stays bounded. O(N*G)
+        fft: ages are grouped by error into narrow log spaced bins, deposited onto a
+             uniform grid and each group is convolved with its gaussian by FFT.
+             O(N + K*G*log(G)) for K error groups. errors within a group differ by
+             at most ``error_tolerance`` (relative). ages with errors narrower than
+             FFT_MIN_SIGMA grid spacings are not resolved by the deposit and are
+             summed exactly over the few grid points they reach instead
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+from numpy import asarray, linspace, exp, sqrt, pi, zeros, floor, log, bincount, arange, \
+    unique, diff, allclose, concatenate, cumsum, argsort, ceil
+from numpy.fft import rfft, irfft
+# ============= local library imports  ==========================
+from ararpy.profiling import profile_stage
+
+IDEOGRAM_METHODS = ('auto', 'direct', 'fft')
+
+# above this many gaussian evaluations 'auto' uses the fft method
+DIRECT_LIMIT = 2e7
+
+# smallest error, in grid spacings, convolved by fft
+FFT_MIN_SIGMA = 3
+
+
+def ideogram_grid(ages, errors, npoints=1000, nsigma=3):
+    """
+        uniform grid spanning every age +/- nsigma*error
+    """
+    ages = asarray(ages, dtype=float)
+    errors = asarray(errors, dtype=float)
+    return linspace((ages - nsigma * errors).min(), (ages + nsigma * errors).max(), npoints)
+
+
+@profile_stage('ideogram.calculate_ideogram')
+def calculate_ideogram(ages, errors, grid=None, npoints=1000, method='auto', normalize=False,
+                       chunk_size=None, error_tolerance=0.01):
+    """
+        ages, errors: 1sigma
+        grid: evaluation points. default ``ideogram_grid(ages, errors, npoints)``. the fft
+            method requires a uniform grid
+        normalize: scale so the peak is 1
+
+        return grid, probability
+    """
+    ages = asarray(ages, dtype=float)
+    errors = asarray(errors, dtype=float)
+    if grid is None:
+        grid = ideogram_grid(ages, errors, npoints)
+    grid = asarray(grid, dtype=float)
+
+    if method not in IDEOGRAM_METHODS:
+        raise ValueError('invalid ideogram method "{}". use one of {}'.format(method, IDEOGRAM_METHODS))
+
+    if method == 'auto':
+        method = 'fft' if len(ages) * len(grid) > DIRECT_LIMIT and _is_uniform(grid) else 'direct'
+
+    if method == 'fft':
+        if not _is_uniform(grid):
+            raise ValueError('fft method requires a uniform grid')
+        narrow = errors < FFT_MIN_SIGMA * (grid[1] - grid[0])
+        prob = zeros(len(grid))
+        if narrow.any():
+            prob += _local_probability(ages[narrow], errors[narrow], grid, chunk_size)
+        if not narrow.all():
+            prob += _fft_probability(ages[~narrow], errors[~narrow], grid, error_tolerance)
+    else:
+        prob = _direct_probability(ages, errors, grid, chunk_size)
+
+    if normalize:
+        m = prob.max()
+        if m:
+            prob = prob / m
+    return grid, prob
+
+
+def find_peaks(grid, probability, threshold=0):
+    """
+        local maxima of an ideogram
+
+        threshold: ignore peaks lower than threshold*max(probability)
+
+        return peak ages, peak heights sorted by decreasing height
+    """
+    grid = asarray(grid)
+    p = asarray(probability)
+    n = len(p)
+    if not n:
+        return grid[:0], p[:0]
+
+    # collapse runs of equal values so flat topped peaks are found once, at their center
+    starts = concatenate(([0], (p[1:] != p[:-1]).nonzero()[0] + 1))
+    ends = concatenate((starts[1:], [n])) - 1
+    q = p[starts]
+
+    left = concatenate(([True], q[1:] > q[:-1]))
+    right = concatenate((q[:-1] > q[1:], [True]))
+    peaks = left & right & (q > threshold * p.max())
+
+    idx = (starts[peaks] + ends[peaks]) // 2
+    order = argsort(p[idx])[::-1]
+    return grid[idx[order]], p[idx[order]]
+
+
+def cumulative_probability(grid, probability):
+    """
+        trapezoidal cumulative integral scaled to 1
+    """
+    grid = asarray(grid, dtype=float)
+    p = asarray(probability, dtype=float)
+    c = concatenate(([0], cumsum(diff(grid) * (p[1:] + p[:-1]) / 2)))
+    return c / c[-1] if c[-1] else c
+
+
+# ===============================================================================
+# methods
+# ===============================================================================
+def _direct_probability(ages, errors, grid, chunk_size=None):
+    if chunk_size is None:
+        # about 32 MB of float64 per chunk
+        chunk_size = max(1, int(4e6 // max(len(grid), 1)))
+
+    prob = zeros(len(grid))
+    for i in range(0, len(ages), chunk_size):
+        a = ages[i:i + chunk_size, None]
+        e = errors[i:i + chunk_size, None]
+        prob += (exp(-0.5 * ((grid[None, :] - a) / e) ** 2) / (e * sqrt(2 * pi))).sum(axis=0)
+    return prob
+
+
+def _local_probability(ages, errors, grid, chunk_size=None):
+    """
+        exact sum on a uniform grid, evaluating each gaussian only within 5 sigma
+    """
+    x0 = grid[0]
+    dx = grid[1] - grid[0]
+    m = len(grid)
+    w = int(ceil(5 * errors.max() / dx))
+    offsets = arange(-w, w + 1)
+    if chunk_size is None:
+        chunk_size = max(1, int(4e6 // len(offsets)))
+
+    prob = zeros(m)
+    for i in range(0, len(ages), chunk_size):
+        a = ages[i:i + chunk_size, None]
+        e = errors[i:i + chunk_size, None]
+        idx = floor((a - x0) / dx + 0.5).astype(int) + offsets[None, :]
+        v = exp(-0.5 * ((x0 + idx * dx - a) / e) ** 2) / (e * sqrt(2 * pi))
+        inside = (idx >= 0) & (idx < m)
+        prob += bincount(idx[inside], v[inside], minlength=m)
+    return prob
+
+
+def _fft_probability(ages, errors, grid, error_tolerance):
+    dx = grid[1] - grid[0]
+    m = len(grid)
+
+    # extend the grid so tails of ages outside it, and wrap around, do not alias
+    pad = int(ceil(5 * errors.max() / dx))
+    pad = min(pad, 4 * m)
+    size = m + 2 * pad
+    nfft = 1 << int(ceil(log(2 * size) / log(2)))
+
+    # linear deposit of each age onto its two neighbouring grid points
+    pos = (ages - grid[0]) / dx + pad
+    i0 = floor(pos).astype(int)
+    f = pos - i0
+
+    # narrow relative error groups
+    le = log(errors)
+    group = floor((le - le.min()) / log(1 + error_tolerance)).astype(int)
+    _, inv = unique(group, return_inverse=True)
+    inv = inv.ravel()
+    sigmas = exp(bincount(inv, le) / bincount(inv))
+
+    # kernels are truncated at the padding, 5 sigma of the largest error
+    offsets = arange(-pad, pad + 1)
+    kidx = offsets % nfft
+
+    # deposit and transform blocks of groups at a time to bound memory
+    block = max(1, int(2 ** 22 // nfft))
+    spectrum = 0
+    for g0 in range(0, len(sigmas), block):
+        ss = sigmas[g0:g0 + block]
+        k = len(ss)
+        sel = (inv >= g0) & (inv < g0 + k)
+        row = (inv[sel] - g0) * nfft
+
+        hist = zeros(k * nfft)
+        for idx, w in ((i0[sel], 1 - f[sel]), (i0[sel] + 1, f[sel])):
+            inside = (idx >= 0) & (idx < size)
+            hist += bincount(row[inside] + idx[inside], w[inside], minlength=k * nfft)
+
+        # the linear deposit smooths like a tent of variance dx**2/6, take it out of the kernel
+        ks = sqrt(ss ** 2 - dx ** 2 / 6.)[:, None]
+        kernels = zeros((k, nfft))
+        kernels[:, kidx] = exp(-0.5 * (offsets[None, :] * dx / ks) ** 2) / (ks * sqrt(2 * pi))
+        spectrum = spectrum + (rfft(hist.reshape(k, nfft), axis=1) * rfft(kernels, axis=1)).sum(axis=0)
+
+    return irfft(spectrum, nfft)[pad:pad + m]
+
+
+def _is_uniform(grid):
+    if len(grid) < 2:
+        return False
+    d = diff(grid)
+    return d[0] > 0 and allclose(d, d[0], rtol=1e-6, atol=0)
+
+
+# ============= EOF =============================================
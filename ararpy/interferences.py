@@ -0,0 +1,349 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    production ratio sets compiled into a linear map from the measured isotopes
+    (Ar40, Ar39, Ar38, Ar37, Ar36) to the interference corrected isotopes.
+
+    the iterative 37/39 correction in ``arar.interference_corrections`` converges to
+
+        ca37 = (a37 - k3739*a39) / (1 - k3739*ca3937)
+
+    which is used directly. errors are propagated to first order with a per analysis
+    jacobian over the five measured isotopes, the same linearization used by
+    uncertainties for the scalar path.
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+from numpy import asarray, zeros, where, sqrt, einsum, errstate, broadcast_to
+from uncertainties import nominal_value, std_dev
+# ============= local library imports  ==========================
+from ararpy.constants import ArArConstants
+
+PRODUCTION_RATIOS = ('k4039', 'k3839', 'k3739', 'ca3937', 'ca3837', 'ca3637', 'cl3638')
+
+# rows of the interference matrix. columns are a40, a39, a38, a37, a36
+INTERFERENCE_ROWS = ('k37', 'k38', 'k39', 'ca36', 'ca37', 'ca38', 'ca39')
+A40, A39, A38, A37, A36 = range(5)
+
+# derived quantities and the production ratio that converts each isotope ratio.
+# K/Cl uses 38ArCl = a38 - atm38 - k38 - ca38
+DERIVED_QUANTITIES = ('kca', 'kcl', 'rad40_percent')
+DERIVED_RATIOS = {'kca': ('ca37', 'ca_k'), 'kcl': ('cl38', 'cl_k')}
+
+# quantities of ``_reduce`` used internally and not returned by calculate_F
+INTERNAL_QUANTITIES = ('cl38',)
+
+
+class CompiledProductionRatios(object):
+    """
+        use ``compile_production_ratios`` to get an instance so that analyses that
+        share a production ratio set and constants share the compiled matrix
+    """
+
+    def __init__(self, values, errors, arar_constants):
+        self.values = values
+        self.errors = errors
+
+        ac = arar_constants
+        self.fixed_mode = ac.k3739_mode.lower() != 'normal'
+        self.fixed_k3739 = nominal_value(ac.fixed_k3739)
+        self.fixed_k3739_err = std_dev(ac.fixed_k3739)
+        self.allow_negative_ca_correction = ac.allow_negative_ca_correction
+        self.atm4036 = ac.atm4036.nominal_value
+        self.atm3836 = ac.atm3836.nominal_value
+        self.lambda_cl36 = ac.lambda_Cl36.nominal_value
+
+        self.matrix = self._build_matrix(values)
+
+    def _build_matrix(self, pr):
+        m = zeros((len(INTERFERENCE_ROWS), 5))
+        k37, k38, k39, ca36, ca37, ca38, ca39 = range(len(INTERFERENCE_ROWS))
+
+        r = pr.get('ca3937', 0)
+        if self.fixed_mode:
+            x = pr.get('fixed_k3739', self.fixed_k3739)
+            y = 1 / pr.get('ca3937', 1)
+            m[ca37, A39] = x * y / (x + y)
+            m[ca39] = r * m[ca37]
+            m[k39, A39] = 1
+            m[k39] -= m[ca39]
+            m[k37] = x * m[k39]
+        else:
+            k = pr.get('k3739', 0)
+            c = 1 / (1 - k * r)
+            m[ca37, A37] = c
+            m[ca37, A39] = -c * k
+            m[ca39] = r * m[ca37]
+            m[k39, A39] = 1
+            m[k39] -= m[ca39]
+            m[k37] = k * m[k39]
+
+        m[k38] = pr.get('k3839', 0) * m[k39]
+        m[ca36] = pr.get('ca3637', 0) * m[ca37]
+        m[ca38] = pr.get('ca3837', 0) * m[ca37]
+        return m
+
+    # ===============================================================================
+    # application
+    # ===============================================================================
+    def interference_corrections(self, values, matrix=None):
+        """
+            values: (n, 5) measured isotopes a40, a39, a38, a37, a36
+
+            return dict of name: (value (n,), jacobian (n, 5))
+        """
+        if matrix is None:
+            matrix = self.matrix
+
+        values = asarray(values, dtype=float)
+        n = values.shape[0]
+        qs = values.dot(matrix.T)
+
+        out = {}
+        for i, name in enumerate(INTERFERENCE_ROWS):
+            out[name] = (qs[:, i], matrix[i][None].repeat(n, axis=0))
+
+        if not self.allow_negative_ca_correction:
+            neg = out['ca37'][0] < 0
+            if neg.any():
+                for name in ('ca36', 'ca37', 'ca38'):
+                    v, jac = out[name]
+                    out[name] = (where(neg, 0, v), where(neg[:, None], 0, jac))
+        return out
+
+    def calculate_F(self, values, errors, decay_time, include_irradiation_error=True, derived=()):
+        """
+            vectorized ``arar.calculate_F``
+
+            values, errors: (n, 5) isotopes a40, a39, a38, a37, a36
+            decay_time: scalar or (n,)
+            derived: quantities from DERIVED_QUANTITIES to add, computed from the same
+                reduction. see ``calculate_derived``
+
+            return dict of value and ``_err`` columns named as ararpy.results.F_QUANTITIES
+        """
+        derived = _check_derived(derived)
+        values = asarray(values, dtype=float)
+        errors = asarray(errors, dtype=float)
+        qs = self._reduce(values, decay_time, self.values, self.matrix)
+
+        # in fixed mode the k3739 error is carried by every quantity, as in the scalar path
+        pvar = {}
+        if self.fixed_mode and self.fixed_k3739_err:
+            pvar = self._parameter_variance(values, decay_time,
+                                            {'fixed_k3739': (self.fixed_k3739, self.fixed_k3739_err)})
+
+        cols = {}
+        for name, (v, jac) in qs.items():
+            if name in INTERNAL_QUANTITIES:
+                continue
+            cols[name] = v
+            cols['{}_err'.format(name)] = sqrt(_propagate(jac, errors) ** 2 + pvar.get(name, 0))
+
+        cols['F_wo_irrad'] = cols['F']
+        cols['F_wo_irrad_err'] = cols['F_err']
+        if include_irradiation_error:
+            params = dict((k, (self.values[k], e)) for k, e in self.errors.items())
+            ivar = self._parameter_variance(values, decay_time, params, names=('F',))
+            cols['F_err'] = sqrt(cols['F_err'] ** 2 + ivar.get('F', 0))
+
+        cols.update(self._derived(qs, errors, [k for k in derived if k not in cols]))
+        return cols
+
+    def calculate_derived(self, values, errors, decay_time, quantities=DERIVED_QUANTITIES):
+        """
+            K/Ca, K/Cl and %40Ar* for whole runs
+
+            values, errors: (n, 5) isotopes a40, a39, a38, a37, a36
+            decay_time: scalar or (n,). needed for the chlorine correction of K/Cl and
+                %40Ar*
+            quantities: subset of DERIVED_QUANTITIES. only the selected columns are
+                computed, and K/Ca alone skips the atmospheric and chlorine corrections
+
+            kca = k39/ca37 / ca_k and kcl = k39/cl38 / cl_k with the optional ``ca_k``
+            and ``cl_k`` production ratios (default 1). errors propagate the measured
+            isotope errors, with correlations, and the conversion ratio errors.
+            use ``calculate_F(..., derived=quantities)`` when F is needed as well
+
+            return dict of value and ``_err`` columns
+        """
+        quantities = _check_derived(quantities)
+        values = asarray(values, dtype=float)
+        errors = asarray(errors, dtype=float)
+        if set(quantities) - set(('kca',)):
+            qs = self._reduce(values, decay_time, self.values, self.matrix)
+        else:
+            qs = self.interference_corrections(values)
+        return self._derived(qs, errors, quantities)
+
+    def _derived(self, qs, errors, quantities):
+        cols = {}
+        for name in quantities:
+            if name in DERIVED_RATIOS:
+                den, conv = DERIVED_RATIOS[name]
+                c, ce = self.values.get(conv, 1), self.errors.get(conv, 0)
+                v, jac = _ratio(qs['k39'], qs[den], default=0)
+                e = _propagate(jac, errors)
+                v, e = v / c, e / c
+                if ce:
+                    e = sqrt(e ** 2 + (v * ce / c) ** 2)
+            else:
+                v, jac = qs[name]
+                e = _propagate(jac, errors)
+
+            cols[name] = v
+            cols['{}_err'.format(name)] = e
+        return cols
+
+    def _reduce(self, values, decay_time, pr, matrix):
+        a40 = _iso(values, A40)
+        a38 = _iso(values, A38)
+        a36 = _iso(values, A36)
+        a39 = _iso(values, A39)
+        a37 = _iso(values, A37)
+
+        ic = self.interference_corrections(values, matrix)
+        k38, k39, ca36, ca38 = ic['k38'], ic['k39'], ic['ca36'], ic['ca38']
+
+        # closed form of the iterative atmospheric/chlorine correction
+        m = pr.get('cl3638', 0) * self.lambda_cl36 * asarray(decay_time, dtype=float)
+        m = broadcast_to(m, values.shape[:1])
+        base = _sub(a38, k38, ca38)
+        atm36 = _scale(_sub(_sub(a36, ca36), _scale(base, m)), 1 / (1 - m * self.atm3836))
+        cl38 = _sub(base, _scale(atm36, self.atm3836))
+        cl36 = _scale(cl38, m)
+
+        atm40 = _scale(atm36, self.atm4036)
+        k40 = _scale(k39, pr.get('k4039', 1))
+        rad40 = _sub(a40, atm40, k40)
+
+        f = _ratio(rad40, k39, default=1)
+        rp = _scale(_ratio(rad40, a40, default=0), 100)
+
+        qs = dict(F=f, rad40=rad40, rad40_percent=rp, k39=k39, atm40=atm40,
+                  k40=k40, cl36=cl36, cl38=cl38,
+                  ic_Ar40=_sub(a40, k40), ic_Ar39=k39, ic_Ar38=a38, ic_Ar37=a37, ic_Ar36=atm36)
+        for name in ('ca39', 'k38', 'ca38', 'k37', 'ca37', 'ca36'):
+            qs[name] = ic[name]
+        return qs
+
+    def _parameter_variance(self, values, decay_time, params, names=None):
+        """
+            variance contributed by independent parameter errors, using central
+            differences of the reduction with respect to each parameter
+
+            params: dict of name: (value, error)
+
+            return dict of quantity name: variance (n,)
+        """
+        var = {}
+        for k, (v, e) in params.items():
+            if not e:
+                continue
+
+            h = abs(v) * 1e-6 or 1e-12
+            qs = []
+            for s in (h, -h):
+                pr = dict(self.values)
+                pr[k] = v + s
+                qs.append(self._reduce(values, decay_time, pr, self._build_matrix(pr)))
+
+            for name in names or qs[0].keys():
+                d = (qs[0][name][0] - qs[1][name][0]) / (2 * h) * e
+                var[name] = var.get(name, 0) + d ** 2
+        return var
+
+
+def _check_derived(quantities):
+    quantities = tuple(quantities)
+    for q in quantities:
+        if q not in DERIVED_QUANTITIES:
+            raise ValueError('invalid derived quantity "{}". use one of {}'.format(q, DERIVED_QUANTITIES))
+    return quantities
+
+
+def _iso(values, idx):
+    n = values.shape[0]
+    jac = zeros((n, 5))
+    jac[:, idx] = 1
+    return values[:, idx], jac
+
+
+def _sub(a, *bs):
+    v, jac = a
+    for bv, bj in bs:
+        v = v - bv
+        jac = jac - bj
+    return v, jac
+
+
+def _scale(a, s):
+    s = asarray(s, dtype=float)
+    v, jac = a
+    return v * s, jac * (s[:, None] if s.ndim else s)
+
+
+def _ratio(a, b, default=0):
+    av, aj = a
+    bv, bj = b
+    zero = bv == 0
+    bs = where(zero, 1, bv)
+    with errstate(divide='ignore', invalid='ignore'):
+        r = av / bs
+        jac = (aj - r[:, None] * bj) / bs[:, None]
+    return where(zero, default, r), where(zero[:, None], 0, jac)
+
+
+def _propagate(jac, errors):
+    return sqrt(einsum('ni,ni->n', jac * errors, jac * errors))
+
+
+_compiled = {}
+
+
+def compile_production_ratios(production_ratios, arar_constants=None):
+    """
+        production_ratios: dict of ratio name: ufloat, (value, error) or float
+
+        return an interned CompiledProductionRatios
+    """
+    if production_ratios is None:
+        production_ratios = {}
+    if arar_constants is None:
+        arar_constants = ArArConstants()
+
+    values, errors = {}, {}
+    for k, v in production_ratios.items():
+        if isinstance(v, tuple):
+            v, e = v
+        else:
+            v, e = nominal_value(v), std_dev(v)
+        values[k] = float(v)
+        errors[k] = float(e)
+
+    ac = arar_constants
+    key = (tuple(sorted((k, values[k], errors[k]) for k in values)),
+           ac.k3739_mode.lower(), ac.k3739_v, ac.k3739_e,
+           ac.allow_negative_ca_correction,
+           ac.atm4036_v, ac.atm4038_v, ac.lambda_Cl36_v)
+    try:
+        return _compiled[key]
+    except KeyError:
+        c = CompiledProductionRatios(values, errors, ac)
+        _compiled[key] = c
+        return c
+
+# ============= EOF =============================================
@@ -0,0 +1,167 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    time interpolated blanks and ic factors.
+
+    reference analyses (blanks, airs) are given as timestamps and (m, k) value/error
+    arrays, one column per isotope or detector. every unknown and every column is
+    interpolated in one pass and the result can be written straight into an
+    ``IsotopeTable``
+
+        vs, es = interpolate_references(blank_times, blank_values, blank_errors,
+                                        unknown_times, kind='bracketing_interpolate')
+        apply_blanks(table, vs, es)
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+from numpy import asarray, argsort, searchsorted, clip, where, sqrt, einsum, maximum, abs as nabs
+from numpy.linalg import inv
+# ============= local library imports  ==========================
+from ararpy.fitting import vandermonde, fit_degree
+
+INTERPOLATION_KINDS = ('preceding', 'following', 'bracketing_average', 'bracketing_interpolate',
+                       'average', 'linear', 'parabolic', 'cubic')
+
+
+def interpolate_references(ref_times, ref_values, ref_errors, times, kind='linear'):
+    """
+        ref_times: (m,) timestamps of the reference analyses
+        ref_values, ref_errors: (m, k)
+        times: (n,) timestamps of the unknowns
+        kind: one of INTERPOLATION_KINDS
+
+        preceding/following use the nearest reference before/after each unknown and
+        fall back to the other side at the ends of the sequence.
+        average, linear, parabolic, cubic fit every column against time, weighted by
+        its reference errors. the error is the larger of the fit scatter and the
+        propagated reference errors
+
+        return values, errors as (n, k) arrays
+    """
+    ref_times = asarray(ref_times, dtype=float)
+    if not len(ref_times):
+        raise ValueError('no reference analyses to interpolate from')
+
+    ref_values = asarray(ref_values, dtype=float).reshape(len(ref_times), -1)
+    ref_errors = asarray(ref_errors, dtype=float).reshape(len(ref_times), -1)
+    times = asarray(times, dtype=float)
+
+    if kind not in INTERPOLATION_KINDS:
+        raise ValueError('invalid interpolation "{}". use one of {}'.format(kind, INTERPOLATION_KINDS))
+
+    order = argsort(ref_times, kind='mergesort')
+    ref_times, ref_values, ref_errors = ref_times[order], ref_values[order], ref_errors[order]
+
+    if kind in ('average', 'linear', 'parabolic', 'cubic'):
+        return _fit(ref_times, ref_values, ref_errors, times, fit_degree(kind))
+
+    m = len(ref_times)
+    after = searchsorted(ref_times, times, side='right')
+    pi = clip(after - 1, 0, m - 1)
+    fi = clip(after, 0, m - 1)
+    # unknowns outside the references use the nearest one on both sides
+    pi = where(after == 0, fi, pi)
+    fi = where(after == m, pi, fi)
+
+    if kind == 'preceding':
+        return ref_values[pi], ref_errors[pi]
+    elif kind == 'following':
+        return ref_values[fi], ref_errors[fi]
+
+    if kind == 'bracketing_average':
+        f = where(pi == fi, 0, 0.5)
+    else:
+        dt = ref_times[fi] - ref_times[pi]
+        f = where(dt > 0, (times - ref_times[pi]) / where(dt > 0, dt, 1), 0)
+
+    f = f[:, None]
+    vs = (1 - f) * ref_values[pi] + f * ref_values[fi]
+    es = sqrt(((1 - f) * ref_errors[pi]) ** 2 + (f * ref_errors[fi]) ** 2)
+    return vs, es
+
+
+def _fit(ref_times, ref_values, ref_errors, times, degree):
+    m = len(ref_times)
+    if m < degree + 1:
+        raise ValueError('{} references cannot be fit with degree {}'.format(m, degree))
+
+    # fit in u = (t - t0) / scale so the powers of large timestamps stay small
+    t0 = ref_times[0]
+    scale = nabs(ref_times - t0).max() or 1
+    a = vandermonde((ref_times - t0) / scale, degree)
+
+    # weight every column by its reference errors. a column with a non positive
+    # error is fit unweighted
+    valid = (ref_errors > 0).all(axis=0)
+    w = where(valid, 1 / where(ref_errors > 0, ref_errors, 1) ** 2, 1).T
+
+    # per column g = (A'WA)^-1 and operator h = g A'W, coefficients = h y
+    g = inv(einsum('mp,km,mq->kpq', a, w, a))
+    h = einsum('kpq,mq,km->kpm', g, a, w)
+    coeffs = einsum('kpm,mk->kp', h, ref_values)
+
+    # the larger of the scatter about the fit and the reference errors propagated
+    # through the fit. for a weighted column the scatter is the propagated error
+    # times sqrt(mswd)
+    resid = ref_values - a.dot(coeffs.T)
+    dof = max(m - degree - 1, 1)
+    chi2 = (w.T * resid ** 2).sum(axis=0) / dof
+
+    v = vandermonde((times - t0) / scale, degree)
+    vs = v.dot(coeffs.T)
+    scatter = einsum('np,kpq,nq->nk', v, g, v) * chi2
+    hv = einsum('np,kpm->nkm', v, h)
+    propagated = einsum('nkm,mk->nk', hv ** 2, ref_errors ** 2)
+    return vs, sqrt(maximum(scatter, propagated))
+
+
+# ===============================================================================
+# application
+# ===============================================================================
+def apply_blanks(table, values, errors, isotopes=None):
+    """
+        write interpolated blanks into ``table``
+
+        values, errors: (table.n, len(isotopes)). default isotopes are table.isotopes
+    """
+    cols = _columns(table.isotopes, isotopes)
+    table.blank_values[:, cols] = values
+    table.blank_errors[:, cols] = errors
+
+
+def apply_ic_factors(table, values, errors, detectors):
+    """
+        write interpolated ic factors into ``table``. every isotope measured on one
+        of ``detectors`` gets that detector's ic factor
+
+        values, errors: (table.n, len(detectors))
+    """
+    values = asarray(values, dtype=float)
+    errors = asarray(errors, dtype=float)
+    detectors = list(detectors)
+    for j, det in enumerate(table.detectors):
+        if det in detectors:
+            d = detectors.index(det)
+            table.ic_factor_values[:, j] = values[:, d]
+            table.ic_factor_errors[:, j] = errors[:, d]
+
+
+def _columns(names, subset):
+    if subset is None:
+        return slice(None)
+    return [names.index(k) for k in subset]
+
+# ============= EOF =============================================
@@ -17,7 +17,7 @@
 # ============= enthought library imports =======================
 
 # ============= standard library imports ========================
-from numpy import array
+from numpy import array, asarray, zeros, ones, append, sqrt, abs as nabs
 # ============= local library imports  ==========================
 from uncertainties import ufloat
 from ararpy.arar import age_equation
@@ -95,6 +95,222 @@ def isochron_regressor(xs, xes, ys, yes,
                 yns=yns, ynes=ynes)
     reg.calculate()
     return reg
+
+
+class IncrementalIsochron(object):
+    """
+        inverse isochron (x=39/40, y=36/40) York 2004 regression that keeps its
+        state between updates.
+
+        adding, removing or excluding points only marks the solution dirty. the next
+        solve starts from the previous slope, so a single toggle typically converges
+        in a couple of iterations instead of starting from the OLS slope.
+
+        the york equation can have more than one root. if a warm start ends far from
+        the previous slope (by more than ``recheck_fraction`` of it), changes sign or
+        does not converge, the fit is solved again from the OLS slope and that
+        solution is used, so the result does not depend on the order of updates
+    """
+
+    recheck_fraction = 0.1
+
+    def __init__(self, xs=(), ys=(), xerrs=(), yerrs=(), rs=None, tol=1e-9, max_iterations=200):
+        self.xs = asarray(xs, dtype=float)
+        self.ys = asarray(ys, dtype=float)
+        self.xerrs = asarray(xerrs, dtype=float)
+        self.yerrs = asarray(yerrs, dtype=float)
+        self.rs = zeros(len(self.xs)) if rs is None else asarray(rs, dtype=float)
+        self.included = ones(len(self.xs), dtype=bool)
+
+        self.tol = tol
+        self.max_iterations = max_iterations
+
+        self.slope = None
+        self.intercept = 0
+        self.slope_err = 0
+        self.intercept_err = 0
+        self.mswd = 0
+        self.iterations = 0
+        self._x_bar = 0
+        self._weights = None
+        self._dirty = True
+
+    @classmethod
+    def from_analyses(cls, analyses, **kw):
+        """
+            analyses: objects with ``get_interference_corrected_value``
+        """
+        rows = []
+        for ai in analyses:
+            a39 = ai.get_interference_corrected_value('Ar39')
+            a36 = ai.get_interference_corrected_value('Ar36')
+            a40 = ai.get_interference_corrected_value('Ar40')
+            rows.append(isochron_point(a39, a36, a40))
+
+        xs, ys, xerrs, yerrs, rs = zip(*rows) if rows else ((),) * 5
+        return cls(xs, ys, xerrs, yerrs, rs, **kw)
+
+    # ===============================================================================
+    # updates
+    # ===============================================================================
+    def add(self, x, y, xerr, yerr, r=0):
+        """
+            return index of the new point
+        """
+        self.xs = append(self.xs, x)
+        self.ys = append(self.ys, y)
+        self.xerrs = append(self.xerrs, xerr)
+        self.yerrs = append(self.yerrs, yerr)
+        self.rs = append(self.rs, r)
+        self.included = append(self.included, True)
+        self._dirty = True
+        return len(self.xs) - 1
+
+    def set_excluded(self, idx, excluded=True):
+        if self.included[idx] == excluded:
+            self.included[idx] = not excluded
+            self._dirty = True
+
+    def remove(self, idx):
+        self.set_excluded(idx)
+
+    # ===============================================================================
+    # results
+    # ===============================================================================
+    def solve(self):
+        if self._dirty:
+            self._solve()
+            self._dirty = False
+        return self.slope, self.intercept
+
+    @property
+    def x_intercept(self):
+        """
+            return x intercept (39Ar/40Ar*) and its error
+        """
+        self.solve()
+        b, a = self.slope, self.intercept
+        if not b or not a:
+            return 0, 0
+
+        xint = -a / b
+        cov = -self._x_bar * self.slope_err ** 2
+        var = xint ** 2 * ((self.intercept_err / a) ** 2 + (self.slope_err / b) ** 2 - 2 * cov / (a * b))
+        return xint, sqrt(max(var, 0))
+
+    def get_age(self, j, arar_constants=None):
+        xint, xe = self.x_intercept
+        if xint <= 0:
+            return ufloat(0, 0)
+        return age_equation(j, ufloat(xint, xe) ** -1, arar_constants=arar_constants)
+
+    def get_trapped_4036(self):
+        self.solve()
+        if not self.intercept:
+            return ufloat(0, 0)
+        return ufloat(self.intercept, self.intercept_err) ** -1
+
+    def _solve(self):
+        sel = self.included
+        x, y = self.xs[sel], self.ys[sel]
+        n = len(x)
+        if n < 2:
+            self.slope, self.intercept = 0, 0
+            self.slope_err = self.intercept_err = self.mswd = 0
+            self.iterations = 0
+            return
+
+        wx = 1 / self.xerrs[sel] ** 2
+        wy = 1 / self.yerrs[sel] ** 2
+        r = self.rs[sel]
+        alpha = sqrt(wx * wy)
+
+        def york_step(b):
+            w = wx * wy / (wx + b * b * wy - 2 * b * r * alpha)
+            sw = w.sum()
+            xb = (w * x).sum() / sw
+            yb = (w * y).sum() / sw
+            u = x - xb
+            v = y - yb
+            beta = w * (u / wy + b * v / wx - (b * u + v) * r / alpha)
+            return (w * beta * v).sum() / (w * beta * u).sum(), w, sw, xb, yb, beta
+
+        # cold start from ordinary least squares
+        dx = x - x.mean()
+        ols = (dx * (y - y.mean())).sum() / (dx * dx).sum()
+
+        pb = self.slope
+        if pb:
+            b, it, converged = self._iterate(york_step, pb)
+            if not converged or b * pb <= 0 or nabs(b - pb) > self.recheck_fraction * nabs(pb):
+                cb, cit, cconverged = self._iterate(york_step, ols)
+                it += cit
+                if cconverged or not converged:
+                    b = cb
+        else:
+            b, it, _ = self._iterate(york_step, ols)
+
+        # weights, centroid and errors at the converged slope
+        _, w, sw, xb, yb, beta = york_step(b)
+        a = yb - b * xb
+
+        # York 2004 errors
+        xadj = xb + beta
+        xa_bar = (w * xadj).sum() / sw
+        ua = xadj - xa_bar
+        sb = (w * ua * ua).sum() ** -0.5
+        sa = (1 / sw + xa_bar ** 2 * sb ** 2) ** 0.5
+
+        self.slope, self.intercept = b, a
+        self.slope_err, self.intercept_err = sb, sa
+        self.mswd = (w * (y - b * x - a) ** 2).sum() / (n - 2) if n > 2 else 0
+        self.iterations = it
+        self._x_bar = xa_bar
+        self._weights = w
+
+    def _iterate(self, york_step, b):
+        """
+            secant steps on h(b) = york(b) - b starting from ``b``. the derivative
+            estimate is local to one solve
+
+            return slope, iterations, converged
+        """
+        it = 0
+        pb = ph = dh = None
+        while 1:
+            it += 1
+            nb = york_step(b)[0]
+            h = nb - b
+            if pb is not None and b != pb and h != ph:
+                dh = (h - ph) / (b - pb)
+
+            pb, ph = b, h
+            if dh is not None and dh < 0:
+                nb = b - h / dh
+
+            converged = nabs(nb - b) <= self.tol * max(nabs(nb), 1e-300)
+            b = nb
+            if converged or it >= self.max_iterations:
+                return b, it, converged
+
+
+def isochron_point(a39, a36, a40):
+    """
+        a39, a36, a40: ufloats
+
+        return x, y, xerr, yerr and the error correlation of x=39/40, y=36/40 from the
+        shared 40Ar denominator
+    """
+    def rel(v):
+        return v.std_dev / v.nominal_value if v.nominal_value else 0
+
+    x = a39 / a40
+    y = a36 / a40
+    d = rel(a40) ** 2
+    den = ((rel(a39) ** 2 + d) * (rel(a36) ** 2 + d)) ** 0.5
+    r = d / den if den else 0
+    return x.nominal_value, y.nominal_value, x.std_dev, y.std_dev, r
+
 # ============= EOF =============================================
 
 
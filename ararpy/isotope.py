@@ -38,15 +38,17 @@ from traitsui.api import View, UItem, Item, HGroup, VGroup
 
 # ============= enthought library imports =======================
 from traits.api import HasTraits, Str, Float, Property, Instance, \
-    Array, String, Either, Dict, cached_property, Event, List, Bool, Int
+    Array, String, Either, Dict, cached_property, Event, List, Bool, Int, Any, on_trait_change
 # ============= standard library imports ========================
 from uncertainties import ufloat, Variable, AffineScalarFunc
-from numpy import array, Inf, polyfit
+from numpy import array, ones
 from binascii import hexlify
 from itertools import izip
 import struct
-import re
 # ============= local library imports  ==========================
+from ararpy.fit_blocks import compile_fit_blocks, is_fit_block, FitBlockSpec
+from ararpy.fitting import batch_slopes
+from ararpy.profiling import profile_stage
 FITS = ['linear', 'parabolic', 'cubic']
 
 
@@ -78,7 +80,7 @@ class BaseMeasurement(HasTraits):
     endianness = '>'
     reverse_unpack = False
     time_zero_offset = Float
-    offset_xs = Property
+    offset_xs = Property(depends_on='xs, time_zero_offset')
 
     # __slots__ = ['xs', 'ys', 'n', 'name', 'mass', 'detector', 'time_zero_offset']
 
@@ -101,6 +103,7 @@ class BaseMeasurement(HasTraits):
             txt = hexlify(txt)
         return txt
 
+    @profile_stage('isotope.unpack_data')
     def unpack_data(self, blob):
         try:
             xs, ys = self._unpack_blob(blob)
@@ -134,6 +137,7 @@ class BaseMeasurement(HasTraits):
     def _set_n(self, v):
         self._n=v
 
+    @cached_property
     def _get_offset_xs(self):
         return self.xs - self.time_zero_offset
 
@@ -145,7 +149,7 @@ class BaseMeasurement(HasTraits):
                 xs=xs[-n:]
                 ys=ys[-n:]
 
-            return polyfit(xs, ys, 1)[0]
+            return batch_slopes(xs[None], ys[None], ones((1, len(xs)), dtype=bool))[0]
 
 
 class IsotopicMeasurement(BaseMeasurement):
@@ -167,6 +171,8 @@ class IsotopicMeasurement(BaseMeasurement):
     error_type = String('SEM')
 
     filter_outliers_dict = Dict
+    # bool array of retained points, set in bulk by ararpy.fitting.filter_measurements
+    outlier_mask = Any
 
     regressor = Property(depends_on='fit, time_zero_offset, dirty')
     # regressor = Property(depends_on='fit, dirty, error_type')
@@ -179,6 +185,7 @@ class IsotopicMeasurement(BaseMeasurement):
 
     _oerror = None
     _ovalue = None
+    _fit_block_spec = None
 
     # __slots__ = ['_fit', '_value', '_error', 'filter_outliers_dict',
     # 'include_baseline_error',
@@ -218,26 +225,10 @@ class IsotopicMeasurement(BaseMeasurement):
             fit, error = fit
             self.error_type = error
 
-        if re.match(r'\([\w\d\s,]*\)', fit):
-            fs = []
-            for m in re.finditer(r'\([\w\d\s,]*\)', fit):
-                a = m.group(0)
-                a = a[1:-1]
-                s, e, f = map(str.strip, a.split(','))
-
-                if s is '':
-                    s = -1
-                else:
-                    s = int(s)
-
-                if e is '':
-                    e = Inf
-                else:
-                    e = int(e)
-
-                fs.append((s, e, f))
-
-            self.fit_blocks = fs
+        if is_fit_block(fit):
+            spec = compile_fit_blocks(fit)
+            self.fit_blocks = spec.blocks
+            self._fit_block_spec = spec
         else:
             self.fit = fit
 
@@ -250,12 +241,14 @@ class IsotopicMeasurement(BaseMeasurement):
 
     def get_fit_block(self, cnt):
         if self.fit_blocks:
-            if cnt < 0:
-                return self.fit_blocks[-1][2]
-            else:
-                for s, e, f in self.fit_blocks:
-                    if s < cnt < e:
-                        return f
+            spec = self._fit_block_spec
+            if spec is None:
+                self._fit_block_spec = spec = FitBlockSpec(self.fit_blocks)
+            return spec.lookup(cnt)
+
+    @on_trait_change('fit_blocks, fit_blocks_items')
+    def _invalidate_fit_block_spec(self):
+        self._fit_block_spec = None
 
     def set_filter_outliers_dict(self, filter_outliers=True, iterations=1, std_devs=2, notify=True):
         self.filter_outliers_dict={'filter_outliers':filter_outliers,
@@ -263,6 +256,10 @@ class IsotopicMeasurement(BaseMeasurement):
                                    'std_devs':std_devs}
         self.dirty=notify
 
+    @on_trait_change('xs, ys, filter_outliers_dict, fit')
+    def _invalidate_outlier_mask(self):
+        self.outlier_mask = None
+
     def set_fit(self, fit, notify=True):
         if fit is not None:
             if isinstance(fit, (int, str)):
@@ -349,6 +346,7 @@ class IsotopicMeasurement(BaseMeasurement):
         return reg
 
     @cached_property
+    @profile_stage('isotope.intercept_fit')
     def _get_regressor(self):
         if 'average' in self.fit.lower():
             reg = self._mean_regressor_factory()
@@ -443,6 +441,7 @@ class BaseIsotope(IsotopicMeasurement):
     baseline = Instance(Baseline, ())
     baseline_fit_abbreviation = Property(depends_on='baseline:fit')
 
+    @profile_stage('isotope.baseline_correction')
     def get_baseline_corrected_value(self):
         b = self.baseline.uvalue
         if not self.include_baseline_error:
@@ -484,9 +483,10 @@ class Isotope(BaseIsotope):
     #                                'age_error_component']
 
     def get_filtered_data(self):
-        return self.regressor.calculate_filtered_data()
+        mask = self.outlier_mask
+        if mask is not None and len(mask) == len(self.xs):
+            return self.xs[mask], self.ys[mask]
 
-    def get_filtered_data(self):
         return self.regressor.calculate_filtered_data()
 
     def revert_user_defined(self):
@@ -506,6 +506,7 @@ class Isotope(BaseIsotope):
         else:
             return ufloat(0, 0, tag=self.name)
 
+    @profile_stage('isotope.intensity')
     def get_intensity(self):
         """
             return the discrimination and ic_factor corrected value
@@ -528,6 +529,7 @@ class Isotope(BaseIsotope):
     def get_ic_corrected_value(self):
         return self.get_non_detector_corrected_value() * (self.ic_factor or 1.0)
 
+    @profile_stage('isotope.blank_correction')
     def get_non_detector_corrected_value(self):
         v = self.get_baseline_corrected_value()
 
@@ -0,0 +1,361 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+from numpy import zeros, ones, full, empty, asarray, where, sqrt, char
+from uncertainties import ufloat
+# ============= local library imports  ==========================
+
+FIT_NAMES = ['average', 'linear', 'parabolic', 'cubic']
+
+# (value, error) column pairs held by an IsotopeTable. ic_factor and
+# discrimination default to 1+/-0, everything else to 0+/-0
+MEASUREMENTS = ('signal', 'baseline', 'blank', 'background',
+                'ic_factor', 'discrimination', 'interference_corrected')
+UNITY_MEASUREMENTS = ('ic_factor', 'discrimination')
+
+
+def _product(v1, e1, v2, e2):
+    v = v1 * v2
+    return v, sqrt((e1 * v2) ** 2 + (e2 * v1) ** 2)
+
+
+class IsotopeTable(object):
+    """
+        columnar storage for the isotopes of many analyses.
+
+        every measurement is held as a pair of (n_analyses, n_isotopes) float arrays
+        e.g. ``signal_values``, ``signal_errors``, ``blank_values``, ``blank_errors``.
+        bulk methods (``baseline_corrected``, ``intensity``, ...) return (values, errors)
+        arrays, ``get(row, name)`` returns a lightweight ``IsotopeView`` that exposes
+        the ``Isotope`` api for a single cell.
+    """
+
+    def __init__(self, n, isotopes, detectors=None):
+        self.isotopes = list(isotopes)
+        self.n = n
+        shape = (n, len(self.isotopes))
+
+        for attr in MEASUREMENTS:
+            vs = ones(shape) if attr in UNITY_MEASUREMENTS else zeros(shape)
+            setattr(self, '{}_values'.format(attr), vs)
+            setattr(self, '{}_errors'.format(attr), zeros(shape))
+
+        self.fits = zeros(shape, dtype='int8')
+        self.fit_names = list(FIT_NAMES)
+
+        self.include_baseline_error = zeros(shape, dtype=bool)
+        self.correct_for_blank = ones(shape, dtype=bool)
+
+        if detectors is None:
+            detectors = [''] * len(self.isotopes)
+        self.detectors = asarray(detectors, dtype=object)
+
+        # attr: (n, n_isotopes) object array of ufloats, built on first access
+        self._uvalues = {}
+
+    @classmethod
+    def from_isotopes(cls, analyses, isotopes=None):
+        """
+            analyses: list of dicts of ``Isotope`` objects keyed by isotope name
+
+            return an IsotopeTable populated from the current state of the isotopes
+        """
+        if isotopes is None:
+            isotopes = sorted(analyses[0].keys(), reverse=True)
+
+        ref = analyses[0]
+        table = cls(len(analyses), isotopes,
+                    detectors=[ref[k].detector for k in isotopes])
+
+        for i, isos in enumerate(analyses):
+            for j, k in enumerate(isotopes):
+                iso = isos[k]
+                table.set_measurement(i, j, 'signal', iso.value, iso.error)
+                table.set_measurement(i, j, 'baseline', iso.baseline.value, iso.baseline.error)
+                table.set_measurement(i, j, 'blank', iso.blank.value, iso.blank.error)
+                if iso.background:
+                    table.set_measurement(i, j, 'background', iso.background.value, iso.background.error)
+                for attr in ('ic_factor', 'discrimination', 'interference_corrected_value'):
+                    v = getattr(iso, attr)
+                    if v is not None:
+                        table.set_measurement(i, j, attr.replace('_value', ''),
+                                              v.nominal_value, v.std_dev)
+
+                table.set_fit(i, j, iso.fit)
+                table.include_baseline_error[i, j] = iso.include_baseline_error
+                table.correct_for_blank[i, j] = iso.correct_for_blank
+        return table
+
+    def index(self, name):
+        return self.isotopes.index(name)
+
+    def get(self, row, name):
+        return IsotopeView(self, row, self.index(name))
+
+    def row(self, row):
+        return dict((k, IsotopeView(self, row, j)) for j, k in enumerate(self.isotopes))
+
+    def set_measurement(self, row, col, attr, v, e):
+        getattr(self, '{}_values'.format(attr))[row, col] = v
+        getattr(self, '{}_errors'.format(attr))[row, col] = e
+
+    def get_measurement(self, row, col, attr):
+        return (getattr(self, '{}_values'.format(attr))[row, col],
+                getattr(self, '{}_errors'.format(attr))[row, col])
+
+    def get_uvalue(self, row, col, attr, tag=None):
+        """
+            one ufloat per cell, so a cell used in several terms stays correlated with
+            itself. a new ufloat is made only when the cell's value or error changed
+        """
+        v, e = self.get_measurement(row, col, attr)
+        try:
+            us = self._uvalues[attr]
+        except KeyError:
+            us = self._uvalues[attr] = empty((self.n, len(self.isotopes)), dtype=object)
+
+        u = us[row, col]
+        if u is None or u.nominal_value != v or u.std_dev != e:
+            u = us[row, col] = ufloat(v, e, tag=tag)
+        return u
+
+    def set_fit(self, row, col, fit):
+        fit = (fit or 'linear').lower()
+        try:
+            idx = self.fit_names.index(fit)
+        except ValueError:
+            idx = len(self.fit_names)
+            self.fit_names.append(fit)
+        self.fits[row, col] = idx
+
+    def get_fit(self, row, col):
+        return self.fit_names[self.fits[row, col]]
+
+    # ===============================================================================
+    # bulk corrections. errors are propagated assuming each column is independent,
+    # which is the same assumption made by the per object Isotope arithmetic
+    # ===============================================================================
+    def baseline_corrected(self):
+        v = self.signal_values - self.baseline_values
+        be = where(self.include_baseline_error, self.baseline_errors, 0)
+        return v, sqrt(self.signal_errors ** 2 + be ** 2)
+
+    def non_detector_corrected(self):
+        v, e = self.baseline_corrected()
+
+        # faraday blank handling mirrors Isotope.get_non_detector_corrected_value
+        mask = self.correct_for_blank & ~self._faraday_mask()
+        v = v - where(mask, self.blank_values, 0)
+        e = sqrt(e ** 2 + where(mask, self.blank_errors, 0) ** 2)
+
+        v = v - self.background_values
+        e = sqrt(e ** 2 + self.background_errors ** 2)
+        return v, e
+
+    def disc_corrected(self):
+        v, e = self.non_detector_corrected()
+        return _product(v, e, self.discrimination_values, self.discrimination_errors)
+
+    def ic_corrected(self):
+        v, e = self.non_detector_corrected()
+        return _product(v, e, self.ic_factor_values, self.ic_factor_errors)
+
+    def intensity(self):
+        v, e = self.disc_corrected()
+        v, e = _product(v, e, self.ic_factor_values, self.ic_factor_errors)
+
+        mask = self._faraday_mask()
+        v = v - where(mask, self.blank_values, 0)
+        e = sqrt(e ** 2 + where(mask, self.blank_errors, 0) ** 2)
+        return v, e
+
+    def _faraday_mask(self):
+        dets = char.lower(self.detectors.astype(str))
+        return full((self.n, len(self.isotopes)), dets == 'faraday')
+
+
+class MeasurementView(object):
+    """
+        read/write view of one (value, error) pair of an IsotopeTable cell
+    """
+    __slots__ = ('_table', '_row', '_col', '_attr')
+
+    def __init__(self, table, row, col, attr):
+        self._table = table
+        self._row = row
+        self._col = col
+        self._attr = attr
+
+    @property
+    def value(self):
+        return self._table.get_measurement(self._row, self._col, self._attr)[0]
+
+    @property
+    def error(self):
+        return self._table.get_measurement(self._row, self._col, self._attr)[1]
+
+    @property
+    def uvalue(self):
+        return self._table.get_uvalue(self._row, self._col, self._attr)
+
+    @property
+    def fit(self):
+        return self._table.get_fit(self._row, self._col)
+
+    def set_uvalue(self, v):
+        if isinstance(v, tuple):
+            v, e = v
+        else:
+            v, e = v.nominal_value, v.std_dev
+        self._table.set_measurement(self._row, self._col, self._attr, v, e)
+
+    def __nonzero__(self):
+        return True
+
+    __bool__ = __nonzero__
+
+
+class IsotopeView(MeasurementView):
+    """
+        thin stand in for ``Isotope`` backed by a row/column of an IsotopeTable
+    """
+    __slots__ = ()
+
+    def __init__(self, table, row, col):
+        super(IsotopeView, self).__init__(table, row, col, 'signal')
+
+    @property
+    def name(self):
+        return self._table.isotopes[self._col]
+
+    @property
+    def detector(self):
+        return self._table.detectors[self._col]
+
+    @property
+    def uvalue(self):
+        return self._table.get_uvalue(self._row, self._col, 'signal', tag=self.name)
+
+    @property
+    def include_baseline_error(self):
+        return bool(self._table.include_baseline_error[self._row, self._col])
+
+    @property
+    def correct_for_blank(self):
+        return bool(self._table.correct_for_blank[self._row, self._col])
+
+    @property
+    def baseline(self):
+        return MeasurementView(self._table, self._row, self._col, 'baseline')
+
+    @property
+    def blank(self):
+        return MeasurementView(self._table, self._row, self._col, 'blank')
+
+    @property
+    def background(self):
+        return MeasurementView(self._table, self._row, self._col, 'background')
+
+    @property
+    def ic_factor(self):
+        return self._uattr('ic_factor')
+
+    @property
+    def discrimination(self):
+        return self._uattr('discrimination')
+
+    @property
+    def interference_corrected_value(self):
+        return self._uattr('interference_corrected')
+
+    def set_blank(self, v, e):
+        self._table.set_measurement(self._row, self._col, 'blank', v, e)
+
+    def set_baseline(self, v, e):
+        self._table.set_measurement(self._row, self._col, 'baseline', v, e)
+
+    def set_fit(self, fit, notify=True):
+        self._table.set_fit(self._row, self._col, fit)
+
+    def get_interference_corrected_value(self):
+        return self.interference_corrected_value
+
+    def get_baseline_corrected_value(self):
+        b = self.baseline.uvalue
+        if not self.include_baseline_error:
+            nv = self.uvalue - b.nominal_value
+            return ufloat(nv.nominal_value, nv.std_dev, tag=self.name)
+        else:
+            return self.uvalue - b
+
+    def get_non_detector_corrected_value(self):
+        v = self.get_baseline_corrected_value()
+        if self.correct_for_blank and self.detector.lower() != 'faraday':
+            v = v - self.blank.uvalue
+
+        return v - self.background.uvalue
+
+    def get_disc_corrected_value(self):
+        return self.get_non_detector_corrected_value() * self.discrimination
+
+    def get_ic_corrected_value(self):
+        return self.get_non_detector_corrected_value() * self.ic_factor
+
+    def get_intensity(self):
+        v = self.get_disc_corrected_value() * self.ic_factor
+        if self.detector.lower() == 'faraday':
+            v = v - self.blank.uvalue
+        return v
+
+    def _uattr(self, attr):
+        return self._table.get_uvalue(self._row, self._col, attr)
+
+    # ===============================================================================
+    # arthmetic
+    # ===============================================================================
+    def __add__(self, a):
+        return self.uvalue + a
+
+    def __radd__(self, a):
+        return self.__add__(a)
+
+    def __mul__(self, a):
+        return self.uvalue * a
+
+    def __rmul__(self, a):
+        return self.__mul__(a)
+
+    def __sub__(self, a):
+        return self.uvalue - a
+
+    def __rsub__(self, a):
+        return a - self.uvalue
+
+    def __div__(self, a):
+        return self.uvalue / a
+
+    def __rdiv__(self, a):
+        return a / self.uvalue
+
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+
+    def __str__(self):
+        return '{} {}'.format(self.name, self.get_baseline_corrected_value())
+
+# ============= EOF =============================================
@@ -0,0 +1,239 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    loop kernels with two backends
+
+        numpy: vectorized implementations
+        numba: explicit loops compiled with numba.njit. only available if numba is
+               installed
+        python: the same loops run as plain python. slow, the reference in
+               ``check_conformance`` when numba is missing
+
+    the backend is chosen at runtime with ``set_backend`` or the ARARPY_KERNELS
+    environment variable (numpy, numba, python or auto). auto uses numba when
+    available
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import os
+
+from numpy import asarray, zeros, where, arange, cumsum, concatenate, minimum, maximum
+
+try:
+    import numba
+except ImportError:
+    numba = None
+# ============= local library imports  ==========================
+
+BACKENDS = ('auto', 'numpy', 'numba', 'python')
+
+
+# ===============================================================================
+# loop kernels. written in the numba subset of python
+# ===============================================================================
+def _plateau_loop(ages, errors, signals, excluded, nsteps, overlap_sigma, gas_fraction):
+    n = ages.shape[0]
+    total = 0.
+    for i in range(n):
+        if not excluded[i]:
+            total += signals[i]
+    if not total:
+        return -1, -1
+
+    best_start = -1
+    best_end = -1
+    best_span = -1
+    for start in range(n):
+        if excluded[start]:
+            continue
+
+        potential_end = -1
+        released = 0.
+        ok = True
+        for end in range(start, n):
+            if not ok:
+                break
+
+            # overlap of the new step with every step already in the window
+            ae = ages[end]
+            ee = errors[end] * overlap_sigma
+            for k in range(start, end):
+                ak = ages[k]
+                ek = errors[k] * overlap_sigma
+                if not (ak - ek < ae + ee and ak + ek > ae - ee):
+                    ok = False
+                    break
+
+            if not excluded[end]:
+                released += signals[end]
+            else:
+                continue
+
+            if end - start < nsteps:
+                continue
+            if not ok:
+                break
+            if released / total >= gas_fraction / 100.:
+                potential_end = end
+
+        if potential_end > 0:
+            span = potential_end - start
+            if span > best_span:
+                best_span = span
+                best_start = start
+                best_end = potential_end
+
+    return best_start, best_end
+
+
+# ===============================================================================
+# numpy kernels
+# ===============================================================================
+def _plateau_numpy(ages, errors, signals, excluded, nsteps, overlap_sigma, gas_fraction):
+    n = ages.shape[0]
+    if not n:
+        return -1, -1
+
+    e = errors * overlap_sigma
+    lo, hi = ages - e, ages + e
+    m = (lo[:, None] < hi[None, :]) & (hi[:, None] > lo[None, :])
+
+    # largest end for which every pair in start..end overlaps
+    upper = ~m & (arange(n)[None, :] > arange(n)[:, None])
+    first_bad = where(upper.any(axis=1), upper.argmax(axis=1), n)
+    max_end = minimum.accumulate(first_bad[::-1])[::-1] - 1
+
+    # last included step at or before each index
+    idx = arange(n)
+    last_included = maximum.accumulate(where(~excluded, idx, -1))
+
+    starts = idx
+    ends = last_included[max_end]
+    sig = where(excluded, 0, signals)
+    total = sig.sum()
+    if not total:
+        return -1, -1
+
+    c = concatenate(([0], cumsum(sig)))
+    released = c[ends + 1] - c[starts]
+
+    ok = ~excluded & (ends - starts >= nsteps) & (ends > 0) & \
+        (released / total >= gas_fraction / 100.)
+    if not ok.any():
+        return -1, -1
+
+    spans = where(ok, ends - starts, -1)
+    best = spans.argmax()
+    return int(starts[best]), int(ends[best])
+
+
+LOOP_KERNELS = {'plateau': _plateau_loop}
+
+NUMPY_KERNELS = {'plateau': _plateau_numpy}
+
+
+# ===============================================================================
+# backend selection
+# ===============================================================================
+_backend = None
+_compiled = {}
+
+
+def set_backend(name):
+    """
+        name: auto, numpy, numba or python
+    """
+    global _backend
+    name = name.lower()
+    if name not in BACKENDS:
+        raise ValueError('invalid kernel backend "{}". use one of {}'.format(name, BACKENDS))
+    if name == 'auto':
+        name = 'numba' if numba is not None else 'numpy'
+    elif name == 'numba' and numba is None:
+        raise ImportError('numba is required for the numba kernel backend')
+    _backend = name
+
+
+def get_backend():
+    if _backend is None:
+        set_backend(os.environ.get('ARARPY_KERNELS', 'auto'))
+    return _backend
+
+
+def get_kernel(name, backend=None):
+    backend = backend or get_backend()
+    if backend == 'numpy':
+        return NUMPY_KERNELS[name]
+    elif backend == 'numba':
+        try:
+            return _compiled[name]
+        except KeyError:
+            k = _compiled[name] = numba.njit(cache=True)(LOOP_KERNELS[name])
+            return k
+    elif backend == 'python':
+        return LOOP_KERNELS[name]
+    raise ValueError('invalid kernel backend "{}"'.format(backend))
+
+
+# ===============================================================================
+# public
+# ===============================================================================
+def find_plateau(ages, errors, signals, excluded=None, nsteps=3, overlap_sigma=2, gas_fraction=50,
+                 backend=None):
+    """
+        fleck 1977 plateau search, same rules as ``Plateau.find_plateaus``
+
+        return (start, end) of the longest plateau or None
+    """
+    ages = asarray(ages, dtype=float)
+    n = ages.shape[0]
+    ex = zeros(n, dtype=bool)
+    if excluded is not None and len(excluded):
+        ex[asarray(excluded, dtype=int)] = True
+
+    s, e = get_kernel('plateau', backend)(ages, asarray(errors, dtype=float),
+                                          asarray(signals, dtype=float), ex,
+                                          int(nsteps), float(overlap_sigma), float(gas_fraction))
+    if s >= 0:
+        return int(s), int(e)
+
+
+def check_conformance(trials=50, seed=0):
+    """
+        run the numpy kernels and the loop kernels (compiled with numba if available)
+        on random inputs and raise AssertionError on any difference
+
+        return dict of kernel name: max abs difference
+    """
+    from numpy.random import RandomState
+    rs = RandomState(seed)
+    loop = 'numba' if numba is not None else 'python'
+    diffs = {}
+
+    for _ in range(trials):
+        k = rs.randint(1, 15)
+        ages = rs.normal(10, 0.2, k)
+        errors = rs.uniform(0.05, 0.3, k)
+        signals = rs.uniform(1, 5, k)
+        excluded = [i for i in range(k) if rs.uniform() < 0.1]
+        nsteps = rs.randint(0, 4)
+        a = find_plateau(ages, errors, signals, excluded, nsteps, backend='numpy')
+        b = find_plateau(ages, errors, signals, excluded, nsteps, backend=loop)
+        assert a == b, 'plateau kernels differ {} != {}'.format(a, b)
+    diffs['plateau'] = 0
+    return diffs
+
+# ============= EOF =============================================
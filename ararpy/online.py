@@ -0,0 +1,201 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+from collections import deque
+
+from numpy import zeros, arange, dot, array, asarray, abs as nabs
+from numpy.linalg import inv, LinAlgError
+from numpy.polynomial.polynomial import polyadd, polymul
+# ============= local library imports  ==========================
+from ararpy.fitting import fit_degree
+
+
+class OnlineRegressor(object):
+    """
+        incremental least squares fit for use while a measurement is in progress.
+
+        keeps the running normal equation sums (sum u^k and sum u^k*y) so adding a
+        point is O(degree) and the intercept/error are solved from a (degree+1)^2
+        system on demand. if ``window`` is set only the last ``window`` points are
+        used, i.e. the same points as ``BaseMeasurement.get_slope(window)``
+
+        the sums are kept in u = (x - x0) / scale, centered and scaled on the retained
+        points, and are rebuilt from those points once the window has slid by a full
+        window or x has moved well outside the scale, so round off does not build up
+
+        reg = OnlineRegressor('linear')
+        for x, y in cycles:
+            reg.add(x, y)
+            display(reg.predict(0), reg.predict_error(0))
+    """
+
+    def __init__(self, fit='linear', window=None, error_type='SEM', time_zero_offset=0):
+        self.fit = fit
+        self.degree = fit_degree(fit)
+        self.window = window
+        self.error_type = error_type
+        self.time_zero_offset = time_zero_offset
+        self.reset()
+
+    @classmethod
+    def from_measurement(cls, m, window=None):
+        """
+            seed a regressor with the cycles already collected by an IsotopicMeasurement
+        """
+        reg = cls(m.fit or 'linear', window=window,
+                  error_type=m.error_type,
+                  time_zero_offset=m.time_zero_offset)
+        for x, y in zip(m.xs, m.ys):
+            reg.add(x, y)
+        return reg
+
+    def reset(self):
+        d = self.degree
+        self._sx = zeros(2 * d + 1)
+        self._sxy = zeros(d + 1)
+        self._x0 = None
+        self._y0 = 0
+        self._scale = 1
+        self._removed = 0
+        self._points = deque()
+        self._coefficients = None
+        self._covariance = None
+
+    @property
+    def n(self):
+        return len(self._points)
+
+    def add(self, x, y):
+        x = float(x) - self.time_zero_offset
+        y = float(y)
+        if self._x0 is None:
+            self._x0, self._y0 = x, y
+
+        self._points.append((x, y))
+        self._update(x, y, 1)
+
+        if self.window and len(self._points) > self.window:
+            ox, oy = self._points.popleft()
+            self._update(ox, oy, -1)
+            self._removed += 1
+
+        if self._removed >= (self.window or 1) or abs(x - self._x0) > 2 * self._scale:
+            self._rebuild()
+
+    def _rebuild(self):
+        xs, ys = self._arrays()
+        self._x0 = xs.mean()
+        self._y0 = ys.mean()
+        self._scale = nabs(xs - self._x0).max() or 1
+        self._removed = 0
+
+        p = self._u(xs)[:, None] ** arange(2 * self.degree + 1)
+        self._sx = p.sum(axis=0)
+        self._sxy = dot(ys - self._y0, p[:, :self.degree + 1])
+        self._coefficients = None
+
+    def _update(self, x, y, sign):
+        p = self._u(x) ** arange(2 * self.degree + 1)
+        self._sx += sign * p
+        self._sxy += sign * p[:self.degree + 1] * (y - self._y0)
+        self._coefficients = None
+
+    def _u(self, x):
+        return (asarray(x, dtype=float) - self._x0) / self._scale
+
+    def _arrays(self):
+        pts = array(self._points, dtype=float).reshape(-1, 2)
+        return pts[:, 0], pts[:, 1]
+
+    # ===============================================================================
+    # results
+    # ===============================================================================
+    @property
+    def coefficients(self):
+        """
+            polynomial coefficients in increasing powers of x
+        """
+        if self._coefficients is None:
+            self._solve()
+
+        # expand y0 + sum c_k u^k with u = (x - x0) / scale
+        d = self.degree
+        if self.n <= d:
+            return zeros(d + 1)
+
+        u = array([-(self._x0 or 0), 1.]) / self._scale
+        out = zeros(1)
+        for ck in self._coefficients[::-1]:
+            out = polyadd(polymul(out, u), [ck])
+        out[0] += self._y0
+        return out
+
+    @property
+    def slope(self):
+        if self.degree < 1:
+            return 0
+        return self.coefficients[1]
+
+    def predict(self, x):
+        if self._coefficients is None:
+            self._solve()
+
+        if self.n <= self.degree:
+            return 0
+        return dot(self._coefficients, self._u(x) ** arange(self.degree + 1)) + self._y0
+
+    def predict_error(self, x):
+        if self._coefficients is None:
+            self._solve()
+
+        cov = self._covariance
+        if cov is None:
+            return 0
+
+        p = self._u(x) ** arange(self.degree + 1)
+        return dot(p, dot(cov, p)) ** 0.5
+
+    def _solve(self):
+        d = self.degree
+        n = self.n
+        self._covariance = None
+        if n <= d:
+            self._coefficients = zeros(d + 1)
+            return
+
+        powers = arange(d + 1)
+        a = self._sx[powers[:, None] + powers]
+        try:
+            ai = inv(a)
+        except LinAlgError:
+            self._coefficients = zeros(d + 1)
+            return
+
+        c = self._coefficients = dot(ai, self._sxy)
+
+        dof = n - d - 1
+        if dof > 0:
+            # residuals of the retained points. differencing the sums loses precision
+            xs, ys = self._arrays()
+            r = ys - self._y0 - dot(self._u(xs)[:, None] ** powers, c)
+            cov = dot(r, r) / dof * ai
+            if d == 0 and self.error_type == 'SD':
+                cov = cov * n
+            self._covariance = cov
+
+# ============= EOF =============================================
@@ -0,0 +1,227 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    streaming reduction of raw analyses.
+
+    analyses are consumed from any iterable in fixed size chunks and each chunk is
+    run through decode -> fit -> correct -> F -> age with array operations, so memory
+    use depends on ``chunk_size`` and not on the number of analyses.
+
+    a raw analysis is a dict
+
+        identifier: str
+        decay_time: float
+        j: (value, error)
+        isotopes: {'Ar40': signal, ...}     signal is a packed blob or (xs, ys)
+        baselines: {'Ar40': baseline, ...}  optional. blob, (xs, ys) or (value, error)
+        blanks: {'Ar40': (value, error)}    optional
+        fits: {'Ar40': 'linear', ...}       optional, default ``default_fit``
+        baseline_fits: {'Ar40': 'average'}  optional, default ``default_baseline_fit``
+        discrimination: {'Ar40': (value, error)}  optional, default 1
+        ic_factors: {'Ar40': (value, error)}      optional, default 1
+        decay_factors: {'Ar37': value, ...}  optional (value, error) or value, default 1.
+            e.g. ``arar.calculate_decay_factor`` for Ar37 and Ar39
+
+    intercepts are corrected as ``Isotope.get_intensity`` (baseline, blank, then
+    discrimination and ic factor) and then multiplied by the decay factors, so the
+    values passed to ``calculate_F`` are decay corrected
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+from itertools import islice
+
+from numpy import frombuffer, zeros, asarray, sqrt
+# ============= local library imports  ==========================
+from ararpy.arar import calculate_ages
+from ararpy.constants import ArArConstants
+from ararpy.fitting import pad_series, batch_intercepts, fit_degree
+from ararpy.interferences import compile_production_ratios
+from ararpy.results import ResultWriter
+
+ISOTOPES = ('Ar40', 'Ar39', 'Ar38', 'Ar37', 'Ar36')
+
+
+def decode_blob(blob, endianness='>', reverse_unpack=False):
+    """
+        array version of BaseMeasurement._unpack_blob. return xs, ys
+    """
+    data = frombuffer(blob, dtype='{}f4'.format(endianness)).reshape(-1, 2).astype(float)
+    xs, ys = data[:, 0], data[:, 1]
+    if reverse_unpack:
+        return ys, xs
+    return xs, ys
+
+
+def _decode(signal, endianness, reverse_unpack=False):
+    if isinstance(signal, (bytes, bytearray)):
+        return decode_blob(signal, endianness, reverse_unpack)
+    xs, ys = signal
+    return asarray(xs, dtype=float), asarray(ys, dtype=float)
+
+
+def chunked(iterable, size):
+    it = iter(iterable)
+    while 1:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class StreamingReducer(object):
+    def __init__(self, production_ratios=None, arar_constants=None, isotopes=ISOTOPES,
+                 chunk_size=1000, default_fit='linear', include_baseline_error=False,
+                 endianness='>', derived=(), reverse_unpack=False, default_baseline_fit='average'):
+        """
+            derived: extra quantities from ``interferences.DERIVED_QUANTITIES`` e.g.
+                ('kca', 'kcl') added to every chunk
+        """
+        if arar_constants is None:
+            arar_constants = ArArConstants()
+
+        self.arar_constants = arar_constants
+        self.production_ratios = compile_production_ratios(production_ratios, arar_constants)
+        self.isotopes = isotopes
+        self.chunk_size = chunk_size
+        self.default_fit = default_fit
+        self.include_baseline_error = include_baseline_error
+        self.endianness = endianness
+        self.derived = tuple(derived)
+        self.reverse_unpack = reverse_unpack
+        self.default_baseline_fit = default_baseline_fit
+
+    # ===============================================================================
+    # public
+    # ===============================================================================
+    def iter_chunks(self, source):
+        """
+            yield (identifiers, columns) for each chunk of ``source``
+        """
+        for chunk in chunked(source, self.chunk_size):
+            yield [a.get('identifier', '') for a in chunk], self.reduce_chunk(chunk)
+
+    def iter_rows(self, source):
+        """
+            yield one dict of reduced values per analysis
+        """
+        for ids, cols in self.iter_chunks(source):
+            names = list(cols.keys())
+            for i, ident in enumerate(ids):
+                row = dict((k, cols[k][i]) for k in names)
+                row['identifier'] = ident
+                yield row
+
+    def reduce_to_file(self, source, path, id_width=32):
+        """
+            reduce ``source`` straight into a bulk result file. return number of analyses
+        """
+        with ResultWriter(path, id_width=id_width) as w:
+            for ids, cols in self.iter_chunks(source):
+                w.write(cols, identifiers=ids)
+        return w.n
+
+    # ===============================================================================
+    # stages
+    # ===============================================================================
+    def reduce_chunk(self, analyses):
+        values, errors = self._fit(analyses)
+        values, errors = self._correct(analyses, values, errors)
+
+        decay_times = asarray([a.get('decay_time', 0) for a in analyses], dtype=float)
+        cols = self.production_ratios.calculate_F(values, errors, decay_times, derived=self.derived)
+
+        js = asarray([a['j'] for a in analyses], dtype=float).reshape(-1, 2)
+        cols['age'], cols['age_err'] = calculate_ages(js[:, 0], js[:, 1], cols['F'], cols['F_err'],
+                                                      arar_constants=self.arar_constants)
+
+        for i, k in enumerate(self.isotopes):
+            cols[k] = values[:, i]
+            cols['{}_err'.format(k)] = errors[:, i]
+        return cols
+
+    def _fit(self, analyses):
+        n = len(analyses)
+        values = zeros((n, len(self.isotopes)))
+        errors = zeros((n, len(self.isotopes)))
+        for i, k in enumerate(self.isotopes):
+            fits = [a.get('fits', {}).get(k, self.default_fit) for a in analyses]
+            series = [_decode(a['isotopes'][k], self.endianness, self.reverse_unpack) for a in analyses]
+            values[:, i], errors[:, i] = self._intercepts(series, [fit_degree(f) for f in fits])
+        return values, errors
+
+    def _intercepts(self, series, degrees):
+        n = len(series)
+        vs, es = zeros(n), zeros(n)
+        degrees = asarray(degrees)
+        for d in set(degrees):
+            idx = (degrees == d).nonzero()[0]
+            xs, ys, mask = pad_series([series[j][0] for j in idx], [series[j][1] for j in idx])
+            vs[idx], es[idx] = batch_intercepts(xs, ys, mask, d)
+        return vs, es
+
+    def _correct(self, analyses, values, errors):
+        for i, k in enumerate(self.isotopes):
+            bs, bse = self._baselines(analyses, k)
+            if not self.include_baseline_error:
+                bse = 0
+
+            bks = self._factors(analyses, 'blanks', k, 0)
+            v = values[:, i] - bs - bks[:, 0]
+            e = sqrt(errors[:, i] ** 2 + bse ** 2 + bks[:, 1] ** 2)
+
+            for key in ('discrimination', 'ic_factors', 'decay_factors'):
+                f = self._factors(analyses, key, k, 1)
+                v, e = v * f[:, 0], sqrt((e * f[:, 0]) ** 2 + (f[:, 1] * v) ** 2)
+
+            values[:, i], errors[:, i] = v, e
+        return values, errors
+
+    def _factors(self, analyses, key, k, default):
+        """
+            return (n, 2) values, errors of analysis[key][k]. scalars have no error
+        """
+        fs = [a.get(key, {}).get(k, default) for a in analyses]
+        return asarray([f if hasattr(f, '__len__') else (f, 0) for f in fs], dtype=float)
+
+    def _baselines(self, analyses, k):
+        n = len(analyses)
+        vs, es = zeros(n), zeros(n)
+
+        idx, series, fits = [], [], []
+        for j, a in enumerate(analyses):
+            b = a.get('baselines', {}).get(k)
+            if b is None:
+                continue
+            if isinstance(b, (bytes, bytearray)) or hasattr(b[0], '__len__'):
+                idx.append(j)
+                series.append(_decode(b, self.endianness, self.reverse_unpack))
+                fits.append(a.get('baseline_fits', {}).get(k, self.default_baseline_fit))
+            else:
+                vs[j], es[j] = b
+
+        if idx:
+            vs[idx], es[idx] = self._intercepts(series, [fit_degree(f) for f in fits])
+        return vs, es
+
+
+def reduce_stream(source, production_ratios=None, arar_constants=None, chunk_size=1000, **kw):
+    """
+        convenience generator. yield one reduced row per analysis in ``source``
+    """
+    r = StreamingReducer(production_ratios, arar_constants, chunk_size=chunk_size, **kw)
+    return r.iter_rows(source)
+
+# ============= EOF =============================================
@@ -17,12 +17,16 @@
 # ============= enthought library imports =======================
 
 # ============= standard library imports ========================
-from numpy import argmax, array, asarray, average
+from numpy import argmax, array, asarray, average, zeros, ones, cumsum, arange, minimum, where, \
+    concatenate, errstate, sqrt, fill_diagonal
 # ============= local library imports  ==========================
 from ararpy import ALPHAS
-from ararpy.stats import calculate_mswd, validate_mswd, calculate_weighted_mean
+from ararpy.kernels import find_plateau
+from ararpy.profiling import profile_stage
+from ararpy.stats import calculate_mswd, validate_mswd, calculate_weighted_mean, get_mswd_limits
 
 
+@profile_stage('plateau.calculate_plateau_age')
 def calculate_plateau_age(ages, errors, k39, kind='inverse_variance', method='fleck 1977', options=None):
     """
         ages: list of ages
@@ -73,7 +77,8 @@ def calculate_plateau_age(ages, errors, k39, kind='inverse_variance', method='fl
         plateau_ages = ages[sx]
         if kind == 'vol_fraction':
             weights = k39[sx]
-            wm, we = average(plateau_ages, weights=weights)
+            wm, sw = average(plateau_ages, weights=weights, returned=True)
+            we = ((weights * errors[sx]) ** 2).sum() ** 0.5 / sw
         else:
             plateau_errors = errors[sx]
             wm, we = calculate_weighted_mean(plateau_ages, plateau_errors)
@@ -81,16 +86,98 @@ def calculate_plateau_age(ages, errors, k39, kind='inverse_variance', method='fl
         return wm, we, pidx
 
 
-def memoize(function):
-    cache = {}
+def overlap_matrix(ages, errors, overlap_sigma=2):
+    """
+        n x n boolean matrix. m[i, j] is True if steps i and j overlap at ``overlap_sigma``.
+        a step always overlaps itself, even with a zero error
+    """
+    ages = asarray(ages, dtype=float)
+    e = asarray(errors, dtype=float) * overlap_sigma
+    lo, hi = ages - e, ages + e
+    m = (lo[:, None] < hi[None, :]) & (hi[:, None] > lo[None, :])
+    fill_diagonal(m, True)
+    return m
+
 
-    def closure(*args):
-        # return function(*args)
-        if args not in cache:
-            cache[args] = function(*args)
-        return cache[args]
+def overlapping_windows(m):
+    """
+        m: overlap matrix
+
+        return starts, ends of all maximal contiguous windows in which every pair of
+        steps overlaps
+    """
+    n = m.shape[0]
+    if not n:
+        return zeros(0, dtype=int), zeros(0, dtype=int)
+
+    # first step after r that does not overlap r
+    upper = ~m & (arange(n)[None, :] > arange(n)[:, None])
+    first_bad = where(upper.any(axis=1), upper.argmax(axis=1), n)
+
+    # window starting at i can extend up to the smallest first_bad of any later row
+    ends = minimum.accumulate(first_bad[::-1])[::-1] - 1
+    starts = arange(n)
+    maximal = concatenate(([True], ends[1:] > ends[:-1]))
+    return starts[maximal], ends[maximal]
+
+
+@profile_stage('plateau.calculate_plateau_diagnostics')
+def calculate_plateau_diagnostics(ages, errors, signals, exclude=None, overlap_sigma=2,
+                                  nsteps=3, gas_fraction=50):
+    """
+        every candidate plateau, not only the longest one found by ``Plateau.find_plateaus``
 
-    return closure
+        candidates are the maximal contiguous windows of mutually overlapping steps.
+        excluded steps contribute no gas and are left out of the mean and mswd
+
+        return dict of arrays, one entry per window
+            start, end, n, gas_fraction, mean, error, mswd, valid, plateau
+
+        gas_fraction is in percent. plateau is True if the window also satisfies
+        ``nsteps`` and ``gas_fraction``
+    """
+    ages = asarray(ages, dtype=float)
+    errors = asarray(errors, dtype=float)
+    signals = asarray(signals, dtype=float)
+
+    included = ones(len(ages), dtype=bool)
+    if exclude is not None and len(exclude):
+        included[asarray(exclude, dtype=int)] = False
+
+    starts, ends = overlapping_windows(overlap_matrix(ages, errors, overlap_sigma))
+
+    def window_sum(v):
+        c = concatenate(([0], cumsum(v)))
+        return c[ends + 1] - c[starts]
+
+    total = signals[included].sum()
+    w = where(included, errors, 1) ** -2 * included
+    # center to limit cancellation in the sum of squares
+    offset = average(ages, weights=w) if w.sum() else 0
+    x = ages - offset
+
+    n = window_sum(included)
+    sw = window_sum(w)
+    swx = window_sum(w * x)
+    swxx = window_sum(w * x * x)
+
+    with errstate(divide='ignore', invalid='ignore'):
+        gas = window_sum(signals * included) / total * 100 if total else zeros(len(starts))
+        xm = where(sw > 0, swx / sw, 0)
+        mean = xm + offset
+        error = where(sw > 0, sw ** -0.5, 0)
+        mswd = where(n > 1, (swxx - sw * xm ** 2) / (n - 1), 0)
+
+    mswd = where(mswd < 0, 0, mswd)
+    valid = zeros(len(starts), dtype=bool)
+    ok = n > 1
+    if ok.any():
+        low, high = get_mswd_limits(n[ok])
+        valid[ok] = (low <= mswd[ok]) & (mswd[ok] <= high)
+
+    plateau = (ends - starts >= nsteps) & (gas >= gas_fraction)
+    return dict(start=starts, end=ends, n=n, gas_fraction=gas, mean=mean, error=error,
+                mswd=mswd, valid=valid, plateau=plateau)
 
 
 class Plateau(object):
@@ -107,12 +194,17 @@ class Plateau(object):
 
     total_signal = 0
 
-    def __init__(self, ages, errors, signals, exclude=None):
-        self.exclude = exclude
+    gas_fraction = 50
+
+    def __init__(self, ages, errors, signals, exclude=None, nsteps=3, gas_fraction=50):
+        self.exclude = [] if exclude is None else list(exclude)
+        self.nsteps = nsteps
+        self.gas_fraction = gas_fraction
         self.signals = signals
         self.errors = errors
         self.ages = ages
 
+    @profile_stage('plateau.find_plateaus')
     def find_plateaus(self, method=''):
         """
             method: str either fleck 1977 or mahon 1996
@@ -132,10 +224,15 @@ class Plateau(object):
         self.total_signal = float(sum(ss))
         # log.info(self.total_signal)
 
+        if self.use_overlap:
+            pidx = find_plateau(self.ages, self.errors, self.signals, exclude,
+                                self.nsteps, self.overlap_sigma, self.gas_fraction)
+            return pidx or []
+
         idxs = []
         spans = []
 
-        overlap_func = memoize(self._overlap)
+        overlap_func = self._overlap_func()
         for i in range(n):
             if i in exclude:
                 continue
@@ -183,42 +280,46 @@ class Plateau(object):
 
         # log.debug('percent {} {} {}'.format(start, end, ss / self.total_signal))
 
-        return ss / self.total_signal >= 0.5
+        if not self.total_signal:
+            return False
+        return ss / self.total_signal >= self.gas_fraction / 100.
 
     def check_mswd(self, start, end):
         """
             return False if not valid
         """
-        ages = self.ages[start, end + 1]
-        errors = self.errors[start, end + 1]
+        ages = self.ages[start:end + 1]
+        errors = self.errors[start:end + 1]
         mswd = calculate_mswd(ages, errors)
         return validate_mswd(mswd, len(ages))
 
     def check_overlap(self, start, end, overlap_func):
-        overlap_sigma = self.overlap_sigma
-        for c, i in enumerate(range(start, end, 1)):
-            for j in range(start + c, end + 1, 1):
-                if i == j:
-                    continue
-                if not overlap_func(i, j, overlap_sigma):
-                    return
-        else:
-            return True
+        return overlap_func(start, end)
 
-    def _overlap(self, start, end, overlap_sigma):
-        # log.debug('checking overlap {} {} '.format(start, end))
+    def diagnostics(self):
+        """
+            see calculate_plateau_diagnostics
+        """
+        return calculate_plateau_diagnostics(self.ages, self.errors, self.signals,
+                                             exclude=self.exclude,
+                                             overlap_sigma=self.overlap_sigma,
+                                             nsteps=self.nsteps,
+                                             gas_fraction=self.gas_fraction)
 
-        a1 = self.ages[start]
-        a2 = self.ages[end]
-        e1 = self.errors[start]
-        e2 = self.errors[end]
+    def _overlap_func(self):
+        """
+            return func(start, end) that is True if every pair of steps in start..end overlaps.
+            the overlap matrix is built on the first call
+        """
+        cache = []
 
-        e1 *= overlap_sigma
-        e2 *= overlap_sigma
+        def func(start, end):
+            if not cache:
+                cache.append(overlap_matrix(self.ages, self.errors, self.overlap_sigma))
+            m = cache[0]
+            return bool(m[start:end + 1, start:end + 1].all())
 
-        # log.debug('{}<{} {}>{}'.format(a1 - e1 , a2 + e2, a1 + e1 , a2 - e2))
-        if a1 - e1 < a2 + e2 and a1 + e1 > a2 - e2:
-            return True
+        return func
 
     def check_nsteps(self, start, end):
         return end - start >= self.nsteps
@@ -0,0 +1,233 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    opt-in per stage instrumentation of the reduction pipeline.
+
+    from ararpy import profiling
+    profiling.enable(trace=True)
+    ... run a reduction ...
+    print(profiling.summary_table())
+    profiling.export_chrome_trace('reduction.json')  # open in chrome://tracing
+
+    stages nest, e.g. arar.calculate_F contains arar.interference_corrections, and the
+    times of a stage include the time spent in its children. when disabled a stage
+    costs one attribute check.
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import json
+import os
+import threading
+import time
+from functools import wraps
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    process_time = time.process_time
+except AttributeError:
+    process_time = time.clock
+
+
+# ============= local library imports  ==========================
+
+class StageStats(object):
+    """
+        net_bytes is the change in traced memory across the stage, summed over calls.
+        it is negative if a stage frees more than it allocates and it is not a count
+        of allocations
+    """
+    __slots__ = ('name', 'calls', 'wall', 'cpu', 'net_bytes')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.net_bytes = 0
+
+    def to_dict(self):
+        return dict(name=self.name, calls=self.calls, wall=self.wall,
+                    cpu=self.cpu, net_bytes=self.net_bytes)
+
+
+class ProfilerState(object):
+    enabled = False
+    trace = False
+    track_allocations = False
+    # True if enable() started tracemalloc, so disable() should stop it
+    started_tracemalloc = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stats = {}
+        self.events = []
+        self.t0 = default_timer()
+
+
+_state = ProfilerState()
+
+
+def enable(trace=False, track_allocations=False):
+    """
+        trace: keep every call as an event for ``export_chrome_trace``
+        track_allocations: record the net change in traced memory per stage with
+            tracemalloc. tracemalloc is started if it is not already running
+    """
+    _state.trace = trace
+    _state.track_allocations = bool(track_allocations and tracemalloc)
+    if _state.track_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state.started_tracemalloc = True
+    _state.enabled = True
+
+
+def disable():
+    """
+        stop recording. tracemalloc is only stopped if ``enable`` started it
+    """
+    _state.enabled = False
+    if _state.started_tracemalloc and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state.started_tracemalloc = False
+    _state.track_allocations = False
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def reset():
+    _state.reset()
+
+
+class stage(object):
+    """
+        time a block of code as ``name``
+
+        with stage('isotope.fit'):
+            ...
+    """
+    __slots__ = ('name', '_wall', '_cpu', '_mem')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _state.enabled:
+            self._mem = tracemalloc.get_traced_memory()[0] if _state.track_allocations else 0
+            self._cpu = process_time()
+            self._wall = default_timer()
+        else:
+            self._wall = None
+        return self
+
+    def __exit__(self, *args):
+        if self._wall is not None:
+            _record(self.name, self._wall, self._cpu, self._mem)
+
+
+def profile_stage(name):
+    """
+        decorator version of ``stage``
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kw):
+            if not _state.enabled:
+                return func(*args, **kw)
+
+            mem = tracemalloc.get_traced_memory()[0] if _state.track_allocations else 0
+            cpu = process_time()
+            wall = default_timer()
+            try:
+                return func(*args, **kw)
+            finally:
+                _record(name, wall, cpu, mem)
+
+        return wrapper
+
+    return decorator
+
+
+def _record(name, wall, cpu, mem):
+    end = default_timer()
+    dcpu = process_time() - cpu
+    dmem = tracemalloc.get_traced_memory()[0] - mem if _state.track_allocations else 0
+
+    with _state.lock:
+        try:
+            s = _state.stats[name]
+        except KeyError:
+            s = _state.stats[name] = StageStats(name)
+
+        s.calls += 1
+        s.wall += end - wall
+        s.cpu += dcpu
+        s.net_bytes += dmem
+
+        if _state.trace:
+            _state.events.append((name, wall - _state.t0, end - wall, threading.current_thread().ident))
+
+
+# ===============================================================================
+# export
+# ===============================================================================
+def get_stats():
+    """
+        return list of StageStats sorted by cumulative wall time
+    """
+    return sorted(_state.stats.values(), key=lambda s: s.wall, reverse=True)
+
+
+def summary_table():
+    header = '{:<40s} {:>8s} {:>12s} {:>12s} {:>12s} {:>14s}'.format('stage', 'calls', 'wall (s)',
+                                                                    'cpu (s)', 'per call (ms)',
+                                                                    'net mem (kB)')
+    lines = [header, '-' * len(header)]
+    for s in get_stats():
+        lines.append('{:<40s} {:>8d} {:>12.4f} {:>12.4f} {:>12.4f} {:>14.1f}'.format(s.name, s.calls,
+                                                                                    s.wall, s.cpu,
+                                                                                    s.wall / s.calls * 1000,
+                                                                                    s.net_bytes / 1024.))
+    return '\n'.join(lines)
+
+
+def chrome_trace():
+    """
+        return the recorded events in the chrome trace event format. requires
+        enable(trace=True)
+    """
+    pid = os.getpid()
+    events = [dict(name=name, cat=name.split('.')[0], ph='X',
+                   ts=st * 1e6, dur=dur * 1e6, pid=pid, tid=tid)
+              for name, st, dur, tid in _state.events]
+    return dict(traceEvents=events, displayTimeUnit='ms')
+
+
+def export_chrome_trace(path):
+    with open(path, 'w') as wfile:
+        json.dump(chrome_trace(), wfile)
+
+# ============= EOF =============================================
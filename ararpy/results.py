@@ -0,0 +1,336 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    columnar storage of reduced results.
+
+    every quantity is stored as two float64 columns, ``<name>`` and ``<name>_err``.
+    files are written as uncompressed .npz (or .parquet when pyarrow is installed)
+    and are loaded lazily, memory mapping each column on first access.
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+
+from numpy import asarray, zeros, memmap, savez, dtype
+from numpy.lib import format as npformat
+from uncertainties import ufloat
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+# ============= local library imports  ==========================
+
+NON_AR_ISOTOPES = ('k40', 'ca39', 'k38', 'ca38', 'k37', 'ca37', 'ca36', 'cl36')
+COMPUTED = ('rad40', 'rad40_percent', 'k39', 'atm40')
+INTERFERENCE_CORRECTED = ('Ar40', 'Ar39', 'Ar38', 'Ar37', 'Ar36')
+
+# quantity names of one calculate_F result
+F_QUANTITIES = ('F', 'F_wo_irrad') + NON_AR_ISOTOPES + COMPUTED + \
+               tuple('ic_{}'.format(k) for k in INTERFERENCE_CORRECTED)
+
+ID_COLUMN = 'identifier'
+
+
+def flatten_F_result(result):
+    """
+        result: the tuple returned by arar.calculate_F
+
+        return list of ufloats in F_QUANTITIES order
+    """
+    f, f_wo_irrad, non_ar, computed, ic = result
+    return [f, f_wo_irrad] + [non_ar[k] for k in NON_AR_ISOTOPES] + \
+           [computed[k] for k in COMPUTED] + [ic[k] for k in INTERFERENCE_CORRECTED]
+
+
+def results_to_columns(results, quantities=F_QUANTITIES, flatten=flatten_F_result):
+    """
+        convert a sequence of per analysis results (e.g. calculate_F outputs) into
+        a dict of value and error columns
+    """
+    results = list(results)
+    n = len(results)
+    vs = zeros((len(quantities), n))
+    es = zeros((len(quantities), n))
+    for j, r in enumerate(results):
+        for i, u in enumerate(flatten(r)):
+            vs[i, j] = getattr(u, 'nominal_value', u)
+            es[i, j] = getattr(u, 'std_dev', 0)
+
+    cols = {}
+    for i, q in enumerate(quantities):
+        cols[q] = vs[i]
+        cols['{}_err'.format(q)] = es[i]
+    return cols
+
+
+class ResultTable(object):
+    """
+        read only collection of result columns. ``columns`` maps a name to either an
+        array or a zero argument callable that loads it, so columns are only read
+        when used
+    """
+
+    def __init__(self, columns, close=None):
+        self._columns = dict(columns)
+        self._loaded = {}
+        self._close = close
+
+    @property
+    def names(self):
+        return sorted(self._columns.keys())
+
+    @property
+    def quantities(self):
+        return [k for k in self.names if not k.endswith('_err') and k != ID_COLUMN]
+
+    def __len__(self):
+        if not self._columns:
+            return 0
+        return len(self[self.names[0]])
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        try:
+            return self._loaded[name]
+        except KeyError:
+            c = self._columns[name]
+            if callable(c):
+                c = c()
+            self._loaded[name] = c
+            return c
+
+    def value(self, name):
+        return self[name]
+
+    def error(self, name):
+        return self['{}_err'.format(name)]
+
+    def uvalue(self, name, idx):
+        return ufloat(self[name][idx], self.error(name)[idx])
+
+    def close(self):
+        self._loaded = {}
+        if self._close:
+            self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# ===============================================================================
+# writing
+# ===============================================================================
+def save_results(path, columns, identifiers=None):
+    """
+        path: .npz or .parquet
+        columns: dict of name: 1d array
+    """
+    columns = dict((k, asarray(v)) for k, v in columns.items())
+    if identifiers is not None:
+        columns[ID_COLUMN] = asarray(identifiers, dtype=str)
+
+    if path.endswith('.parquet'):
+        if pyarrow is None:
+            raise ImportError('pyarrow is required to write {}'.format(path))
+        table = pyarrow.Table.from_arrays([pyarrow.array(v) for v in columns.values()],
+                                          names=list(columns.keys()))
+        pq.write_table(table, path)
+    else:
+        # savez does not compress so the members can be memory mapped
+        savez(path, **columns)
+
+
+class ResultWriter(object):
+    """
+        write results in chunks with constant memory. each column is appended to a
+        raw temporary file and packed into an uncompressed .npz on ``close``
+
+        with ResultWriter('results.npz') as w:
+            for chunk in chunks:
+                w.write(columns)
+    """
+
+    def __init__(self, path, id_width=32):
+        self.path = path
+        self.id_width = id_width
+        self.n = 0
+        self._dtypes = {}
+        self._files = {}
+        self._root = tempfile.mkdtemp(prefix='ararpy_results')
+
+    def write(self, columns, identifiers=None):
+        """
+            append one chunk. every column must have the same length and, once rows
+            have been written, the chunk must supply exactly the columns of the earlier
+            chunks. the chunk is checked before anything is written
+        """
+        columns = dict((k, asarray(v)) for k, v in columns.items())
+        if identifiers is not None:
+            ids = asarray(identifiers, dtype=str)
+            if ids.dtype.itemsize > dtype('U{}'.format(self.id_width)).itemsize:
+                raise ValueError('identifiers longer than id_width={}'.format(self.id_width))
+            columns[ID_COLUMN] = ids.astype('U{}'.format(self.id_width))
+
+        lens = dict((k, len(v)) for k, v in columns.items())
+        if len(set(lens.values())) > 1:
+            raise ValueError('columns have different lengths {}'.format(sorted(lens.items())))
+
+        if self.n:
+            missing = sorted(set(self._files) - set(columns))
+            if missing:
+                raise ValueError('columns {} written in earlier chunks are missing'.format(missing))
+            extra = sorted(set(columns) - set(self._files))
+            if extra:
+                raise ValueError('columns {} not present in earlier chunks'.format(extra))
+        else:
+            # earlier chunks were empty, so columns not in this chunk have no rows
+            for k in set(self._files) - set(columns):
+                fp = self._files.pop(k)
+                fp.close()
+                os.remove(fp.name)
+                del self._dtypes[k]
+
+        chunk = []
+        for k, v in columns.items():
+            dt = self._dtypes.get(k, v.dtype)
+            try:
+                chunk.append((k, dt, v.astype(dt)))
+            except ValueError as e:
+                raise ValueError('column {} cannot be written as {}. {}'.format(k, dt, e))
+
+        for k, dt, v in chunk:
+            if k not in self._files:
+                self._files[k] = open(os.path.join(self._root, '{}.raw'.format(k)), 'wb')
+                self._dtypes[k] = dt
+            v.tofile(self._files[k])
+
+        if lens:
+            self.n += next(iter(lens.values()))
+
+    def close(self):
+        try:
+            with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for k, fp in self._files.items():
+                    fp.close()
+                    npy = os.path.join(self._root, '{}.npy'.format(k))
+                    with open(npy, 'wb') as wfile:
+                        header = dict(descr=npformat.dtype_to_descr(self._dtypes[k]),
+                                      fortran_order=False, shape=(self.n,))
+                        npformat.write_array_header_2_0(wfile, header)
+                        with open(fp.name, 'rb') as rfile:
+                            shutil.copyfileobj(rfile, wfile)
+                    os.remove(fp.name)
+                    zf.write(npy, '{}.npy'.format(k))
+                    os.remove(npy)
+        finally:
+            shutil.rmtree(self._root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# ===============================================================================
+# reading
+# ===============================================================================
+def load_results(path, mmap=True):
+    """
+        return a lazily loaded ResultTable
+    """
+    if path.endswith('.parquet'):
+        return _load_parquet(path, mmap)
+    return _load_npz(path, mmap)
+
+
+def _load_parquet(path, mmap):
+    if pyarrow is None:
+        raise ImportError('pyarrow is required to read {}'.format(path))
+
+    names = pq.read_schema(path).names
+
+    def factory(name):
+        return lambda: pq.read_table(path, columns=[name], memory_map=mmap).column(name).to_numpy()
+
+    return ResultTable(dict((n, factory(n)) for n in names))
+
+
+# size of the fixed part of a zip local file header
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+
+def _npz_member_offset(rfile, info):
+    rfile.seek(info.header_offset)
+    fields = _LOCAL_HEADER.unpack(rfile.read(_LOCAL_HEADER.size))
+    fname_len, extra_len = fields[-2:]
+    return info.header_offset + _LOCAL_HEADER.size + fname_len + extra_len
+
+
+def _read_npy_header(rfile):
+    version = npformat.read_magic(rfile)
+    if version == (1, 0):
+        shape, fortran, dtype = npformat.read_array_header_1_0(rfile)
+    else:
+        shape, fortran, dtype = npformat.read_array_header_2_0(rfile)
+    return shape, fortran, dtype, rfile.tell()
+
+
+def _load_npz(path, mmap):
+    columns = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as rfile:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            # only stored members can be read, or memory mapped, at a raw offset.
+            # compressed members (np.savez_compressed) are read through the archive
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                rfile.seek(_npz_member_offset(rfile, info))
+                shape, fortran, dtype, offset = _read_npy_header(rfile)
+                if not dtype.hasobject and all(shape):
+                    columns[name] = _mmap_loader(path, dtype, shape, fortran, offset)
+                    continue
+
+            columns[name] = _member_loader(path, info)
+
+    return ResultTable(columns)
+
+
+def _mmap_loader(path, dtype, shape, fortran, offset):
+    order = 'F' if fortran else 'C'
+    return lambda: memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order=order)
+
+
+def _member_loader(path, info):
+    def load():
+        with zipfile.ZipFile(path) as z:
+            with z.open(info) as rfile:
+                return npformat.read_array(rfile)
+
+    return load
+
+# ============= EOF =============================================
@@ -0,0 +1,268 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    process pool whose inputs and outputs live in shared memory.
+
+    arrays are copied into ``multiprocessing.shared_memory`` blocks once; workers
+    receive only ``SharedArray`` handles plus a row range, attach to the blocks and
+    write their results in place. nothing but the handles is pickled.
+
+        with SharedMemoryExecutor(max_workers=8) as ex:
+            xs = ex.share(padded_xs)          # share once, reuse across stages
+            vs, es = ex.fit_intercepts(xs, ys, mask, degree=1)
+            cols = ex.calculate_F(values, errors, decay_times, production_ratios, j=js)
+
+    arrays returned by the executor are views of shared blocks and are valid until
+    ``release`` or the end of the with block. copy them to keep them.
+
+    requires python 3.8+
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+from numpy import ndarray, dtype as ndtype, asarray, prod, unique, full
+# ============= local library imports  ==========================
+from ararpy.constants import ArArConstants
+from ararpy.interferences import compile_production_ratios
+
+
+class SharedArray(object):
+    """
+        picklable handle to an array in a shared memory block
+    """
+    __slots__ = ('name', 'shape', 'dtype')
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = ndtype(dtype).str
+
+    def __getstate__(self):
+        return self.name, self.shape, self.dtype
+
+    def __setstate__(self, state):
+        self.name, self.shape, self.dtype = state
+
+    def attach(self):
+        """
+            return shm, array. close shm when done with the array
+        """
+        shm = shared_memory.SharedMemory(name=self.name)
+        return shm, ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+
+@contextmanager
+def attached(*handles):
+    blocks, arrays = [], []
+    try:
+        for h in handles:
+            shm, a = h.attach()
+            blocks.append(shm)
+            arrays.append(a)
+        yield arrays
+    finally:
+        del arrays[:]
+        for shm in blocks:
+            shm.close()
+
+
+# ===============================================================================
+# worker functions. module level so they pickle by reference
+# ===============================================================================
+def _intercepts_chunk(start, stop, handles):
+    from ararpy.fitting import batch_intercepts
+
+    with attached(*handles) as (xs, ys, mask, degrees, vs, es):
+        s = slice(start, stop)
+        ds = degrees[s]
+        for d in unique(ds):
+            rows = (ds == d).nonzero()[0] + start
+            vs[rows], es[rows] = batch_intercepts(xs[rows], ys[rows], mask[rows], int(d))
+
+
+def _F_chunk(start, stop, handles, names, compiled, arar_constants, with_age):
+    with attached(*handles) as arrays:
+        values, errors, decay_times, js, out = arrays
+        s = slice(start, stop)
+        cols = compiled.calculate_F(values[s], errors[s], decay_times[s])
+        if with_age:
+            from ararpy.arar import calculate_ages
+
+            cols['age'], cols['age_err'] = calculate_ages(js[s, 0], js[s, 1], cols['F'], cols['F_err'],
+                                                          arar_constants=arar_constants)
+        for i, k in enumerate(names):
+            out[s, i] = cols[k]
+
+
+def _plateau_chunk(start, stop, handles, kw):
+    from ararpy.kernels import find_plateau
+
+    with attached(*handles) as (ages, errors, signals, offsets, out):
+        for i in range(start, stop):
+            s = slice(offsets[i], offsets[i + 1])
+            pidx = find_plateau(ages[s], errors[s], signals[s], **kw)
+            out[i] = pidx if pidx else (-1, -1)
+
+
+class SharedMemoryExecutor(object):
+    def __init__(self, max_workers=None, chunk_size=1024, mp_context=None):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context)
+        self.chunk_size = chunk_size
+        self._blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+        self.release()
+
+    # ===============================================================================
+    # blocks
+    # ===============================================================================
+    def empty(self, shape, dtype=float):
+        """
+            allocate a shared block. return handle
+        """
+        shape = tuple(shape)
+        nbytes = max(int(prod(shape)) * ndtype(dtype).itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        handle = SharedArray(shm.name, shape, dtype)
+        self._blocks[shm.name] = (shm, ndarray(shape, dtype=dtype, buffer=shm.buf))
+        return handle
+
+    def share(self, a, dtype=None):
+        """
+            copy ``a`` into a shared block. shared handles are returned unchanged
+        """
+        if isinstance(a, SharedArray):
+            return a
+
+        a = asarray(a, dtype=dtype)
+        handle = self.empty(a.shape, a.dtype)
+        self.get(handle)[...] = a
+        return handle
+
+    def get(self, handle):
+        """
+            array view of a block created by this executor
+        """
+        return self._blocks[handle.name][1]
+
+    def release(self, handle=None):
+        """
+            close and unlink one or every block
+        """
+        names = [handle.name] if handle is not None else list(self._blocks)
+        for name in names:
+            shm, _ = self._blocks.pop(name)
+            shm.close()
+            shm.unlink()
+
+    def run_chunks(self, func, n, *args):
+        """
+            call func(start, stop, *args) on the pool for consecutive row ranges of n
+        """
+        futures = [self.executor.submit(func, i, min(i + self.chunk_size, n), *args)
+                   for i in range(0, n, self.chunk_size)]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for f in pending:
+            f.cancel()
+        for f in done:
+            f.result()
+
+    # ===============================================================================
+    # stages
+    # ===============================================================================
+    def fit_intercepts(self, xs, ys, mask, degree=1):
+        """
+            xs, ys, mask: (n_series, n_points) padded series, arrays or handles
+            degree: int or per series sequence
+
+            return intercepts, errors
+        """
+        xs, ys = self.share(xs, float), self.share(ys, float)
+        mask = self.share(mask, bool)
+        n = xs.shape[0]
+
+        degrees = asarray(degree, dtype=int)
+        if degrees.ndim == 0:
+            degrees = full(n, int(degrees))
+        degrees = self.share(degrees)
+
+        vs, es = self.empty((n,)), self.empty((n,))
+        self.run_chunks(_intercepts_chunk, n, (xs, ys, mask, degrees, vs, es))
+        return self.get(vs), self.get(es)
+
+    def calculate_F(self, values, errors, decay_times, production_ratios=None, arar_constants=None,
+                    j=None):
+        """
+            vectorized F (and ages if ``j`` is given) in parallel
+
+            values, errors: (n, 5) isotopes a40, a39, a38, a37, a36
+            decay_times: (n,)
+            j: optional (n, 2) j, j_err
+
+            return dict of columns as ``CompiledProductionRatios.calculate_F``
+        """
+        if arar_constants is None:
+            arar_constants = ArArConstants()
+        compiled = compile_production_ratios(production_ratios, arar_constants)
+
+        values, errors = self.share(values, float), self.share(errors, float)
+        decay_times = self.share(decay_times, float)
+        n = values.shape[0]
+
+        with_age = j is not None
+        js = self.share(j if with_age else ((0, 0),), float)
+
+        names = sorted(compiled.calculate_F(((1, 1, 1, 1, 1),), ((0, 0, 0, 0, 0),), 0).keys())
+        if with_age:
+            names += ['age', 'age_err']
+
+        out = self.empty((n, len(names)))
+        self.run_chunks(_F_chunk, n, (values, errors, decay_times, js, out),
+                        names, compiled, arar_constants, with_age)
+
+        arr = self.get(out)
+        return dict((k, arr[:, i]) for i, k in enumerate(names))
+
+    def find_plateaus(self, ages, errors, signals, offsets, **kw):
+        """
+            plateau of many spectra stored back to back
+
+            ages, errors, signals: flat arrays of every step
+            offsets: (n_spectra+1,) start of each spectrum, last entry is the total length
+            kw: passed to ``kernels.find_plateau`` e.g. nsteps, overlap_sigma, gas_fraction
+
+            return (n_spectra, 2) start, end indices within each spectrum. -1 if none
+        """
+        ages, errors = self.share(ages, float), self.share(errors, float)
+        signals = self.share(signals, float)
+        offsets = self.share(offsets, int)
+        n = offsets.shape[0] - 1
+
+        out = self.empty((n, 2), int)
+        self.run_chunks(_plateau_chunk, n, (ages, errors, signals, offsets, out), kw)
+        return self.get(out)
+
+# ============= EOF =============================================
@@ -0,0 +1,257 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+from numpy import array, zeros, ones, cumsum, where
+from uncertainties import ufloat
+# ============= local library imports  ==========================
+from ararpy.arar import age_equation, calculate_F
+from ararpy.constants import ArArConstants
+from ararpy.plateau import Plateau
+from ararpy.stats import calculate_mswd, calculate_weighted_mean, validate_mswd
+
+# cached pieces and the inputs they depend on
+DEPENDENCIES = {'cumulative': ('k39', 'excluded'),
+                'integrated_age': ('f', 'j', 'k39', 'excluded'),
+                'plateau': ('ages', 'k39', 'excluded', 'plateau_method', 'nsteps', 'overlap_sigma'),
+                'plateau_age': ('ages', 'k39', 'excluded', 'plateau_method', 'nsteps', 'overlap_sigma'),
+                'mswd': ('ages', 'k39', 'excluded', 'plateau_method', 'nsteps', 'overlap_sigma')}
+
+
+def _option(name):
+    """
+        plateau option that clears the cached quantities depending on it when set
+    """
+    attr = '_{}'.format(name)
+
+    def fget(self):
+        return getattr(self, attr)
+
+    def fset(self, v):
+        if getattr(self, attr, None) != v:
+            setattr(self, attr, v)
+            self._invalidate(name)
+
+    return property(fget, fset)
+
+
+class Spectrum(object):
+    """
+        step heating spectrum with lazily computed and cached derived quantities.
+
+        per step ages are computed with ``arar.age_equation`` and only recomputed for
+        steps whose F changes. excluding a step or changing its values only clears
+        the cached quantities that depend on what changed
+    """
+    plateau_method = _option('plateau_method')
+    nsteps = _option('nsteps')
+    overlap_sigma = _option('overlap_sigma')
+
+    def __init__(self, f, f_err, k39, k39_err=None, j=(1, 0), excluded=None,
+                 arar_constants=None, plateau_method='fleck 1977', nsteps=3, overlap_sigma=2):
+        n = len(f)
+        self.f = array(f, dtype=float)
+        self.f_err = array(f_err, dtype=float)
+        self.k39 = array(k39, dtype=float)
+        self.k39_err = zeros(n) if k39_err is None else array(k39_err, dtype=float)
+        self.excluded = zeros(n, dtype=bool)
+        if excluded is not None:
+            self.excluded[list(excluded)] = True
+
+        self._cache = {}
+        self.j = j
+        self.arar_constants = arar_constants or ArArConstants()
+        self.plateau_method = plateau_method
+        self.nsteps = nsteps
+        self.overlap_sigma = overlap_sigma
+
+        self._ages = zeros(n)
+        self._age_errors = zeros(n)
+        self._stale_ages = ones(n, dtype=bool)
+
+    @classmethod
+    def from_isotopes(cls, isotopes, decay_times, j, interferences=None, arar_constants=None, **kw):
+        """
+            isotopes: list of (a40, a39, a38, a37, a36) per step
+            decay_times: list of decay times per step
+        """
+        fs, ks = [], []
+        for isos, dt in zip(isotopes, decay_times):
+            f, _, _, computed, _ = calculate_F(isos, dt, interferences=interferences,
+                                               arar_constants=arar_constants)
+            fs.append(f)
+            ks.append(computed['k39'])
+
+        return cls([fi.nominal_value for fi in fs], [fi.std_dev for fi in fs],
+                   [ki.nominal_value for ki in ks], [ki.std_dev for ki in ks],
+                   j=j, arar_constants=arar_constants, **kw)
+
+    @property
+    def n(self):
+        return len(self.f)
+
+    # ===============================================================================
+    # mutation
+    # ===============================================================================
+    def set_excluded(self, idx, excluded=True):
+        if self.excluded[idx] != excluded:
+            self.excluded[idx] = excluded
+            self._invalidate('excluded')
+
+    def set_step(self, idx, f=None, f_err=None, k39=None, k39_err=None):
+        if f is not None or f_err is not None:
+            if f is not None:
+                self.f[idx] = f
+            if f_err is not None:
+                self.f_err[idx] = f_err
+            self._stale_ages[idx] = True
+            self._invalidate('f')
+            self._invalidate('ages')
+
+        if k39 is not None or k39_err is not None:
+            if k39 is not None:
+                self.k39[idx] = k39
+            if k39_err is not None:
+                self.k39_err[idx] = k39_err
+            self._invalidate('k39')
+
+    def set_j(self, j):
+        self.j = j
+        self._stale_ages[:] = True
+        self._invalidate('ages')
+        self._invalidate('j')
+
+    def _invalidate(self, attr):
+        for k, deps in DEPENDENCIES.items():
+            if attr in deps:
+                self._cache.pop(k, None)
+
+    def _cached(self, key, func):
+        try:
+            return self._cache[key]
+        except KeyError:
+            v = self._cache[key] = func()
+            return v
+
+    # ===============================================================================
+    # derived quantities
+    # ===============================================================================
+    @property
+    def ages(self):
+        self._update_ages()
+        return self._ages
+
+    @property
+    def age_errors(self):
+        self._update_ages()
+        return self._age_errors
+
+    @property
+    def cumulative_k39(self):
+        """
+            cumulative fraction of 39ArK released (excluded steps contribute 0), as the
+            upper edge of each step
+        """
+        return self._cached('cumulative', self._calculate_cumulative)
+
+    @property
+    def integrated_age(self):
+        """
+            total gas age from the 39ArK weighted F of the included steps. the error
+            includes the 39ArK errors through the weights
+        """
+        return self._cached('integrated_age', self._calculate_integrated_age)
+
+    @property
+    def plateau(self):
+        """
+            (start, end) indices of the plateau or None
+        """
+        return self._cached('plateau', self._find_plateau)
+
+    @property
+    def plateau_age(self):
+        return self._cached('plateau_age', self._calculate_plateau_age)
+
+    @property
+    def mswd(self):
+        """
+            (mswd, valid) of the plateau steps
+        """
+        return self._cached('mswd', self._calculate_mswd)
+
+    def _update_ages(self):
+        stale = self._stale_ages
+        if stale.any():
+            ac = self.arar_constants
+            for i in stale.nonzero()[0]:
+                a = age_equation(self.j, ufloat(self.f[i], self.f_err[i]), arar_constants=ac)
+                self._ages[i] = a.nominal_value
+                self._age_errors[i] = a.std_dev
+            stale[:] = False
+
+    def _included_k39(self):
+        return where(self.excluded, 0, self.k39)
+
+    def _calculate_cumulative(self):
+        k = self._included_k39()
+        total = k.sum()
+        return cumsum(k) / total if total else zeros(self.n)
+
+    def _calculate_integrated_age(self):
+        inc = ~self.excluded
+        k39 = self.k39[inc]
+        total = k39.sum()
+        if not total:
+            return ufloat(0, 0)
+
+        fs = self.f[inc]
+        w = k39 / total
+        f = (w * fs).sum()
+        # dF/dk39_i = (f_i - F) / total
+        f_err = (((w * self.f_err[inc]) ** 2).sum() +
+                 (((fs - f) / total * self.k39_err[inc]) ** 2).sum()) ** 0.5
+        return age_equation(self.j, ufloat(f, f_err), arar_constants=self.arar_constants)
+
+    def _find_plateau(self):
+        p = Plateau(self.ages, self.age_errors, self.k39,
+                    exclude=list(self.excluded.nonzero()[0]))
+        p.nsteps = self.nsteps
+        p.overlap_sigma = self.overlap_sigma
+        return p.find_plateaus(self.plateau_method) or None
+
+    def _plateau_slice(self):
+        pidx = self.plateau
+        if pidx:
+            sx = zeros(self.n, dtype=bool)
+            sx[pidx[0]:pidx[1] + 1] = True
+            return sx & ~self.excluded
+
+    def _calculate_plateau_age(self):
+        sx = self._plateau_slice()
+        if sx is not None:
+            wm, we = calculate_weighted_mean(self.ages[sx], self.age_errors[sx])
+            return ufloat(wm, we)
+
+    def _calculate_mswd(self):
+        sx = self._plateau_slice()
+        if sx is not None:
+            ages, errors = self.ages[sx], self.age_errors[sx]
+            mswd = calculate_mswd(ages, errors)
+            return mswd, validate_mswd(mswd, len(ages))
+
+# ============= EOF =============================================
@@ -16,7 +16,11 @@
 
 # ============= enthought library imports =======================
 #============= standard library imports ========================
-from numpy import asarray, average, vectorize
+import warnings
+
+from numpy import asarray, average, vectorize, unique, bincount, sqrt, where, errstate, ones_like, zeros, \
+    eye, ones
+from numpy.linalg import solve
 
 #============= local library imports  ==========================
 def _kronecker(ii, jj):
@@ -46,23 +50,162 @@ def calculate_mswd(x, errs, k=1, wm=None):
     return mswd_w
 
 
-def calculate_weighted_mean(x, errs, error=0):
+def calculate_weighted_mean(x, errs, error=0, expand_mswd=False):
+    """
+        inverse variance weighted mean
+
+        error: 0 return the error of the mean, sum(1/errs**2)**-0.5
+               1 deprecated. return a constant error of 1, as older callers expect.
+                 a DeprecationWarning is issued
+        expand_mswd: expand the error of the mean by sqrt(mswd) when mswd > 1.
+            only valid with error=0
+    """
+    if error not in (0, 1):
+        raise ValueError('invalid error "{}". use 0, or the deprecated 1'.format(error))
+    if error == 1 and expand_mswd:
+        raise ValueError('expand_mswd requires error=0')
+
     x = asarray(x)
     errs = asarray(errs)
     weights = 1 / errs ** 2
-    #     weights = asarray(map(lambda e: 1 / e ** 2, errs))
-
-    #     wtot = weights.sum()
-    #     wmean = (weights * x).sum() / wtot
 
     wmean, sum_weights = average(x, weights=weights, returned=True)
-    if error == 0:
-        werr = sum_weights ** -0.5
-    elif error == 1:
-        werr = 1
+    if error == 1:
+        warnings.warn('calculate_weighted_mean error=1 is deprecated and returns a constant error of 1',
+                      DeprecationWarning, stacklevel=2)
+        return wmean, 1
+
+    werr = sum_weights ** -0.5
+    if expand_mswd:
+        mswd = calculate_mswd(x, errs, wm=wmean)
+        if mswd > 1:
+            werr *= mswd ** 0.5
     return wmean, werr
 
 
+WEIGHTINGS = ('inverse_variance', 'equal', 'vol_fraction')
+
+
+def calculate_grouped_weighted_mean(x, errs, groups, kind='inverse_variance', weights=None, k=1):
+    """
+        weighted mean of every group in one pass
+
+        x, errs: flat arrays of values and 1sigma errors
+        groups: group label of each value
+        kind: inverse_variance, equal or vol_fraction. vol_fraction requires ``weights``
+            e.g. 39ArK of each step
+
+        return dict of arrays, one entry per group in sorted label order
+            groups, n, mean, error, mswd, valid, expanded_error
+
+        mswd is always calculated about the group mean with the value errors.
+        valid is False for groups with fewer than 2 values.
+        expanded_error is error*sqrt(mswd) for mswd > 1
+    """
+    x = asarray(x, dtype=float)
+    errs = asarray(errs, dtype=float)
+    labels, inv = unique(asarray(groups), return_inverse=True)
+    inv = inv.ravel()
+    m = len(labels)
+
+    if kind == 'inverse_variance':
+        w = 1 / errs ** 2
+    elif kind == 'equal':
+        w = ones_like(x)
+    elif kind == 'vol_fraction':
+        if weights is None:
+            raise ValueError('vol_fraction weighting requires weights')
+        w = asarray(weights, dtype=float)
+    else:
+        raise ValueError('invalid weighting "{}". use one of {}'.format(kind, WEIGHTINGS))
+
+    n = bincount(inv, minlength=m)
+    sw = bincount(inv, w, minlength=m)
+    with errstate(divide='ignore', invalid='ignore'):
+        mean = bincount(inv, w * x, minlength=m) / sw
+        if kind == 'inverse_variance':
+            error = sw ** -0.5
+        else:
+            error = sqrt(bincount(inv, (w * errs) ** 2, minlength=m)) / sw
+
+        dof = n - k
+        ssw = bincount(inv, (x - mean[inv]) ** 2 / errs ** 2, minlength=m)
+        mswd = where(dof > 0, ssw / where(dof > 0, dof, 1), 0)
+
+    valid = zeros(m, dtype=bool)
+    ok = (n >= 2) & (dof > 0)
+    if ok.any():
+        low, high = get_mswd_limits(n[ok], k)
+        valid[ok] = (low <= mswd[ok]) & (mswd[ok] <= high)
+
+    expanded = where(mswd > 1, error * sqrt(mswd), error)
+    return dict(groups=labels, n=n, mean=mean, error=error, mswd=mswd, valid=valid,
+                expanded_error=expanded)
+
+
+def shared_error_factor(groups, loadings):
+    """
+        low rank factor for errors shared within groups, e.g. the J of an irradiation
+        position or a decay constant shared by every analysis
+
+        groups: group label of each value
+        loadings: (n,) sensitivity of each value times the 1sigma shared error
+            e.g. dage/dJ * J_err
+
+        return U (n, n_groups) so the shared covariance is U.dot(U.T)
+    """
+    labels, inv = unique(asarray(groups), return_inverse=True)
+    inv = inv.ravel()
+    u = zeros((len(inv), len(labels)))
+    u[range(len(inv)), inv] = asarray(loadings, dtype=float)
+    return u
+
+
+def calculate_correlated_weighted_mean(x, errs, u=None, k=1):
+    """
+        generalized least squares mean for covariance diag(errs**2) + u.dot(u.T)
+
+        x, errs: values and their independent 1sigma errors
+        u: (n, r) low rank factor of the shared errors, see ``shared_error_factor``.
+            None is the uncorrelated case
+
+        the covariance is never formed. C^-1 is applied with the Woodbury identity
+        so the cost is O(n*r**2)
+
+        return mean, error, mswd
+    """
+    x = asarray(x, dtype=float)
+    errs = asarray(errs, dtype=float)
+    dinv = 1 / errs ** 2
+    n = len(x)
+
+    if u is None:
+        u = zeros((n, 0))
+    u = asarray(u, dtype=float).reshape(n, -1)
+
+    # C^-1 v = D^-1 v - D^-1 U (I + U' D^-1 U)^-1 U' D^-1 v
+    du = u * dinv[:, None]
+    s = eye(u.shape[1]) + u.T.dot(du)
+
+    def cinv(v):
+        dv = v * dinv
+        if not u.shape[1]:
+            return dv
+        return dv - du.dot(solve(s, u.T.dot(dv)))
+
+    one = ones(n)
+    c1 = cinv(one)
+    sw = c1.sum()
+    mean = c1.dot(x) / sw
+    error = sw ** -0.5
+
+    mswd = 0
+    if n > k:
+        r = x - mean
+        mswd = r.dot(cinv(r)) / float(n - k)
+    return mean, error, mswd
+
+
 def validate_mswd(mswd, n, k=1):
     """
          is mswd acceptable based on Mahon 1996
@@ -85,7 +228,7 @@ def get_mswd_limits(n, k=1):
     # use scale parameter to calculate the chi2_reduced from chi2
     from scipy.stats import chi2
 
-    rv = chi2(dof, scale=1 / float(dof))
+    rv = chi2(dof, scale=1. / dof)
     return rv.interval(0.95)
 
 def chi_squared(x, y, sx, sy, a, b, corrcoeffs=None):
@@ -0,0 +1,181 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    recompute F and ages over grids of constants without re-reducing.
+
+    the reduction is split into stages, each depending on a subset of the constants
+
+        interference: k3739, ca3937, ca3637, ca3837, k3839, fixed_k3739
+        atmospheric: atm4036, atm4038, cl3638, lambda_Cl36
+        F: k4039
+        age: lambda_b, lambda_e
+
+    stages upstream of the swept constants are computed once per analysis and
+    reused; only the dependent stages are broadcast over the grid.
+
+        s = ParameterSweep(values, decay_times, j, production_ratios)
+        r = s.sweep(lambda_b=linspace(4.95e-10, 4.98e-10, 50))
+        r['age']  # (50, n_analyses)
+
+    values are nominal. use ``interferences.CompiledProductionRatios.calculate_F``
+    for errors at a single set of constants
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+from numpy import asarray, where, log, errstate, broadcast_to, stack, einsum, atleast_1d
+# ============= local library imports  ==========================
+from ararpy.constants import ArArConstants
+from ararpy.interferences import compile_production_ratios, INTERFERENCE_ROWS, A40, A39, A38, A36
+
+INTERFERENCE_PARAMETERS = ('k3739', 'ca3937', 'ca3637', 'ca3837', 'k3839', 'fixed_k3739')
+ATMOSPHERIC_PARAMETERS = ('atm4036', 'atm4038', 'cl3638', 'lambda_Cl36')
+F_PARAMETERS = ('k4039',)
+AGE_PARAMETERS = ('lambda_b', 'lambda_e')
+SWEEP_PARAMETERS = INTERFERENCE_PARAMETERS + ATMOSPHERIC_PARAMETERS + F_PARAMETERS + AGE_PARAMETERS
+
+
+class ParameterSweep(object):
+    def __init__(self, values, decay_times, j, production_ratios=None, arar_constants=None):
+        """
+            values: (n, 5) decay corrected isotopes a40, a39, a38, a37, a36
+            decay_times: scalar or (n,)
+            j: scalar or (n,)
+        """
+        if arar_constants is None:
+            arar_constants = ArArConstants()
+
+        self.values = asarray(values, dtype=float)
+        n = self.values.shape[0]
+        self.decay_times = broadcast_to(asarray(decay_times, dtype=float), (n,))
+        self.j = broadcast_to(asarray(j, dtype=float), (n,))
+
+        self.compiled = compile_production_ratios(production_ratios, arar_constants)
+        ac = arar_constants
+        # same defaults as CompiledProductionRatios for ratios missing from the set
+        self.base = dict(k4039=1, fixed_k3739=self.compiled.fixed_k3739)
+        self.base.update(self.compiled.values)
+        self.base.update(atm4036=ac.atm4036_v, atm4038=ac.atm4038_v,
+                         lambda_Cl36=ac.lambda_Cl36_v,
+                         lambda_b=ac.lambda_b_v, lambda_e=ac.lambda_e_v)
+        self.age_scalar = float(ac.age_scalar)
+
+        self._cache = {}
+
+    def sweep(self, **grids):
+        """
+            grids: parameter name: 1d array. several parameters are swept together
+                i.e. row i uses the i-th value of every grid
+
+            return dict of F, age (in age_units) and k39 as (n_params, n_analyses) arrays
+        """
+        for k in grids:
+            if k not in SWEEP_PARAMETERS:
+                raise ValueError('cannot sweep "{}". use one of {}'.format(k, SWEEP_PARAMETERS))
+
+        inactive = 'k3739' if self.compiled.fixed_mode else 'fixed_k3739'
+        if inactive in grids:
+            raise ValueError('cannot sweep "{}" with k3739_mode "{}"'.format(
+                inactive, 'Fixed' if self.compiled.fixed_mode else 'Normal'))
+
+        grids = dict((k, atleast_1d(asarray(v, dtype=float))) for k, v in grids.items())
+        lens = set(len(v) for v in grids.values())
+        if len(lens) > 1:
+            raise ValueError('all grids must have the same length')
+
+        def param(k):
+            # (g, 1) column for swept parameters so they broadcast against analyses
+            if k in grids:
+                return grids[k][:, None]
+            return self.base.get(k, 0)
+
+        swept = set(grids)
+        ic = self._stage('interference', swept & set(INTERFERENCE_PARAMETERS),
+                         lambda: self._interference(grids))
+        atm36 = self._stage('atmospheric', swept & set(INTERFERENCE_PARAMETERS + ATMOSPHERIC_PARAMETERS),
+                            lambda: self._atmospheric(ic, param))
+        f, k39 = self._stage('F', swept & set(INTERFERENCE_PARAMETERS + ATMOSPHERIC_PARAMETERS + F_PARAMETERS),
+                             lambda: self._F(ic, atm36, param))
+
+        lk = param('lambda_b') + param('lambda_e')
+        age = self._age(f, lk)
+
+        g = lens.pop() if lens else 1
+        n = self.values.shape[0]
+        return dict(F=broadcast_to(f, (g, n)), k39=broadcast_to(k39, (g, n)),
+                    age=broadcast_to(age, (g, n)))
+
+    def _stage(self, name, swept, func):
+        """
+            stages that do not depend on any swept parameter are computed once and cached
+        """
+        if swept:
+            return func()
+        try:
+            return self._cache[name]
+        except KeyError:
+            v = self._cache[name] = func()
+            return v
+
+    # ===============================================================================
+    # stages
+    # ===============================================================================
+    def _interference(self, grids):
+        """
+            return dict of name: (g, n) or (1, n)
+        """
+        cp = self.compiled
+        keys = [k for k in INTERFERENCE_PARAMETERS if k in grids]
+        if keys:
+            matrices = []
+            for i in range(len(grids[keys[0]])):
+                pr = dict(self.base)
+                for k in keys:
+                    pr[k] = grids[k][i]
+                matrices.append(cp._build_matrix(pr))
+            m = stack(matrices)
+        else:
+            m = cp.matrix[None]
+
+        qs = einsum('gij,nj->gin', m, self.values)
+        ic = dict((name, qs[:, i]) for i, name in enumerate(INTERFERENCE_ROWS))
+        if not cp.allow_negative_ca_correction:
+            neg = ic['ca37'] < 0
+            for name in ('ca36', 'ca37', 'ca38'):
+                ic[name] = where(neg, 0, ic[name])
+        return ic
+
+    def _atmospheric(self, ic, param):
+        v = self.values
+        atm3836 = param('atm4036') / param('atm4038')
+        m = param('cl3638') * param('lambda_Cl36') * self.decay_times
+        base = v[:, A38] - ic['k38'] - ic['ca38']
+        return (v[:, A36] - ic['ca36'] - base * m) / (1 - m * atm3836)
+
+    def _F(self, ic, atm36, param):
+        a40 = self.values[:, A40]
+        k39 = ic['k39']
+        rad40 = a40 - atm36 * param('atm4036') - k39 * param('k4039')
+        zero = k39 == 0
+        with errstate(divide='ignore', invalid='ignore'):
+            f = where(zero, 1, rad40 / where(zero, 1, k39))
+        return f, k39
+
+    def _age(self, f, lk):
+        x = 1 + self.j * f
+        valid = x > 0
+        return where(valid, log(where(valid, x, 1)) / lk, 0) / self.age_scalar
+
+# ============= EOF =============================================
@@ -0,0 +1,132 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import struct
+
+from numpy import linspace, exp
+from numpy.random import RandomState
+from uncertainties import ufloat
+# ============= local library imports  ==========================
+
+# number of analyses, number of heating steps, number of cycles per isotope
+SCALES = {'small': dict(analyses=10, steps=5, cycles=20),
+          'medium': dict(analyses=1000, steps=50, cycles=50),
+          'large': dict(analyses=100000, steps=200, cycles=100)}
+
+SEED = 1234567
+
+INTERFERENCES = dict(k4039=ufloat(0.01, 0.001),
+                     k3839=ufloat(0.012, 0.0001),
+                     k3739=ufloat(0.0002, 0.00001),
+                     ca3937=ufloat(0.0007, 0.00001),
+                     ca3837=ufloat(0.00003, 0.000001),
+                     ca3637=ufloat(0.00027, 0.000001),
+                     cl3638=ufloat(250, 5))
+
+
+def random_state():
+    return RandomState(SEED)
+
+
+def make_isotopes(n, rs=None):
+    """
+        return list of n (a40, a39, a38, a37, a36) ufloat tuples
+    """
+    if rs is None:
+        rs = random_state()
+
+    a39 = rs.uniform(1, 10, n)
+    a40 = a39 * rs.uniform(5, 15, n) + 10
+    a38 = a39 * 0.013 + rs.uniform(0, 0.01, n)
+    a37 = a39 * rs.uniform(0.01, 1, n)
+    a36 = rs.uniform(0.001, 0.05, n)
+
+    def u(v, r):
+        return ufloat(v, abs(v) * r)
+
+    return [(u(i40, 0.001), u(i39, 0.001), u(i38, 0.01), u(i37, 0.005), u(i36, 0.02))
+            for i40, i39, i38, i37, i36 in zip(a40, a39, a38, a37, a36)]
+
+
+def make_spectrum(steps, rs=None):
+    """
+        return ages, errors, k39 for a synthetic step heating experiment with a
+        plateau in the middle third of the release
+    """
+    if rs is None:
+        rs = random_state()
+
+    ages = 28.0 + rs.normal(0, 0.05, steps)
+    ages[:steps // 3] += linspace(3, 0.2, steps // 3)
+    ages[-(steps // 6 or 1):] -= 0.5
+    errors = rs.uniform(0.05, 0.2, steps)
+    k39 = exp(-((linspace(-2, 2, steps)) ** 2)) + 0.05
+    return ages, errors, k39
+
+
+def make_segments(n=3):
+    """
+        return irradiation segments (power, duration, delta t)
+    """
+    return [(1.0, 10.0 * (i + 1), 100.0 + 20 * i) for i in range(n)]
+
+
+def make_blobs(n, cycles, rs=None):
+    """
+        return n packed (x,y) blobs as stored in the database
+    """
+    if rs is None:
+        rs = random_state()
+
+    blobs = []
+    xs = linspace(0, cycles * 4.0, cycles)
+    for _ in range(n):
+        ys = 10 - 0.01 * xs + rs.normal(0, 0.01, cycles)
+        blobs.append(b''.join(struct.pack('>ff', x, y) for x, y in zip(xs, ys)))
+    return blobs
+
+
+def make_series(n, cycles, rs=None):
+    """
+        return xs, ys (n, cycles) arrays of isotope time series
+    """
+    if rs is None:
+        rs = random_state()
+
+    xs = linspace(5, cycles * 4.0, cycles)[None].repeat(n, axis=0)
+    ys = 10 - 0.01 * xs + 1e-5 * xs ** 2 + rs.normal(0, 0.01, xs.shape)
+    return xs, ys
+
+
+class SyntheticAnalysis(object):
+    """
+        minimal analysis object for the isochron functions
+    """
+
+    def __init__(self, a40, a39, a36):
+        self._values = dict(Ar40=a40, Ar39=a39, Ar36=a36)
+
+    def get_interference_corrected_value(self, k):
+        return self._values[k]
+
+
+def make_analyses(n, rs=None):
+    return [SyntheticAnalysis(a40, a39, a36)
+            for a40, a39, _, _, a36 in make_isotopes(n, rs)]
+
+# ============= EOF =============================================
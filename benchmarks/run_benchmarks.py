@@ -0,0 +1,344 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+    benchmarks for the ararpy hot paths.
+
+    run
+        python -m benchmarks.run_benchmarks --scales small medium -o results.json
+
+    compare two runs (e.g. from two commits). exits with 1 if any benchmark slowed
+    down by more than the threshold
+        python -m benchmarks.run_benchmarks --compare old.json new.json --threshold 0.1
+
+    benchmarks that loop over analyses in python are capped at ``LOOP_LIMIT`` calls.
+    every result records ``size``, the number of analyses (or steps) actually timed,
+    so a capped large run is not mistaken for 100k analyses.
+
+    ``isotope.*`` need ararpy.isotope, which only imports on python 2 with the
+    regression package. elsewhere they are recorded as skipped, and the array
+    equivalents ``pipeline.decode_blob`` (for ``BaseMeasurement.unpack_data``) and
+    ``fitting.batch_intercepts`` (for the ``IsotopicMeasurement`` regressor) are timed
+"""
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import traceback
+from timeit import default_timer
+
+import numpy
+# ============= local library imports  ==========================
+from benchmarks.generators import SCALES, INTERFERENCES, random_state, make_isotopes, \
+    make_spectrum, make_segments, make_blobs, make_series, make_analyses
+
+BENCHMARKS = []
+
+# per analysis python loops (ufloat arithmetic) are capped at this many calls so the
+# large scale stays runnable. the array benchmarks use the full scale
+LOOP_LIMIT = 1000
+
+
+class SkipBenchmark(Exception):
+    """
+        raised by a benchmark factory if the benchmark cannot run in this environment
+    """
+
+
+def import_isotope(substitute):
+    """
+        ararpy.isotope is python 2 only and needs the regression package
+    """
+    try:
+        from ararpy import isotope
+    except (ImportError, SyntaxError) as e:
+        raise SkipBenchmark('ararpy.isotope not importable on python {}.{} ({}). '
+                            'see {}'.format(sys.version_info[0], sys.version_info[1], e, substitute))
+    return isotope
+
+
+def loop_count(scale):
+    return min(scale['analyses'], LOOP_LIMIT)
+
+
+def benchmark(name):
+    """
+        register a benchmark. the decorated function takes the scale dict and returns
+        (func, size). func is a zero argument callable that runs the timed work on
+        ``size`` analyses (or steps)
+    """
+
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+
+    return decorator
+
+
+# ===============================================================================
+# benchmarks
+# ===============================================================================
+@benchmark('arar.calculate_F')
+def bench_calculate_F(scale):
+    from ararpy.arar import calculate_F
+
+    isos = make_isotopes(loop_count(scale))
+    return lambda: [calculate_F(i, 100, interferences=INTERFERENCES) for i in isos], len(isos)
+
+
+@benchmark('arar.age_equation')
+def bench_age_equation(scale):
+    from ararpy.arar import age_equation
+    from ararpy.constants import ArArConstants
+
+    rs = random_state()
+    fs = rs.uniform(1, 20, loop_count(scale))
+    ac = ArArConstants()
+    return lambda: [age_equation((0.001, 1e-6), (f, f * 0.001), arar_constants=ac) for f in fs], len(fs)
+
+
+@benchmark('arar.calculate_decay_factor')
+def bench_calculate_decay_factor(scale):
+    from ararpy.arar import calculate_decay_factor
+
+    segments = make_segments()
+    n = loop_count(scale)
+    return lambda: [calculate_decay_factor(0.01975, segments) for _ in range(n)], n
+
+
+@benchmark('plateau.find_plateaus')
+def bench_find_plateaus(scale):
+    from ararpy.plateau import Plateau
+
+    ages, errors, k39 = make_spectrum(scale['steps'])
+
+    def func():
+        p = Plateau(ages, errors, k39, exclude=[])
+        return p.find_plateaus('fleck 1977')
+
+    return func, len(ages)
+
+
+@benchmark('stats.calculate_weighted_mean')
+def bench_weighted_mean(scale):
+    from ararpy.stats import calculate_weighted_mean
+
+    ages, errors, _ = make_spectrum(scale['steps'])
+    n = loop_count(scale)
+    return lambda: [calculate_weighted_mean(ages, errors) for _ in range(n)], n
+
+
+@benchmark('stats.calculate_mswd')
+def bench_mswd(scale):
+    from ararpy.stats import calculate_mswd
+
+    ages, errors, _ = make_spectrum(scale['steps'])
+    n = loop_count(scale)
+    return lambda: [calculate_mswd(ages, errors) for _ in range(n)], n
+
+
+@benchmark('isochron.extract_isochron_xy')
+def bench_extract_isochron_xy(scale):
+    from ararpy.isochron import extract_isochron_xy
+
+    ans = make_analyses(loop_count(scale))
+    return lambda: extract_isochron_xy(ans), len(ans)
+
+
+@benchmark('isotope.unpack_data')
+def bench_unpack_data(scale):
+    BaseMeasurement = import_isotope('pipeline.decode_blob').BaseMeasurement
+
+    blobs = make_blobs(loop_count(scale), scale['cycles'])
+
+    def func():
+        for b in blobs:
+            BaseMeasurement().unpack_data(b)
+
+    return func, len(blobs)
+
+
+@benchmark('isotope.regressor')
+def bench_regressor(scale):
+    IsotopicMeasurement = import_isotope('fitting.batch_intercepts').IsotopicMeasurement
+
+    xs, ys = make_series(loop_count(scale), scale['cycles'])
+
+    def func():
+        for x, y in zip(xs, ys):
+            m = IsotopicMeasurement(xs=x, ys=y)
+            m.set_fit('linear')
+            m.value
+
+    return func, len(xs)
+
+
+@benchmark('pipeline.decode_blob')
+def bench_decode_blob(scale):
+    from ararpy.pipeline import decode_blob
+
+    blobs = make_blobs(loop_count(scale), scale['cycles'])
+    return lambda: [decode_blob(b) for b in blobs], len(blobs)
+
+
+@benchmark('fitting.batch_intercepts')
+def bench_batch_intercepts(scale):
+    from ararpy.fitting import batch_intercepts
+
+    xs, ys = make_series(scale['analyses'], scale['cycles'])
+    mask = xs == xs
+    return lambda: batch_intercepts(xs, ys, mask, 1), len(xs)
+
+
+@benchmark('fitting.batch_polyfit')
+def bench_batch_polyfit(scale):
+    from ararpy.fitting import batch_polyfit
+
+    xs, ys = make_series(scale['analyses'], scale['cycles'])
+    mask = xs == xs
+    return lambda: batch_polyfit(xs, ys, mask, 2), len(xs)
+
+
+# ===============================================================================
+# runner
+# ===============================================================================
+def time_func(func, repeat=5, min_time=0.2, warmup=1):
+    """
+        return timing statistics in seconds per call. the callable is run at least
+        ``repeat`` times and for at least ``min_time`` seconds
+
+        the first ``warmup`` calls are not timed so that jit compilation (e.g. the
+        numba plateau kernel) and import costs are excluded
+    """
+    for _ in range(warmup):
+        func()
+
+    times = []
+    st = default_timer()
+    while len(times) < repeat or (default_timer() - st < min_time and len(times) < 1000):
+        t = default_timer()
+        func()
+        times.append(default_timer() - t)
+
+    times = numpy.asarray(times)
+    return dict(best=float(times.min()),
+                mean=float(times.mean()),
+                std=float(times.std()),
+                n=len(times))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run(scales, names=None, repeat=5):
+    results = {}
+    for name, factory in BENCHMARKS:
+        if names and not any(n in name for n in names):
+            continue
+
+        results[name] = rs = {}
+        for s in scales:
+            try:
+                func, size = factory(SCALES[s])
+                rs[s] = time_func(func, repeat=repeat)
+                rs[s]['size'] = size
+                print('{:<35s} {:<8s} {:>8d} {:>12.6f} s'.format(name, s, size, rs[s]['best']))
+            except SkipBenchmark as e:
+                rs[s] = dict(skipped=str(e))
+                print('{:<35s} {:<8s} skipped. {}'.format(name, s, e))
+            except Exception as e:
+                rs[s] = dict(error='{}: {}'.format(e.__class__.__name__, e),
+                             traceback=traceback.format_exc())
+                print('{:<35s} {:<8s} {}'.format(name, s, rs[s]['error']))
+
+    return dict(meta=dict(commit=git_commit(),
+                          timestamp=time.time(),
+                          python=sys.version,
+                          numpy=numpy.__version__,
+                          platform=platform.platform()),
+                results=results)
+
+
+def compare(old, new, threshold=0.1):
+    """
+        compare the best times of two result dicts
+
+        return list of (name, scale, old, new, ratio, flag). flag is 'regression' if
+        new is slower than old by more than ``threshold`` (fraction) and 'improvement'
+        if it is faster by more than ``threshold``. runs that timed a different number
+        of analyses are flagged 'size changed' and never count as a regression
+    """
+    rows = []
+    for name, scales in sorted(new['results'].items()):
+        for s, r in sorted(scales.items()):
+            try:
+                ro = old['results'][name][s]
+                o = ro['best']
+                n = r['best']
+            except KeyError:
+                continue
+
+            ratio = n / o if o else float('inf')
+            flag = ''
+            if ro.get('size') != r.get('size'):
+                flag = 'size changed'
+            elif ratio > 1 + threshold:
+                flag = 'regression'
+            elif ratio < 1 - threshold:
+                flag = 'improvement'
+            rows.append((name, s, o, n, ratio, flag))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ararpy benchmarks')
+    parser.add_argument('--scales', nargs='+', default=['small'], choices=sorted(SCALES.keys()))
+    parser.add_argument('--bench', nargs='+', help='only run benchmarks whose name contains one of these')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', help='write results to this json file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as rfile:
+            old = json.load(rfile)
+        with open(args.compare[1]) as rfile:
+            new = json.load(rfile)
+
+        rows = compare(old, new, args.threshold)
+        for name, s, o, n, ratio, flag in rows:
+            print('{:<35s} {:<8s} {:>12.6f} {:>12.6f} {:>7.2f}x {}'.format(name, s, o, n, ratio, flag))
+        return int(any(r[-1] == 'regression' for r in rows))
+
+    results = run(args.scales, args.bench, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as wfile:
+            json.dump(results, wfile, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# ============= EOF =============================================
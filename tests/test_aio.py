@@ -0,0 +1,114 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import sys
+import unittest
+
+from numpy import linspace, polyfit, allclose
+from numpy.random import RandomState
+from uncertainties import ufloat
+# ============= local library imports  ==========================
+from ararpy.constants import ArArConstants
+from ararpy.interferences import compile_production_ratios
+from tests.test_shared import PRODUCTION_RATIOS, make_isotopes
+
+
+class Measurement(object):
+    def __init__(self, xs, ys, fit='linear'):
+        self.xs = xs
+        self.offset_xs = xs
+        self.ys = ys
+        self.fit = fit
+
+
+class Analysis(object):
+    def __init__(self, a40, a39, a36):
+        self.isotopes = dict(Ar40=a40, Ar39=a39, Ar36=a36)
+
+    def get_interference_corrected_value(self, k):
+        return self.isotopes[k]
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'asyncio entry points require python 3.7+')
+class AsyncReducerTestCase(unittest.TestCase):
+    def _run(self, coro_func):
+        import asyncio
+        from ararpy.aio import AsyncReducer
+
+        async def main():
+            async with AsyncReducer(max_workers=2, chunk_size=8) as r:
+                return await coro_func(r)
+
+        return asyncio.run(main())
+
+    def test_calculate_F(self):
+        values, errors, dts = make_isotopes(20)
+        expected = compile_production_ratios(PRODUCTION_RATIOS, ArArConstants()).calculate_F(values, errors,
+                                                                                           dts)
+        isotopes = [[ufloat(v, e) for v, e in zip(vs, es)] for vs, es in zip(values, errors)]
+
+        async def single(r):
+            return await r.calculate_F(isotopes[3], dts[3], production_ratios=PRODUCTION_RATIOS)
+
+        result = self._run(single)
+        for k, v in expected.items():
+            self.assertAlmostEqual(result[k], v[3], delta=abs(v[3]) * 1e-12)
+
+        async def stream(r):
+            return [x async for x in r.iter_calculate_F(isotopes, dts, production_ratios=PRODUCTION_RATIOS)]
+
+        results = self._run(stream)
+        self.assertEqual([i for i, _ in results], list(range(20)))
+        self.assertTrue(allclose([r['F'] for _, r in results], expected['F'], rtol=1e-12))
+
+    def test_fit_measurements(self):
+        rs = RandomState(1)
+        xs = linspace(0, 100, 30)
+        ms = [Measurement(xs, 5 + 0.01 * i * xs + rs.normal(0, 0.1, 30)) for i in range(20)]
+
+        async def fit(r):
+            return await r.fit_measurements(ms)
+
+        results = self._run(fit)
+        self.assertEqual(len(results), 20)
+        for m, (v, e) in zip(ms, results):
+            self.assertAlmostEqual(v, polyfit(m.xs, m.ys, 1)[-1], places=10)
+            self.assertTrue(e > 0)
+
+    def test_calculate_isochron(self):
+        rs = RandomState(2)
+        analyses = []
+        for _ in range(10):
+            a39 = rs.uniform(5, 10)
+            a36 = rs.uniform(0.01, 0.1)
+            a40 = a39 * 8 + a36 * 295.5
+            analyses.append(Analysis(ufloat(a40, a40 * 0.001), ufloat(a39, a39 * 0.002),
+                                     ufloat(a36, a36 * 0.01)))
+
+        async def iso(r):
+            return await r.calculate_isochron(analyses)
+
+        iso = self._run(iso)
+        xint, _ = iso.x_intercept
+        self.assertAlmostEqual(1 / xint, 8, places=6)
+        self.assertAlmostEqual(iso.get_trapped_4036().nominal_value, 295.5, places=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
@@ -0,0 +1,162 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from numpy import allclose, arange, array_equal
+# ============= local library imports  ==========================
+from ararpy.constants import ArArConstants
+from ararpy.distributed import SQLiteQueue, DistributedRunner, INDEX_COLUMN, PENDING, RUNNING, DONE, FAILED
+from ararpy.pipeline import StreamingReducer
+from ararpy.results import load_results, ID_COLUMN
+from tests.test_pipeline import make_analyses
+from tests.test_shared import PRODUCTION_RATIOS
+
+
+def make_project(n):
+    """
+        analyses from two irradiations, interleaved so chunks are not in analysis order
+    """
+    analyses = make_analyses(n)
+    for i, a in enumerate(analyses):
+        a['irradiation'] = 'NM-{}'.format(200 + i % 2)
+        a['production_ratios'] = PRODUCTION_RATIOS
+    return analyses
+
+
+class DistributedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'project.queue')
+        self.queue = SQLiteQueue(self.path)
+        self.runner = DistributedRunner(self.queue, max_attempts=2)
+        self.analyses = make_project(9)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _row(self, key):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('SELECT state, worker, attempts FROM chunks WHERE key=?', (key,)).fetchone()
+        finally:
+            conn.close()
+
+    def test_submit(self):
+        n = self.runner.submit(self.analyses, chunk_size=2)
+        # 5 analyses in NM-200 and 4 in NM-201
+        self.assertEqual(n, 5)
+        self.assertEqual(self.runner.status(), {PENDING: 5})
+
+        # the same project again adds nothing
+        self.assertEqual(self.runner.submit(self.analyses, chunk_size=2), 5)
+        self.assertEqual(self.runner.status(), {PENDING: 5})
+
+    def test_resubmit_replace(self):
+        self.runner.submit(self.analyses, chunk_size=2)
+        keys = set(self.queue.keys())
+
+        changed = self.analyses[:-1]
+        self.assertRaises(ValueError, self.runner.submit, changed, chunk_size=2)
+        self.assertEqual(set(self.queue.keys()), keys)
+
+        self.assertEqual(self.runner.submit(changed, chunk_size=2, replace=True), 4)
+        new = set(self.queue.keys())
+        # only the chunk holding the dropped analysis is removed
+        self.assertTrue(new < keys)
+        self.assertEqual(len(keys - new), 1)
+
+    def test_merge_order(self):
+        self.runner.submit(self.analyses, chunk_size=2)
+        self.assertEqual(self.runner.work(), 5)
+        self.assertEqual(self.runner.status(), {DONE: 5})
+
+        merged = self.runner.merge()
+        self.assertTrue(array_equal(merged[INDEX_COLUMN], arange(9)))
+        self.assertEqual(merged[ID_COLUMN], [a['identifier'] for a in self.analyses])
+
+        r = StreamingReducer(PRODUCTION_RATIOS, ArArConstants())
+        expected = r.reduce_chunk(self.analyses)
+        for k in ('Ar40', 'Ar39', 'F', 'F_err', 'age', 'age_err'):
+            self.assertTrue(allclose(merged[k], expected[k], rtol=1e-12, atol=0), k)
+
+        path = self.runner.merge(os.path.join(self.root, 'project.npz'))
+        with load_results(path) as table:
+            self.assertTrue(array_equal(table[INDEX_COLUMN], arange(9)))
+            self.assertEqual(list(table[ID_COLUMN]), merged[ID_COLUMN])
+            self.assertTrue(allclose(table['F'], merged['F'], rtol=0, atol=0))
+
+    def test_lease_expired(self):
+        self.runner.submit(self.analyses, chunk_size=5)
+        key, _ = self.queue.claim('crashed', lease=-1)
+        self.assertEqual(self._row(key)[:2], (RUNNING, 'crashed'))
+
+        # the expired chunk is handed out again and the run completes
+        self.assertEqual(self.runner.work(worker='w1'), 2)
+        self.assertEqual(self.runner.status(), {DONE: 2})
+        self.assertEqual(len(self.runner.merge()[ID_COLUMN]), 9)
+
+    def test_lease_held(self):
+        self.runner.submit(self.analyses, chunk_size=5)
+        self.queue.claim('w0', lease=600)
+        self.assertEqual(self.runner.work(worker='w1', poll=0.01, idle_timeout=0.05), 1)
+        self.assertEqual(self.runner.status(), {DONE: 1, RUNNING: 1})
+        self.assertRaises(RuntimeError, list, self.runner.iter_results())
+
+    def test_fail_stale_worker(self):
+        self.queue.put('a', 0, b'payload')
+        self.queue.claim('w0', lease=-1)
+        self.queue.claim('w1', lease=600)
+
+        # w0 lost its lease so its failure is ignored
+        self.queue.fail('a', 'w0', 'error', 2)
+        self.assertEqual(self._row('a'), (RUNNING, 'w1', 0))
+
+        self.queue.fail('a', 'w1', 'error', 2)
+        self.assertEqual(self._row('a'), (PENDING, 'w1', 1))
+
+    def test_fail_max_attempts(self):
+        self.queue.put('a', 0, b'payload')
+        self.queue.claim('w0', lease=600)
+        self.queue.fail('a', 'w0', 'error', 2)
+        self.assertEqual(self._row('a'), (PENDING, 'w0', 1))
+
+        self.queue.claim('w0', lease=600)
+        self.queue.fail('a', 'w0', 'error', 2)
+        self.assertEqual(self._row('a'), (FAILED, 'w0', 2))
+        self.assertIsNone(self.queue.claim('w0', lease=600))
+
+    def test_work_max_attempts(self):
+        self.analyses[0]['isotopes'] = {}
+        self.runner.submit(self.analyses, chunk_size=5)
+        self.assertEqual(self.runner.work(), 1)
+        self.assertEqual(self.runner.status(), {DONE: 1, FAILED: 1})
+
+        key = [k for k, state, _ in self.queue.results() if state == FAILED][0]
+        self.assertEqual(self._row(key)[2], 2)
+        self.assertRaises(RuntimeError, self.runner.merge)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ============= EOF =============================================
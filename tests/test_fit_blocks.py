@@ -0,0 +1,116 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy import linspace, polyfit, allclose, arange
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy import fit_blocks
+from ararpy.fit_blocks import FitBlockSpec, compile_fit_blocks, parse_fit_blocks, fit_blocks_batch, \
+    predict_fit_blocks, clear_fit_block_specs
+
+FIT_BLOCKS = ['(,10,average)(10,,linear)',
+              '(,5,linear)(5,20,parabolic)(20,,average)',
+              '(3,8,linear)(12,15,cubic)',
+              '(,10,average)(5,,linear)(10,30,parabolic)',
+              '(0,0,linear)(,,average)']
+
+
+def scan(blocks, cnt):
+    """
+        the linear scan IsotopicMeasurement.get_fit_block used before compiling
+    """
+    if cnt < 0:
+        return blocks[-1][2]
+    for s, e, f in blocks:
+        if s < cnt < e:
+            return f
+
+
+class FitBlockSpecTestCase(unittest.TestCase):
+    def setUp(self):
+        clear_fit_block_specs()
+
+    def test_parse(self):
+        self.assertEqual(parse_fit_blocks('(,10,average)(10,,linear)'),
+                         [(-1, 10, 'average'), (10, float('inf'), 'linear')])
+
+    def test_lookup(self):
+        for fit in FIT_BLOCKS:
+            blocks = parse_fit_blocks(fit)
+            spec = FitBlockSpec(blocks)
+            for cnt in arange(-3, 40):
+                self.assertEqual(spec.lookup(cnt), scan(blocks, cnt), (fit, cnt))
+            for cnt in (2.5, 9.99, 10.01, 1e9):
+                self.assertEqual(spec.lookup(cnt), scan(blocks, cnt), (fit, cnt))
+
+    def test_lookup_indices(self):
+        cnts = list(arange(-3, 40)) + [2.5, 9.99, 10.01, 1e9]
+        for fit in FIT_BLOCKS:
+            spec = FitBlockSpec(parse_fit_blocks(fit))
+            idx = spec.lookup_indices(cnts)
+            fits = [spec.fits[i] if i >= 0 else None for i in idx]
+            self.assertEqual(fits, [spec.lookup(c) for c in cnts], fit)
+
+    def test_compile_cached(self):
+        a = compile_fit_blocks('(,10,average)(10,,linear)')
+        self.assertIs(a, compile_fit_blocks('(, 10, average)(10, , linear)'))
+
+    def test_compile_cache_bounded(self):
+        size = fit_blocks.FIT_BLOCK_CACHE_SIZE
+        try:
+            fit_blocks.FIT_BLOCK_CACHE_SIZE = 3
+            first = compile_fit_blocks(FIT_BLOCKS[0])
+            for fit in FIT_BLOCKS[1:3]:
+                compile_fit_blocks(fit)
+            # touch the first so it is the most recently used
+            self.assertIs(compile_fit_blocks(FIT_BLOCKS[0]), first)
+            second = compile_fit_blocks(FIT_BLOCKS[1])
+            compile_fit_blocks(FIT_BLOCKS[3])
+            compile_fit_blocks(FIT_BLOCKS[4])
+
+            # 2 then 0 were the least recently used when 3 and 4 were added
+            self.assertEqual(len(fit_blocks._specs), 3)
+            self.assertIs(compile_fit_blocks(FIT_BLOCKS[1]), second)
+            self.assertIsNot(compile_fit_blocks(FIT_BLOCKS[0]), first)
+        finally:
+            fit_blocks.FIT_BLOCK_CACHE_SIZE = size
+
+    def test_fit_blocks_batch(self):
+        rs = RandomState(0)
+        xs = linspace(0, 100, 30)[None].repeat(4, axis=0)
+        ys = 5 + 0.1 * xs + rs.normal(0, 0.1, xs.shape)
+
+        spec = compile_fit_blocks('(,10,average)(10,,linear)')
+        results = fit_blocks_batch(spec, xs, ys)
+        cnts = arange(xs.shape[1])
+        for (s, e, f), coeffs in results:
+            sel = (s < cnts) & (cnts < e)
+            deg = 0 if f == 'average' else 1
+            for x, y, c in zip(xs, ys, coeffs):
+                self.assertTrue(allclose(c, polyfit(x[sel], y[sel], deg)[::-1]))
+
+        pred = predict_fit_blocks(results, xs)
+        sel = cnts < 10
+        self.assertTrue(allclose(pred[:, sel], results[0][1][:, :1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
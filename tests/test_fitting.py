@@ -0,0 +1,213 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy import linspace, polyfit, polyval, ones, sqrt, abs as nabs, array_equal, array
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.fitting import pad_series, batch_filter_outliers, filter_measurements, calculate_slopes, \
+    fit_shared_timebase, fit_measurements_shared, clear_shared_designs
+
+
+class Measurement(object):
+    def __init__(self, xs, ys, fit='linear', filter_outliers_dict=None):
+        self.xs = xs
+        self.offset_xs = xs
+        self.ys = ys
+        self.fit = fit
+        self.filter_outliers_dict = filter_outliers_dict or {}
+
+
+def make_series(n, seed=0, outliers=3):
+    """
+        n series of varying length with a few large outliers each
+    """
+    rs = RandomState(seed)
+    xs, ys = [], []
+    for i in range(n):
+        m = rs.randint(15, 40)
+        x = linspace(5, 200, m)
+        y = 10 - 0.02 * x + 1e-4 * x ** 2 + rs.normal(0, 0.05, m)
+        idx = rs.choice(m, outliers, replace=False)
+        y[idx] += rs.choice((-1, 1), outliers) * rs.uniform(0.5, 1, outliers)
+        xs.append(x)
+        ys.append(y)
+    return xs, ys
+
+
+def sigma_clip(x, y, degree, iterations, std_devs):
+    """
+        per series reference for batch_filter_outliers
+    """
+    keep = ones(len(x), dtype=bool)
+    for _ in range(iterations):
+        r = y - polyval(polyfit(x[keep], y[keep], degree), x)
+        sd = sqrt((r[keep] ** 2).sum() / (keep.sum() - 1))
+        keep = keep & (nabs(r) <= std_devs * sd)
+    return keep
+
+
+class FilterOutliersTestCase(unittest.TestCase):
+    def _compare(self, degrees, iterations, std_devs):
+        xs, ys = make_series(len(degrees))
+        pxs, pys, mask = pad_series(xs, ys)
+        valid = batch_filter_outliers(pxs, pys, mask, degrees, iterations, std_devs)
+
+        self.assertFalse((valid & ~mask).any())
+        self.assertLess(valid.sum(), mask.sum())
+        for x, y, d, v in zip(xs, ys, degrees, valid):
+            expected = sigma_clip(x, y, d, iterations, std_devs)
+            self.assertTrue(array_equal(v[:len(x)], expected))
+
+    def test_linear(self):
+        self._compare([1] * 10, 1, 2)
+
+    def test_mixed_degrees(self):
+        self._compare([0, 1, 2, 3] * 3, 1, 2)
+
+    def test_iterations(self):
+        self._compare([1, 2] * 5, 3, 2.5)
+
+    def test_filter_measurements(self):
+        xs, ys = make_series(6)
+        fits = ['linear', 'parabolic', 'linear', 'cubic', 'linear', 'parabolic']
+        fods = [dict(filter_outliers=True, iterations=1, std_devs=2),
+                dict(filter_outliers=True, iterations=2, std_devs=2),
+                dict(filter_outliers=False),
+                dict(filter_outliers=True, iterations=1, std_devs=2),
+                dict(filter_outliers=True, iterations=2, std_devs=2),
+                dict(filter_outliers=True, iterations=1, std_devs=3)]
+        ms = [Measurement(x, y, f, d) for x, y, f, d in zip(xs, ys, fits, fods)]
+        filter_measurements(ms)
+
+        degrees = dict(linear=1, parabolic=2, cubic=3)
+        for m, fod in zip(ms, fods):
+            mask = getattr(m, 'outlier_mask', None)
+            if not fod['filter_outliers']:
+                self.assertIsNone(mask)
+                continue
+
+            expected = sigma_clip(m.xs, m.ys, degrees[m.fit], fod['iterations'], fod['std_devs'])
+            self.assertTrue(array_equal(mask, expected))
+
+
+class SlopesTestCase(unittest.TestCase):
+    def setUp(self):
+        xs, ys = make_series(8, outliers=0)
+        # large time values so an uncentered sum would cancel
+        self.measurements = [Measurement(x + 1e6 * i, y) for i, (x, y) in enumerate(zip(xs, ys))]
+
+    def test_calculate_slopes(self):
+        slopes = calculate_slopes(self.measurements)
+        for m, s in zip(self.measurements, slopes):
+            e = polyfit(m.xs - m.xs.mean(), m.ys, 1)[0]
+            self.assertAlmostEqual(s, e, delta=abs(e) * 1e-8)
+
+    def test_calculate_slopes_last_n(self):
+        slopes = calculate_slopes(self.measurements, n=10)
+        for m, s in zip(self.measurements, slopes):
+            x = m.xs[-10:]
+            e = polyfit(x - x.mean(), m.ys[-10:], 1)[0]
+            self.assertAlmostEqual(s, e, delta=abs(e) * 1e-8)
+
+    def test_degenerate(self):
+        ms = [Measurement(linspace(0, 1, 5), linspace(0, 2, 5)),
+              Measurement(ones(3), linspace(0, 2, 3)),
+              Measurement(ones(1), ones(1))]
+        slopes = calculate_slopes(ms)
+        self.assertAlmostEqual(slopes[0], 2, 12)
+        self.assertEqual(list(slopes[1:]), [0, 0])
+
+
+def reference_fit(x, y, degree):
+    """
+        per isotope polyfit. return intercept, error and covariance in increasing powers
+    """
+    c, cov = polyfit(x, y, degree, cov=True)
+    cov = cov[::-1, ::-1]
+    return c[-1], sqrt(cov[0, 0]), cov
+
+
+class SharedTimebaseTestCase(unittest.TestCase):
+    def setUp(self):
+        clear_shared_designs()
+        rs = RandomState(2)
+        self.xs = linspace(5, 200, 30)
+        self.ys = array([a - b * self.xs + c * self.xs ** 2 + rs.normal(0, 0.05, len(self.xs))
+                         for a, b, c in rs.uniform((1, 0, 0), (100, 0.1, 1e-4), (5, 3))])
+
+    def _compare(self, x, y, degree, v, e, cov):
+        rv, re, rcov = reference_fit(x, y, degree)
+        self.assertAlmostEqual(v, rv, delta=abs(rv) * 1e-10)
+        self.assertAlmostEqual(e, re, delta=re * 1e-8)
+        self.assertTrue(nabs(cov - rcov).max() <= nabs(rcov).max() * 1e-8)
+
+    def test_fit_shared_timebase(self):
+        for degree in (0, 1, 2, 3):
+            vs, es, covs = fit_shared_timebase(self.xs, self.ys, degree)
+            for y, v, e, cov in zip(self.ys, vs, es, covs):
+                self.assertEqual(cov.shape, (degree + 1, degree + 1))
+                self._compare(self.xs, y, degree, v, e, cov)
+
+    def test_mixed_degrees_and_masks(self):
+        rs = RandomState(3)
+        degrees = [1, 2, 1, 0, 2]
+        masks = rs.uniform(size=self.ys.shape) > 0.2
+        # isotopes 0 and 2 share a degree and mask so are fit together
+        masks[2] = masks[0]
+
+        vs, es, covs = fit_shared_timebase(self.xs, self.ys, degrees, masks)
+        for i, (y, d, m) in enumerate(zip(self.ys, degrees, masks)):
+            self._compare(self.xs[m], y[m], d, vs[i], es[i], covs[i])
+
+            # same answer as fitting the isotope on its own
+            v, e, cov = fit_shared_timebase(self.xs, y[None, :], d, m[None, :])
+            self.assertAlmostEqual(vs[i], v[0], delta=abs(v[0]) * 1e-12)
+            self.assertAlmostEqual(es[i], e[0], delta=e[0] * 1e-12)
+
+    def test_large_times(self):
+        xs = self.xs + 1e6
+        vs, es, covs = fit_shared_timebase(xs, self.ys, 1)
+        for y, v, e in zip(self.ys, vs, es):
+            c, cov = polyfit(xs - xs.mean(), y, 1, cov=True)
+            # intercept at x=0 extrapolated from the centered fit
+            rv = c[1] - c[0] * xs.mean()
+            self.assertAlmostEqual(v, rv, delta=abs(rv) * 1e-8)
+
+    def test_fit_measurements_shared(self):
+        other = linspace(0, 100, 20)
+        ms = [Measurement(self.xs, self.ys[0], 'linear'),
+              Measurement(self.xs, self.ys[1], 'parabolic'),
+              Measurement(other, 2 + 0.1 * other, 'average'),
+              Measurement(self.xs, self.ys[2], 'linear', dict(filter_outliers=True))]
+        ms[3].value, ms[3].error = 1.5, 0.1
+
+        results = fit_measurements_shared(ms)
+        for m, (v, e) in zip(ms[:3], results):
+            rv, re, _ = reference_fit(m.offset_xs, m.ys, {'linear': 1, 'parabolic': 2, 'average': 0}[m.fit])
+            self.assertAlmostEqual(v, rv, delta=abs(rv) * 1e-10)
+            self.assertAlmostEqual(e, re, delta=re * 1e-8)
+
+        # filtering without a mask is not shared so the measurement's own fit is used
+        self.assertEqual(results[3], (1.5, 0.1))
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
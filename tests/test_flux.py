@@ -0,0 +1,116 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy import linspace, meshgrid, allclose, array, sqrt, diag
+from numpy.linalg import inv
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.arar import calculate_flux
+from ararpy.constants import ArArConstants
+from ararpy.flux import calculate_fluxes, FluxSurface, FluxModel, surface_design
+
+MONITOR_AGE = (28.201e6, 0.023e6)
+
+
+def make_monitors(model='plane', seed=0, noise=0):
+    rs = RandomState(seed)
+    x, y = meshgrid(linspace(-1, 1, 4), linspace(-1, 1, 4))
+    x, y = x.ravel(), y.ravel()
+    coeffs = [0.002, 1e-5, -2e-5]
+    if model == 'bowl':
+        coeffs += [3e-6, 2e-6, -1e-6]
+    j = surface_design(x, y, model).dot(coeffs)
+    j_err = rs.uniform(1e-7, 3e-7, len(x))
+    return x, y, j + noise * j_err * rs.normal(size=len(x)), j_err, array(coeffs)
+
+
+class FluxTestCase(unittest.TestCase):
+    def test_calculate_fluxes(self):
+        rs = RandomState(0)
+        f = rs.uniform(5, 15, 10)
+        f_err = f * 0.001
+        j, je = calculate_fluxes(f, f_err, *MONITOR_AGE)
+        for fi, fe, ji, jei in zip(f, f_err, j, je):
+            ej, eje = calculate_flux((fi, fe), MONITOR_AGE)
+            self.assertAlmostEqual(ji / ej, 1, 12)
+            self.assertAlmostEqual(jei / eje, 1, 9)
+
+    def test_calculate_fluxes_constants(self):
+        ac = ArArConstants()
+        j, je = calculate_fluxes([10.], [0.01], 28e6, 0, arar_constants=ac)
+        self.assertAlmostEqual(j[0] / calculate_flux((10., 0.01), (28e6, 0), arar_constants=ac)[0], 1, 12)
+
+    def test_calculate_fluxes_zero_f(self):
+        j, je = calculate_fluxes([0, 10.], [0.1, 0.01], *MONITOR_AGE)
+        self.assertEqual((j[0], je[0]), (1, 0))
+        self.assertEqual(calculate_flux((0, 0.1), MONITOR_AGE), (1, 0))
+
+    def test_plane(self):
+        x, y, j, je, coeffs = make_monitors()
+        s = FluxSurface(x, y, j, je)
+        self.assertTrue(allclose(s.coefficients, coeffs, rtol=1e-9, atol=1e-15))
+        self.assertAlmostEqual(s.mswd, 0, 12)
+        self.assertTrue(allclose(s.predict(x, y), j, rtol=1e-9))
+
+    def test_bowl(self):
+        x, y, j, je, coeffs = make_monitors('bowl')
+        s = FluxSurface(x, y, j, je, model='bowl')
+        self.assertTrue(allclose(s.coefficients, coeffs, rtol=1e-9, atol=1e-15))
+
+    def test_weighted_fit(self):
+        x, y, j, je, coeffs = make_monitors(noise=1)
+        s = FluxSurface(x, y, j, je)
+
+        # generalized least squares
+        a = surface_design(x, y)
+        w = diag(1 / je ** 2)
+        cov = inv(a.T.dot(w).dot(a))
+        c = cov.dot(a.T).dot(w).dot(j)
+        self.assertTrue(allclose(s.coefficients, c, rtol=1e-9))
+        self.assertTrue(allclose(s.covariance, cov, rtol=1e-9))
+        self.assertTrue(allclose(s.predict_error(x[:2], y[:2]),
+                                 sqrt(diag(a[:2].dot(cov).dot(a[:2].T))), rtol=1e-9))
+        self.assertGreater(s.mswd, 0)
+
+    def test_zero_error(self):
+        x, y, j, je, _ = make_monitors()
+        je[3] = 0
+        with self.assertRaises(ValueError):
+            FluxSurface(x, y, j, je)
+
+    def test_flux_model(self):
+        x, y, j, je, _ = make_monitors()
+        fm = FluxModel()
+        s = fm.fit_level('A', x, y, j, je)
+        self.assertIs(fm.fit_level('A', x, y, j.copy(), je), s)
+        self.assertIsNot(fm.fit_level('A', x, y, j * 1.01, je), s)
+        self.assertIsNot(fm.fit_level('A', x, y, j, je, model='bowl'), fm.get_surface('A'))
+
+        uj, uje = fm.evaluate('A', [0], [0])
+        self.assertAlmostEqual(uj[0] / 0.00202, 1, 9)
+
+        fm.clear('A')
+        with self.assertRaises(KeyError):
+            fm.get_surface('A')
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
@@ -0,0 +1,60 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy import linspace, abs as nabs, maximum
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.ideogram import calculate_ideogram
+
+
+class IdeogramTestCase(unittest.TestCase):
+    def _compare(self, ages, errors, grid):
+        _, fft = calculate_ideogram(ages, errors, grid, method='fft')
+        _, direct = calculate_ideogram(ages, errors, grid, method='direct')
+        peak = direct.max()
+        self.assertLess(nabs(fft - direct).max() / peak, 1e-3)
+        self.assertLess((nabs(fft - direct) / maximum(direct, 1e-2 * peak)).max(), 1e-2)
+
+    def test_fft_wide_errors(self):
+        rs = RandomState(0)
+        ages = rs.uniform(0, 100, 5000)
+        errors = rs.uniform(0.5, 5, 5000)
+        self._compare(ages, errors, linspace(-20, 120, 2000))
+
+    def test_fft_errors_below_grid_spacing(self):
+        # grid spacing 0.45, so errors span narrow (exact) and wide (fft) ages
+        rs = RandomState(1)
+        ages = rs.uniform(0, 4500, 3000)
+        errors = rs.uniform(0.01, 5, 3000)
+        self._compare(ages, errors, linspace(0, 4500, 10000))
+
+    def test_auto_matches_direct(self):
+        rs = RandomState(2)
+        ages = rs.uniform(0, 4500, 20000)
+        errors = rs.uniform(0.01, 5, 20000)
+        grid = linspace(0, 4500, 2000)
+        _, auto = calculate_ideogram(ages, errors, grid)
+        _, direct = calculate_ideogram(ages, errors, grid, method='direct')
+        self.assertLess(nabs(auto - direct).max() / direct.max(), 1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
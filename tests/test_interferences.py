@@ -0,0 +1,171 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from numpy import allclose
+from uncertainties import ufloat
+# ============= local library imports  ==========================
+from ararpy.arar import calculate_F
+from ararpy.constants import ArArConstants
+from ararpy.interferences import compile_production_ratios, DERIVED_QUANTITIES
+from ararpy.pipeline import StreamingReducer
+from ararpy.results import F_QUANTITIES, flatten_F_result
+from tests.test_pipeline import make_analyses
+from tests.test_shared import PRODUCTION_RATIOS, make_isotopes
+
+
+def scalar_F(values, errors, decay_times, production_ratios, arar_constants=None):
+    """
+        per analysis ``arar.calculate_F``. return dict of name: (values, errors)
+    """
+    pr = dict((k, ufloat(*v)) for k, v in production_ratios.items())
+    rows = []
+    for vs, es, dt in zip(values, errors, decay_times):
+        isos = [ufloat(v, e) for v, e in zip(vs, es)]
+        rows.append(flatten_F_result(calculate_F(isos, dt, interferences=pr, arar_constants=arar_constants)))
+
+    return dict((k, ([r[i].nominal_value for r in rows], [r[i].std_dev for r in rows]))
+                for i, k in enumerate(F_QUANTITIES))
+
+
+def scalar_derived(values, errors, decay_times, production_ratios, arar_constants=None):
+    """
+        K/Ca, K/Cl and %40Ar* from per analysis ``arar.calculate_F``. return dict of
+        name: (values, errors)
+    """
+    if arar_constants is None:
+        arar_constants = ArArConstants()
+
+    pr = dict((k, ufloat(*v)) for k, v in production_ratios.items())
+    ca_k = pr.get('ca_k', 1)
+    cl_k = pr.get('cl_k', 1)
+    atm3836 = arar_constants.atm3836.nominal_value
+
+    rows = []
+    for vs, es, dt in zip(values, errors, decay_times):
+        isos = [ufloat(v, e) for v, e in zip(vs, es)]
+        _, _, non_ar, computed, ic = calculate_F(isos, dt, interferences=pr, arar_constants=arar_constants)
+        k39 = computed['k39']
+        cl38 = isos[2] - ic['Ar36'] * atm3836 - non_ar['k38'] - non_ar['ca38']
+        rows.append((k39 / non_ar['ca37'] / ca_k, k39 / cl38 / cl_k, computed['rad40_percent']))
+
+    return dict((k, ([r[i].nominal_value for r in rows], [r[i].std_dev for r in rows]))
+                for i, k in enumerate(DERIVED_QUANTITIES))
+
+
+class CompiledProductionRatiosTestCase(unittest.TestCase):
+    def _compare(self, production_ratios, arar_constants=None):
+        values, errors, dts = make_isotopes(20)
+        cpr = compile_production_ratios(production_ratios, arar_constants)
+        cols = cpr.calculate_F(values, errors, dts)
+        expected = scalar_F(values, errors, dts, production_ratios, arar_constants)
+        for k, (v, e) in expected.items():
+            self.assertTrue(allclose(cols[k], v, rtol=1e-9, atol=1e-12), k)
+            self.assertTrue(allclose(cols['{}_err'.format(k)], e, rtol=1e-6, atol=1e-12), k)
+
+    def test_calculate_F(self):
+        self._compare(PRODUCTION_RATIOS)
+
+    def test_calculate_F_no_production_ratio_errors(self):
+        pr = dict((k, (v, 0)) for k, (v, e) in PRODUCTION_RATIOS.items())
+        self._compare(pr)
+
+    def test_calculate_F_fixed_k3739(self):
+        ac = ArArConstants()
+        ac.k3739_mode = 'Fixed'
+        self._compare(PRODUCTION_RATIOS, ac)
+
+
+class DerivedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.values, self.errors, self.dts = make_isotopes(20)
+
+    def _compare(self, cols, expected, names=DERIVED_QUANTITIES):
+        for k in names:
+            v, e = expected[k]
+            self.assertTrue(allclose(cols[k], v, rtol=1e-9, atol=0), k)
+            self.assertTrue(allclose(cols['{}_err'.format(k)], e, rtol=1e-6, atol=0), k)
+
+    def test_calculate_derived(self):
+        cpr = compile_production_ratios(PRODUCTION_RATIOS)
+        cols = cpr.calculate_derived(self.values, self.errors, self.dts)
+        self._compare(cols, scalar_derived(self.values, self.errors, self.dts, PRODUCTION_RATIOS))
+
+    def test_kca_only(self):
+        cpr = compile_production_ratios(PRODUCTION_RATIOS)
+        cols = cpr.calculate_derived(self.values, self.errors, self.dts, ('kca',))
+        self.assertEqual(sorted(cols), ['kca', 'kca_err'])
+        self._compare(cols, scalar_derived(self.values, self.errors, self.dts, PRODUCTION_RATIOS), ('kca',))
+
+    def test_kcl_without_decay(self):
+        # no 36Cl has grown in so K/Cl comes from 38ArCl alone
+        dts = self.dts * 0
+        cpr = compile_production_ratios(PRODUCTION_RATIOS)
+        cols = cpr.calculate_derived(self.values, self.errors, dts, ('kcl',))
+        self.assertTrue((cols['kcl'] != 0).all())
+        self._compare(cols, scalar_derived(self.values, self.errors, dts, PRODUCTION_RATIOS), ('kcl',))
+
+    def test_conversion_ratios(self):
+        pr = dict(PRODUCTION_RATIOS, ca_k=(1.96, 0.02), cl_k=(0.25, 0.01))
+        cpr = compile_production_ratios(pr)
+        cols = cpr.calculate_derived(self.values, self.errors, self.dts)
+        self._compare(cols, scalar_derived(self.values, self.errors, self.dts, pr))
+
+    def test_calculate_F_derived(self):
+        cpr = compile_production_ratios(PRODUCTION_RATIOS)
+        cols = cpr.calculate_F(self.values, self.errors, self.dts, derived=DERIVED_QUANTITIES)
+        self.assertNotIn('cl38', cols)
+
+        derived = cpr.calculate_derived(self.values, self.errors, self.dts)
+        for k in ('kca', 'kcl'):
+            self.assertTrue(allclose(cols[k], derived[k], rtol=1e-14, atol=0), k)
+            self.assertTrue(allclose(cols['{}_err'.format(k)], derived['{}_err'.format(k)], rtol=1e-14), k)
+
+        expected = cpr.calculate_F(self.values, self.errors, self.dts)
+        self.assertEqual(sorted(set(cols) - set(expected)), ['kca', 'kca_err', 'kcl', 'kcl_err'])
+        for k, v in expected.items():
+            self.assertTrue(allclose(cols[k], v, rtol=0, atol=0), k)
+
+    def test_invalid(self):
+        cpr = compile_production_ratios(PRODUCTION_RATIOS)
+        self.assertRaises(ValueError, cpr.calculate_derived, self.values, self.errors, self.dts, ('kar',))
+        self.assertRaises(ValueError, cpr.calculate_F, self.values, self.errors, self.dts, derived=('kar',))
+
+    def test_streaming_reducer_single_reduction(self):
+        # without production ratio errors there are no extra reductions for the
+        # irradiation error of F
+        pr = dict((k, (v, 0)) for k, (v, e) in PRODUCTION_RATIOS.items())
+        r = StreamingReducer(pr, derived=('kca', 'kcl'))
+        cpr = r.production_ratios
+        with mock.patch.object(cpr, '_reduce', side_effect=cpr._reduce) as reduce:
+            cols = r.reduce_chunk(make_analyses(4))
+            self.assertEqual(reduce.call_count, 1)
+
+        for k in ('kca', 'kcl', 'rad40_percent', 'F', 'age'):
+            self.assertEqual(len(cols[k]), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
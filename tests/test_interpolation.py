@@ -0,0 +1,151 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy import linspace, polyfit, polyval, sqrt, column_stack, array, allclose, zeros, ones
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.interpolation import interpolate_references, INTERPOLATION_KINDS
+from ararpy.stats import calculate_weighted_mean, calculate_mswd
+
+DEGREES = {'average': 0, 'linear': 1, 'parabolic': 2, 'cubic': 3}
+
+
+def make_references(m=12, seed=0):
+    """
+        blanks drifting with time. the first column is noisy with small errors so
+        its mswd is above 1, the second has large errors
+    """
+    rs = RandomState(seed)
+    t = 1.4e9 + linspace(0, 86400, m) + rs.uniform(-600, 600, m)
+    dt = (t - t[0]) / 86400.
+    e1 = rs.uniform(0.001, 0.003, m)
+    e2 = rs.uniform(0.05, 0.2, m)
+    v1 = 0.5 + 0.1 * dt + rs.normal(0, 0.01, m)
+    v2 = 2 - 0.3 * dt + 0.2 * dt ** 2 + rs.normal(0, 0.01, m)
+    return t, column_stack((v1, v2)), column_stack((e1, e2))
+
+
+def reference_fit(t, v, e, times, degree):
+    """
+        weighted polyfit of one column. the error is the propagated reference errors
+        expanded by sqrt(mswd) when mswd > 1
+    """
+    x, xi = (t - t[0]) / 86400., (times - t[0]) / 86400.
+    c, cov = polyfit(x, v, degree, w=1 / e, cov='unscaled')
+    r = (v - polyval(c, x)) / e
+    mswd = (r ** 2).sum() / max(len(x) - degree - 1, 1)
+
+    a = xi[:, None] ** array(range(degree, -1, -1))
+    err = sqrt((a.dot(cov) * a).sum(axis=1) * max(mswd, 1))
+    return polyval(c, xi), err
+
+
+class InterpolateReferencesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.t, self.v, self.e = make_references()
+        self.times = linspace(self.t[0] - 3600, self.t[-1] + 3600, 25)
+
+    def test_weighted_fit(self):
+        for kind in ('linear', 'parabolic', 'cubic'):
+            vs, es = interpolate_references(self.t, self.v, self.e, self.times, kind)
+            self.assertEqual(vs.shape, (len(self.times), 2))
+            for k in range(2):
+                rv, re = reference_fit(self.t, self.v[:, k], self.e[:, k], self.times, DEGREES[kind])
+                self.assertTrue(allclose(vs[:, k], rv, rtol=1e-9, atol=0), kind)
+                self.assertTrue(allclose(es[:, k], re, rtol=1e-7, atol=0), kind)
+
+    def test_average(self):
+        vs, es = interpolate_references(self.t, self.v, self.e, self.times, 'average')
+        for k in range(2):
+            wm, we = calculate_weighted_mean(self.v[:, k], self.e[:, k])
+            mswd = calculate_mswd(self.v[:, k], self.e[:, k], wm=wm)
+            self.assertTrue(allclose(vs[:, k], wm, rtol=1e-12))
+            self.assertTrue(allclose(es[:, k], we * sqrt(max(mswd, 1)), rtol=1e-10))
+
+    def test_errors_weight_the_fit(self):
+        # a reference with a huge error is ignored by the fit
+        e = self.e.copy()
+        v = self.v.copy()
+        v[5] += 100
+        e[5] = 1e6
+        vs, _ = interpolate_references(self.t, v, e, self.times, 'linear')
+        ref, _ = interpolate_references(self.t[self.t != self.t[5]], self.v[self.t != self.t[5]],
+                                        self.e[self.t != self.t[5]], self.times, 'linear')
+        self.assertTrue(allclose(vs, ref, rtol=1e-6))
+
+    def test_zero_errors_unweighted(self):
+        e = self.e.copy()
+        e[:, 1] = 0
+        vs, es = interpolate_references(self.t, self.v, e, self.times, 'linear')
+
+        x, xi = self.t - self.t[0], self.times - self.t[0]
+        c, cov = polyfit(x, self.v[:, 1], 1, cov=True)
+        self.assertTrue(allclose(vs[:, 1], polyval(c, xi), rtol=1e-9))
+        a = column_stack((xi, ones(len(xi))))
+        self.assertTrue(allclose(es[:, 1], sqrt((a.dot(cov) * a).sum(axis=1)), rtol=1e-7))
+
+        # the other column is still weighted
+        rv, _ = reference_fit(self.t, self.v[:, 0], self.e[:, 0], self.times, 1)
+        self.assertTrue(allclose(vs[:, 0], rv, rtol=1e-9))
+
+    def test_unsorted_references(self):
+        idx = RandomState(1).permutation(len(self.t))
+        a = interpolate_references(self.t, self.v, self.e, self.times, 'parabolic')
+        b = interpolate_references(self.t[idx], self.v[idx], self.e[idx], self.times, 'parabolic')
+        self.assertTrue(allclose(a[0], b[0], rtol=1e-12))
+        self.assertTrue(allclose(a[1], b[1], rtol=1e-10))
+
+    def test_bracketing(self):
+        t = array([0., 10., 20.])
+        v = array([1., 2., 4.])
+        e = array([0.1, 0.2, 0.4])
+        times = array([-5., 5., 10., 15., 25.])
+
+        vs, es = interpolate_references(t, v, e, times, 'preceding')
+        self.assertEqual(list(vs[:, 0]), [1, 1, 2, 2, 4])
+        vs, es = interpolate_references(t, v, e, times, 'following')
+        self.assertEqual(list(vs[:, 0]), [1, 2, 4, 4, 4])
+
+        vs, es = interpolate_references(t, v, e, times, 'bracketing_average')
+        self.assertTrue(allclose(vs[:, 0], [1, 1.5, 3, 3, 4]))
+        self.assertAlmostEqual(es[1, 0], sqrt(0.05 ** 2 + 0.1 ** 2))
+
+        vs, es = interpolate_references(t, v, e, times, 'bracketing_interpolate')
+        self.assertTrue(allclose(vs[:, 0], [1, 1.5, 2, 3, 4]))
+        self.assertAlmostEqual(es[3, 0], sqrt(0.1 ** 2 + 0.2 ** 2))
+
+    def test_no_references(self):
+        for kind in INTERPOLATION_KINDS:
+            with self.assertRaises(ValueError) as cm:
+                interpolate_references([], zeros((0, 2)), zeros((0, 2)), self.times, kind)
+            self.assertIn('no reference', str(cm.exception))
+
+    def test_too_few_references(self):
+        self.assertRaises(ValueError, interpolate_references, self.t[:2], self.v[:2], self.e[:2],
+                          self.times, 'parabolic')
+
+    def test_invalid_kind(self):
+        self.assertRaises(ValueError, interpolate_references, self.t, self.v, self.e, self.times, 'spline')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ============= EOF =============================================
@@ -0,0 +1,169 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy import sqrt, linspace
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.isochron import IncrementalIsochron
+
+
+def make_points(n, seed=0, slope=-0.0338 / 0.05, intercept=1 / 295.5, scatter=1):
+    """
+        inverse isochron points with correlated errors
+    """
+    rs = RandomState(seed)
+    xs = linspace(0.005, 0.045, n) * rs.uniform(0.9, 1.1, n)
+    ys = intercept + slope * xs
+    xerrs = xs * rs.uniform(0.002, 0.01, n)
+    yerrs = rs.uniform(2e-5, 6e-5, n)
+    ys = ys + rs.normal(0, yerrs * scatter)
+    xs = xs + rs.normal(0, xerrs * scatter)
+    rs_ = rs.uniform(0, 0.5, n)
+    return xs, ys, xerrs, yerrs, rs_
+
+
+def york(xs, ys, xerrs, yerrs, rs, iterations=1000):
+    """
+        reference York 2004 regression. plain fixed point iteration from the OLS slope
+
+        return slope, intercept, slope_err, intercept_err, mswd
+    """
+    wx, wy = 1 / xerrs ** 2, 1 / yerrs ** 2
+    alpha = sqrt(wx * wy)
+    dx = xs - xs.mean()
+    b = (dx * (ys - ys.mean())).sum() / (dx * dx).sum()
+    for _ in range(iterations):
+        w = wx * wy / (wx + b * b * wy - 2 * b * rs * alpha)
+        xb, yb = (w * xs).sum() / w.sum(), (w * ys).sum() / w.sum()
+        u, v = xs - xb, ys - yb
+        beta = w * (u / wy + b * v / wx - (b * u + v) * rs / alpha)
+        nb = (w * beta * v).sum() / (w * beta * u).sum()
+        if abs(nb - b) <= 1e-15 * abs(nb):
+            b = nb
+            break
+        b = nb
+
+    w = wx * wy / (wx + b * b * wy - 2 * b * rs * alpha)
+    xb, yb = (w * xs).sum() / w.sum(), (w * ys).sum() / w.sum()
+    u, v = xs - xb, ys - yb
+    beta = w * (u / wy + b * v / wx - (b * u + v) * rs / alpha)
+    a = yb - b * xb
+
+    xadj = xb + beta
+    xa = (w * xadj).sum() / w.sum()
+    sb = (w * (xadj - xa) ** 2).sum() ** -0.5
+    sa = (1 / w.sum() + xa ** 2 * sb ** 2) ** 0.5
+    mswd = (w * (ys - b * xs - a) ** 2).sum() / (len(xs) - 2)
+    return b, a, sb, sa, mswd
+
+
+def cold(iso):
+    """
+        a fresh fit of the points ``iso`` currently includes
+    """
+    sel = iso.included
+    c = IncrementalIsochron(iso.xs[sel], iso.ys[sel], iso.xerrs[sel], iso.yerrs[sel], iso.rs[sel],
+                            tol=iso.tol)
+    c.solve()
+    return c
+
+
+class IncrementalIsochronTestCase(unittest.TestCase):
+    def setUp(self):
+        self.points = make_points(15)
+
+    def _compare(self, iso, expected, rtol=1e-7):
+        iso.solve()
+        if isinstance(expected, IncrementalIsochron):
+            expected = (expected.slope, expected.intercept, expected.slope_err,
+                        expected.intercept_err, expected.mswd)
+
+        for name, e in zip(('slope', 'intercept', 'slope_err', 'intercept_err', 'mswd'), expected):
+            v = getattr(iso, name)
+            self.assertAlmostEqual(v, e, delta=abs(e) * rtol, msg=name)
+
+    def test_reference(self):
+        iso = IncrementalIsochron(*self.points)
+        self._compare(iso, york(*self.points))
+
+    def test_tight_tolerance(self):
+        iso = IncrementalIsochron(*self.points, tol=1e-14)
+        self._compare(iso, york(*self.points), rtol=1e-11)
+
+    def test_add(self):
+        xs, ys, xerrs, yerrs, rs = make_points(20, seed=1)
+        iso = IncrementalIsochron(xs[:10], ys[:10], xerrs[:10], yerrs[:10], rs[:10])
+        iso.solve()
+        for i in range(10, 20):
+            iso.add(xs[i], ys[i], xerrs[i], yerrs[i], rs[i])
+            self._compare(iso, cold(iso))
+        self._compare(iso, york(xs, ys, xerrs, yerrs, rs))
+
+    def test_exclude(self):
+        iso = IncrementalIsochron(*self.points)
+        iso.solve()
+        rs = RandomState(2)
+        for _ in range(30):
+            idx = rs.randint(len(self.points[0]))
+            iso.set_excluded(idx, bool(iso.included[idx]))
+            if iso.included.sum() > 2:
+                self._compare(iso, cold(iso))
+
+    def test_exclude_include(self):
+        iso = IncrementalIsochron(*self.points)
+        iso.solve()
+        expected = (iso.slope, iso.intercept, iso.slope_err, iso.intercept_err, iso.mswd)
+
+        iso.set_excluded(3)
+        iso.set_excluded(7)
+        self._compare(iso, cold(iso))
+
+        iso.set_excluded(3, False)
+        iso.set_excluded(7, False)
+        self._compare(iso, expected)
+
+    def test_slope_sign_change(self):
+        # a nearly flat isochron with large scatter. excluding points flips the slope
+        xs, ys, xerrs, yerrs, rs = make_points(12, seed=3, slope=-0.001, scatter=5)
+        iso = IncrementalIsochron(xs, ys, xerrs, yerrs, rs)
+        iso.solve()
+        slopes = [iso.slope]
+        for i in range(0, 12, 2):
+            iso.set_excluded(i)
+            self._compare(iso, cold(iso))
+            slopes.append(iso.slope)
+        self.assertTrue(min(slopes) < 0 < max(slopes))
+
+    def test_too_few_points(self):
+        xs, ys, xerrs, yerrs, rs = self.points
+        iso = IncrementalIsochron(xs[:2], ys[:2], xerrs[:2], yerrs[:2], rs[:2])
+        iso.set_excluded(0)
+        self.assertEqual(iso.solve(), (0, 0))
+        self.assertEqual(iso.x_intercept, (0, 0))
+
+        iso.set_excluded(0, False)
+        iso.add(xs[2], ys[2], xerrs[2], yerrs[2], rs[2])
+        self._compare(iso, york(xs[:3], ys[:3], xerrs[:3], yerrs[:3], rs[:3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ============= EOF =============================================
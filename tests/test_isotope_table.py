@@ -0,0 +1,121 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.isotope_table import IsotopeTable
+
+ISOTOPES = ('Ar40', 'Ar39', 'Ar38', 'Ar37', 'Ar36')
+
+
+def make_table(n=4, seed=0):
+    rs = RandomState(seed)
+    t = IsotopeTable(n, ISOTOPES, detectors=['H1', 'AX', 'L1', 'L2', 'CDD'])
+    shape = (n, len(ISOTOPES))
+    t.signal_values[:] = rs.uniform(10, 100, shape)
+    t.signal_errors[:] = rs.uniform(0.01, 0.1, shape)
+    t.baseline_values[:] = rs.uniform(0, 0.1, shape)
+    t.baseline_errors[:] = rs.uniform(0.001, 0.01, shape)
+    t.blank_values[:] = rs.uniform(0, 1, shape)
+    t.blank_errors[:] = rs.uniform(0.001, 0.01, shape)
+    t.ic_factor_values[:] = rs.uniform(0.9, 1.1, shape)
+    t.ic_factor_errors[:] = rs.uniform(0.001, 0.01, shape)
+    t.discrimination_values[:] = rs.uniform(1, 1.02, shape)
+    t.discrimination_errors[:] = rs.uniform(0.0001, 0.001, shape)
+    t.include_baseline_error[:, ::2] = True
+    return t
+
+
+class IsotopeTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.table = make_table()
+
+    def test_row(self):
+        t = self.table
+        row = t.row(2)
+        self.assertEqual(sorted(row.keys()), sorted(ISOTOPES))
+
+        v = row['Ar39']
+        j = t.index('Ar39')
+        self.assertEqual(v.name, 'Ar39')
+        self.assertEqual(v.detector, 'AX')
+        self.assertEqual(v.value, t.signal_values[2, j])
+        self.assertEqual(v.error, t.signal_errors[2, j])
+        self.assertEqual(v.baseline.value, t.baseline_values[2, j])
+        self.assertEqual(v.blank.error, t.blank_errors[2, j])
+
+    def test_set_through_view(self):
+        t = self.table
+        v = t.get(1, 'Ar36')
+        v.set_blank(0.5, 0.05)
+        v.baseline.set_uvalue((0.2, 0.02))
+        v.set_fit('parabolic')
+
+        j = t.index('Ar36')
+        self.assertEqual(t.get_measurement(1, j, 'blank'), (0.5, 0.05))
+        self.assertEqual(t.get_measurement(1, j, 'baseline'), (0.2, 0.02))
+        self.assertEqual(t.get_fit(1, j), 'parabolic')
+
+    def test_intensity(self):
+        t = self.table
+        vs, es = t.intensity()
+        for i in range(t.n):
+            for j, k in enumerate(ISOTOPES):
+                u = t.get(i, k).get_intensity()
+                self.assertAlmostEqual(u.nominal_value, vs[i, j], 12)
+                self.assertAlmostEqual(u.std_dev, es[i, j], 12)
+
+    def test_baseline_corrected(self):
+        t = self.table
+        vs, es = t.baseline_corrected()
+        for i in range(t.n):
+            for j, k in enumerate(ISOTOPES):
+                u = t.get(i, k).get_baseline_corrected_value()
+                self.assertAlmostEqual(u.nominal_value, vs[i, j], 12)
+                self.assertAlmostEqual(u.std_dev, es[i, j], 12)
+
+    def test_uvalue_cached(self):
+        t = self.table
+        a = t.get(0, 'Ar40')
+        b = t.get(0, 'Ar40')
+        self.assertIs(a.uvalue, b.uvalue)
+        self.assertIs(a.ic_factor, b.ic_factor)
+        self.assertIs(a.baseline.uvalue, t.row(0)['Ar40'].baseline.uvalue)
+
+        # the same cell used twice stays correlated with itself
+        self.assertEqual((a - b.uvalue).std_dev, 0)
+        self.assertIsNot(a.uvalue, t.get(1, 'Ar40').uvalue)
+
+    def test_uvalue_cache_invalidated(self):
+        t = self.table
+        v = t.get(0, 'Ar39')
+        u = v.uvalue
+        v.set_uvalue((12.0, 0.3))
+        self.assertIsNot(v.uvalue, u)
+        self.assertEqual(v.uvalue.nominal_value, 12.0)
+        self.assertEqual(v.uvalue.std_dev, 0.3)
+
+        t.ic_factor_values[0, t.index('Ar39')] = 1.5
+        self.assertEqual(v.ic_factor.nominal_value, 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
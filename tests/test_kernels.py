@@ -0,0 +1,146 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy import kernels
+from ararpy.kernels import find_plateau, check_conformance, set_backend, get_backend
+from ararpy.plateau import Plateau
+
+
+def baseline_find_plateaus(ages, errors, signals, exclude, nsteps=3, overlap_sigma=2):
+    """
+        the pairwise fleck 1977 search of the original Plateau.find_plateaus
+    """
+    n = len(ages)
+    total = float(sum(s for i, s in enumerate(signals) if i not in exclude))
+
+    def overlap(i, j):
+        a1, a2 = ages[i], ages[j]
+        e1, e2 = errors[i] * overlap_sigma, errors[j] * overlap_sigma
+        return a1 - e1 < a2 + e2 and a1 + e1 > a2 - e2
+
+    def check_overlap(start, end):
+        for i in range(start, end):
+            for j in range(i + 1, end + 1):
+                if not overlap(i, j):
+                    return False
+        return True
+
+    def percent_released(start, end):
+        ss = sum([(s if i not in exclude else 0) for i, s in enumerate(signals)][start:end + 1])
+        return ss / total >= 0.5
+
+    idxs, spans = [], []
+    for start in range(n):
+        if start in exclude:
+            continue
+
+        potential_end = None
+        for i in range(start, n):
+            if i in exclude:
+                continue
+            if i - start < nsteps:
+                continue
+            if not check_overlap(start, i):
+                break
+            if not percent_released(start, i):
+                continue
+            potential_end = i
+
+        if potential_end:
+            idxs.append((start, potential_end))
+            spans.append(potential_end - start)
+
+    if spans:
+        return idxs[spans.index(max(spans))]
+
+
+def random_spectra(trials=200, seed=0):
+    rs = RandomState(seed)
+    for _ in range(trials):
+        k = rs.randint(1, 16)
+        ages = rs.normal(10, 0.2, k)
+        errors = rs.uniform(0.05, 0.3, k)
+        signals = rs.uniform(1, 5, k)
+        exclude = [i for i in range(k) if rs.uniform() < 0.1]
+        yield ages, errors, signals, exclude, rs.randint(0, 4)
+
+
+class KernelsTestCase(unittest.TestCase):
+    def setUp(self):
+        self._backend = get_backend()
+
+    def tearDown(self):
+        set_backend(self._backend)
+
+    def _check_backend(self, backend):
+        for ages, errors, signals, exclude, nsteps in random_spectra():
+            expected = baseline_find_plateaus(ages, errors, signals, exclude, nsteps)
+            result = find_plateau(ages, errors, signals, exclude, nsteps, backend=backend)
+            self.assertEqual(result, expected)
+
+    def test_numpy_plateau(self):
+        self._check_backend('numpy')
+
+    @unittest.skipIf(kernels.numba is None, 'numba is not installed')
+    def test_numba_plateau(self):
+        self._check_backend('numba')
+
+    def test_python_plateau(self):
+        self._check_backend('python')
+
+    def test_plateau_class(self):
+        backends = ['numpy', 'python'] + (['numba'] if kernels.numba is not None else [])
+        for backend in backends:
+            set_backend(backend)
+            for ages, errors, signals, exclude, _ in random_spectra(50, seed=1):
+                expected = baseline_find_plateaus(ages, errors, signals, exclude) or []
+                p = Plateau(ages=ages, errors=errors, signals=signals, exclude=exclude)
+                self.assertEqual(p.find_plateaus(), expected)
+
+    def test_set_backend(self):
+        for name in ('numpy', 'python'):
+            set_backend(name)
+            self.assertEqual(get_backend(), name)
+        self.assertRaises(ValueError, set_backend, 'fortran')
+
+    def test_conformance(self):
+        diffs = check_conformance()
+        self.assertEqual(sorted(diffs), ['plateau'])
+
+    def test_no_signal(self):
+        backends = ['numpy', 'python'] + (['numba'] if kernels.numba is not None else [])
+        ages = [10.0, 10.1, 9.9, 10.0, 10.05]
+        errors = [0.1] * 5
+        for backend in backends:
+            self.assertIsNone(find_plateau(ages, errors, [0] * 5, nsteps=1, backend=backend))
+            self.assertIsNone(find_plateau(ages, errors, [1] * 5, excluded=list(range(5)), nsteps=1,
+                                           backend=backend))
+
+            set_backend(backend)
+            for method in ('fleck 1977', 'mahon 1996'):
+                p = Plateau(ages=ages, errors=errors, signals=[0] * 5, nsteps=1)
+                self.assertEqual(p.find_plateaus(method), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
@@ -0,0 +1,98 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy import linspace, polyfit, polyval, arange, dot, sqrt
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.online import OnlineRegressor
+
+
+def reference(xs, ys, degree, x=0):
+    """
+        polyfit in centered, scaled x. return value and error of the fit at x and the
+        coefficients in increasing powers of x
+    """
+    m = xs.mean()
+    s = abs(xs - m).max()
+    c, cov = polyfit((xs - m) / s, ys, degree, cov='unscaled')
+    r = ys - polyval(c, (xs - m) / s)
+    var = dot(r, r) / (len(xs) - degree - 1)
+    p = ((x - m) / s) ** arange(degree, -1, -1)
+    return polyval(c, (x - m) / s), sqrt(var * dot(p, dot(cov, p))), polyfit(xs, ys, degree)[::-1]
+
+
+def make_series(n, xmax, seed=0):
+    rs = RandomState(seed)
+    xs = linspace(5, xmax, n)
+    ys = 500 - 0.5 * xs + 1e-3 * xs ** 2 - 1e-7 * xs ** 3 + rs.normal(0, 1, n)
+    return xs, ys
+
+
+class OnlineRegressorTestCase(unittest.TestCase):
+    def _compare(self, fit, degree, window, n, xmax):
+        xs, ys = make_series(n, xmax)
+        reg = OnlineRegressor(fit, window=window)
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            reg.add(x, y)
+            if i < degree + 2:
+                continue
+
+            sx = slice(max(0, i + 1 - window) if window else 0, i + 1)
+            v, e, c = reference(xs[sx], ys[sx], degree)
+            self.assertAlmostEqual(reg.predict(0), v, delta=e * 1e-9)
+            self.assertAlmostEqual(reg.predict_error(0) / e, 1, 9)
+            for a, b in zip(reg.coefficients, c):
+                self.assertAlmostEqual(a, b, delta=abs(b) * 1e-5 + 1e-12)
+        self.assertEqual(reg.n, window or n)
+
+    def test_linear_window(self):
+        self._compare('linear', 1, 20, 250, 1000)
+
+    def test_parabolic_window(self):
+        self._compare('parabolic', 2, 25, 250, 1000)
+
+    def test_cubic_window(self):
+        self._compare('cubic', 3, 30, 150, 600)
+
+    def test_cubic_long_window(self):
+        self._compare('cubic', 3, 50, 300, 1200)
+
+    def test_cubic(self):
+        self._compare('cubic', 3, None, 150, 600)
+
+    def test_average(self):
+        xs, ys = make_series(30, 100)
+        reg = OnlineRegressor('average', error_type='SD')
+        for x, y in zip(xs, ys):
+            reg.add(x, y)
+        self.assertAlmostEqual(reg.predict(0), ys.mean(), 9)
+        self.assertAlmostEqual(reg.predict_error(0), ys.std(ddof=1), 9)
+
+    def test_too_few_points(self):
+        reg = OnlineRegressor('parabolic')
+        reg.add(1, 2)
+        reg.add(2, 3)
+        self.assertEqual(reg.predict(0), 0)
+        self.assertEqual(reg.predict_error(0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
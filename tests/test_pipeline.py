@@ -0,0 +1,155 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from numpy import linspace, polyfit, polyval, dot, allclose
+from numpy.random import RandomState
+from uncertainties import ufloat
+# ============= local library imports  ==========================
+from ararpy.arar import calculate_F, age_equation
+from ararpy.constants import ArArConstants
+from ararpy.pipeline import StreamingReducer, ISOTOPES, decode_blob
+from ararpy.results import load_results
+from tests.test_shared import PRODUCTION_RATIOS
+
+SIGNALS = dict(Ar40=150., Ar39=8., Ar38=0.3, Ar37=12., Ar36=0.05)
+FITS = dict(Ar40='linear', Ar39='linear', Ar38='average', Ar37='parabolic', Ar36='linear')
+J = (0.002, 2e-6)
+
+
+def pack(xs, ys):
+    return b''.join(struct.pack('>ff', x, y) for x, y in zip(xs, ys))
+
+
+def make_analyses(n, seed=0):
+    rs = RandomState(seed)
+    xs = linspace(5, 200, 40)
+    bxs = linspace(0, 30, 15)
+    analyses = []
+    for i in range(n):
+        isotopes, baselines, blanks = {}, {}, {}
+        for k, v in SIGNALS.items():
+            v = v * rs.uniform(0.8, 1.2)
+            ys = v - v * 1e-4 * xs + rs.normal(0, v * 1e-3 + 1e-4, len(xs))
+            isotopes[k] = pack(xs, ys)
+            baselines[k] = pack(bxs, rs.normal(0.002, 1e-4, len(bxs)))
+            blanks[k] = (v * 0.01, v * 0.001)
+
+        a = dict(identifier='a{:03d}'.format(i), decay_time=rs.uniform(10, 100), j=J,
+                 isotopes=isotopes, baselines=baselines, blanks=blanks, fits=FITS,
+                 ic_factors=dict(Ar36=(1.02, 0.002)),
+                 discrimination=dict(Ar40=(1.003, 0.0005)),
+                 decay_factors=dict(Ar37=rs.uniform(1.5, 2), Ar39=(1.001, 0)))
+        analyses.append(a)
+    return analyses
+
+
+def intercept(blob, fit):
+    """
+        per analysis intercept and standard error with polyfit
+    """
+    xs, ys = decode_blob(blob)
+    d = dict(average=0, linear=1, parabolic=2)[fit]
+    c, cov = polyfit(xs, ys, d, cov='unscaled')
+    r = ys - polyval(c, xs)
+    var = dot(r, r) / (len(xs) - d - 1)
+    return c[-1], (var * cov[-1, -1]) ** 0.5
+
+
+def reduce_analysis(a, arar_constants):
+    """
+        the uncertainties based per analysis path
+    """
+    isos = []
+    for k in ISOTOPES:
+        v = ufloat(*intercept(a['isotopes'][k], a['fits'][k]))
+        b = intercept(a['baselines'][k], 'average')[0]
+        v = v - b - ufloat(*a['blanks'][k])
+        for key in ('discrimination', 'ic_factors', 'decay_factors'):
+            f = a[key].get(k, 1)
+            v = v * (ufloat(*f) if isinstance(f, tuple) else f)
+        isos.append(v)
+
+    pr = dict((k, ufloat(*v)) for k, v in PRODUCTION_RATIOS.items())
+    f = calculate_F(isos, a['decay_time'], interferences=pr, arar_constants=arar_constants)[0]
+    age = age_equation(a['j'], f, arar_constants=arar_constants)
+    return isos, f, age
+
+
+class StreamingReducerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.arar_constants = ArArConstants()
+        self.analyses = make_analyses(7)
+        self.expected = [reduce_analysis(a, self.arar_constants) for a in self.analyses]
+
+    def _reducer(self, **kw):
+        return StreamingReducer(PRODUCTION_RATIOS, self.arar_constants, chunk_size=3, **kw)
+
+    def test_iter_rows(self):
+        rows = list(self._reducer().iter_rows(self.analyses))
+        self.assertEqual([r['identifier'] for r in rows], [a['identifier'] for a in self.analyses])
+
+        for row, (isos, f, age) in zip(rows, self.expected):
+            for k, u in zip(ISOTOPES, isos):
+                self.assertAlmostEqual(row[k] / u.nominal_value, 1, 9)
+                self.assertAlmostEqual(row['{}_err'.format(k)] / u.std_dev, 1, 6)
+
+            self.assertAlmostEqual(row['F'] / f.nominal_value, 1, 9)
+            self.assertAlmostEqual(row['F_err'] / f.std_dev, 1, 6)
+            self.assertAlmostEqual(row['age'] / age.nominal_value, 1, 9)
+            self.assertAlmostEqual(row['age_err'] / age.std_dev, 1, 6)
+
+    def test_reduce_to_file(self):
+        root = tempfile.mkdtemp()
+        try:
+            path = os.path.join(root, 'reduced.npz')
+            n = self._reducer().reduce_to_file(iter(self.analyses), path)
+            self.assertEqual(n, len(self.analyses))
+
+            t = load_results(path)
+            self.assertEqual(list(t['identifier']), [a['identifier'] for a in self.analyses])
+            self.assertTrue(allclose(t['F'], [f.nominal_value for _, f, _ in self.expected], rtol=1e-9))
+            self.assertTrue(allclose(t['age_err'], [a.std_dev for _, _, a in self.expected], rtol=1e-6))
+        finally:
+            shutil.rmtree(root)
+
+    def test_reverse_unpack(self):
+        a = self.analyses[0]
+        reversed_analysis = dict(a)
+        reversed_analysis['isotopes'] = dict((k, pack(*decode_blob(b)[::-1])) for k, b in a['isotopes'].items())
+        reversed_analysis['baselines'] = dict((k, pack(*decode_blob(b)[::-1])) for k, b in a['baselines'].items())
+
+        row = next(self._reducer().iter_rows([a]))
+        rrow = next(self._reducer(reverse_unpack=True).iter_rows([reversed_analysis]))
+        self.assertEqual(row['F'], rrow['F'])
+
+    def test_baseline_values(self):
+        a = dict(self.analyses[0])
+        a['baselines'] = dict((k, intercept(b, 'average')) for k, b in a['baselines'].items())
+        row = next(self._reducer().iter_rows([a]))
+        self.assertAlmostEqual(row['F'] / self.expected[0][1].nominal_value, 1, 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
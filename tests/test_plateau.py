@@ -0,0 +1,170 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from numpy import array, ones_like
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy import plateau
+from ararpy.plateau import Plateau, overlap_matrix, overlapping_windows, calculate_plateau_diagnostics
+from ararpy.stats import calculate_weighted_mean, calculate_mswd, validate_mswd
+
+
+def brute_force_windows(ages, errors, overlap_sigma=2):
+    """
+        every maximal window start..end in which all pairs of steps overlap
+    """
+    n = len(ages)
+
+    def overlaps(i, j):
+        ei, ej = errors[i] * overlap_sigma, errors[j] * overlap_sigma
+        return i == j or (ages[i] - ei < ages[j] + ej and ages[i] + ei > ages[j] - ej)
+
+    windows = []
+    for s in range(n):
+        e = s
+        while e + 1 < n and all(overlaps(k, e + 1) for k in range(s, e + 1)):
+            e += 1
+        if not windows or e > windows[-1][1]:
+            windows.append((s, e))
+    return windows
+
+
+def make_steps(n, seed=0):
+    rs = RandomState(seed)
+    ages = rs.normal(28.2, 0.15, n)
+    errors = rs.uniform(0.02, 0.1, n)
+    signals = rs.uniform(1, 5, n)
+    return ages, errors, signals
+
+
+class OverlapTestCase(unittest.TestCase):
+    def test_zero_error_step(self):
+        ages = array([10.0, 10.05, 10.0, 9.95, 10.02])
+        errors = array([0.1, 0.1, 0, 0.1, 0.1])
+        m = overlap_matrix(ages, errors)
+        self.assertTrue(m.diagonal().all())
+
+        p = Plateau(ages, errors, ones_like(ages))
+        func = p._overlap_func()
+        self.assertTrue(func(0, 4))
+        self.assertTrue(func(2, 2))
+
+    def test_overlap_func_matches_brute_force(self):
+        for seed in range(10):
+            ages, errors, signals = make_steps(12, seed)
+            func = Plateau(ages, errors, signals)._overlap_func()
+            for s, e in brute_force_windows(ages, errors):
+                self.assertTrue(func(s, e))
+                if e + 1 < len(ages):
+                    self.assertFalse(func(s, e + 1))
+
+    def test_overlapping_windows(self):
+        for seed in range(10):
+            ages, errors, _ = make_steps(15, seed)
+            starts, ends = overlapping_windows(overlap_matrix(ages, errors))
+            self.assertEqual(list(zip(starts, ends)), brute_force_windows(ages, errors))
+
+    def test_overlap_matrix_lazy(self):
+        ages, errors, signals = make_steps(10)
+        with mock.patch.object(plateau, 'overlap_matrix', wraps=overlap_matrix) as om:
+            p = Plateau(ages, errors, signals)
+            p.find_plateaus('mahon 1996')
+            p.find_plateaus('fleck 1977')
+            self.assertEqual(om.call_count, 0)
+
+            func = p._overlap_func()
+            func(0, 3)
+            func(1, 4)
+            self.assertEqual(om.call_count, 1)
+
+
+class PlateauDiagnosticsTestCase(unittest.TestCase):
+    def _check(self, ages, errors, signals, exclude=None, nsteps=3, gas_fraction=50):
+        d = calculate_plateau_diagnostics(ages, errors, signals, exclude=exclude,
+                                          nsteps=nsteps, gas_fraction=gas_fraction)
+        windows = brute_force_windows(ages, errors)
+        self.assertEqual(list(zip(d['start'], d['end'])), windows)
+
+        exclude = exclude or []
+        total = sum(s for i, s in enumerate(signals) if i not in exclude)
+        for k, (s, e) in enumerate(windows):
+            idx = [i for i in range(s, e + 1) if i not in exclude]
+            self.assertEqual(d['n'][k], len(idx))
+
+            gas = signals[idx].sum() / total * 100
+            self.assertAlmostEqual(d['gas_fraction'][k], gas, places=10)
+            self.assertEqual(d['plateau'][k], e - s >= nsteps and gas >= gas_fraction)
+
+            if not idx:
+                continue
+
+            wm, we = calculate_weighted_mean(ages[idx], errors[idx])
+            self.assertAlmostEqual(d['mean'][k], wm, places=10)
+            self.assertAlmostEqual(d['error'][k], we, places=12)
+
+            if len(idx) > 1:
+                mswd = calculate_mswd(ages[idx], errors[idx], wm=wm)
+                self.assertAlmostEqual(d['mswd'][k], mswd, places=8)
+                self.assertEqual(bool(d['valid'][k]), bool(validate_mswd(mswd, len(idx))))
+            else:
+                self.assertEqual(d['mswd'][k], 0)
+                self.assertFalse(d['valid'][k])
+        return d
+
+    def test_diagnostics(self):
+        for seed in range(10):
+            self._check(*make_steps(15, seed))
+
+    def test_exclude(self):
+        ages, errors, signals = make_steps(15, 3)
+        self._check(ages, errors, signals, exclude=[0, 4, 5])
+        self._check(ages, errors, signals, exclude=array([2]))
+
+    def test_gas_fraction(self):
+        ages, errors, signals = make_steps(15, 4)
+        self._check(ages, errors, signals, nsteps=1, gas_fraction=10)
+
+    def test_longest_plateau(self):
+        for seed in range(10):
+            ages, errors, signals = make_steps(15, seed)
+            d = calculate_plateau_diagnostics(ages, errors, signals)
+            pidx = Plateau(ages, errors, signals).find_plateaus('fleck 1977')
+            if pidx:
+                ps = [(s, e) for s, e, p in zip(d['start'], d['end'], d['plateau']) if p]
+                self.assertIn(pidx[1] - pidx[0], [e - s for s, e in ps])
+                self.assertEqual(max(e - s for s, e in ps), pidx[1] - pidx[0])
+
+    def test_method(self):
+        ages, errors, signals = make_steps(15, 1)
+        d = Plateau(ages, errors, signals, exclude=[3]).diagnostics()
+        r = calculate_plateau_diagnostics(ages, errors, signals, exclude=[3])
+        for k in r:
+            self.assertEqual(list(d[k]), list(r[k]))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ============= EOF =============================================
@@ -0,0 +1,108 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+# ============= local library imports  ==========================
+from ararpy import profiling
+from ararpy.profiling import stage, profile_stage
+
+
+@profile_stage('test.outer')
+def outer(n):
+    with stage('test.inner'):
+        return sum(range(n))
+
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        profiling.reset()
+
+    def tearDown(self):
+        profiling.disable()
+        profiling.reset()
+
+    def test_disabled(self):
+        self.assertFalse(profiling.is_enabled())
+        outer(10)
+        self.assertEqual(profiling.get_stats(), [])
+
+    def test_stages(self):
+        profiling.enable()
+        for _ in range(3):
+            self.assertEqual(outer(1000), 499500)
+
+        stats = dict((s.name, s) for s in profiling.get_stats())
+        self.assertEqual(stats['test.outer'].calls, 3)
+        self.assertEqual(stats['test.inner'].calls, 3)
+        self.assertGreaterEqual(stats['test.outer'].wall, stats['test.inner'].wall)
+        self.assertEqual(profiling.get_stats()[0].name, 'test.outer')
+
+        table = profiling.summary_table()
+        self.assertIn('test.inner', table)
+        self.assertIn('net mem (kB)', table)
+
+    def test_chrome_trace(self):
+        profiling.enable(trace=True)
+        outer(10)
+        path = os.path.join(tempfile.mkdtemp(), 'trace.json')
+        profiling.export_chrome_trace(path)
+        with open(path) as rfile:
+            events = json.load(rfile)['traceEvents']
+
+        self.assertEqual(sorted(e['name'] for e in events), ['test.inner', 'test.outer'])
+        for e in events:
+            self.assertEqual(e['ph'], 'X')
+            self.assertEqual(e['cat'], 'test')
+            self.assertGreaterEqual(e['dur'], 0)
+
+    def test_net_bytes(self):
+        profiling.enable(track_allocations=True)
+        keep = []
+        with stage('test.allocate'):
+            keep.append(bytearray(1 << 20))
+        with stage('test.free'):
+            keep.pop()
+
+        stats = dict((s.name, s.to_dict()) for s in profiling.get_stats())
+        self.assertGreater(stats['test.allocate']['net_bytes'], 1 << 19)
+        self.assertLess(stats['test.free']['net_bytes'], -(1 << 19))
+
+    def test_tracemalloc_started_by_profiler(self):
+        self.assertFalse(tracemalloc.is_tracing())
+        profiling.enable(track_allocations=True)
+        self.assertTrue(tracemalloc.is_tracing())
+        profiling.disable()
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_tracemalloc_started_by_caller(self):
+        tracemalloc.start()
+        try:
+            profiling.enable(track_allocations=True)
+            profiling.disable()
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
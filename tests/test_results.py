@@ -0,0 +1,154 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import os
+import shutil
+import tempfile
+import unittest
+
+from numpy import arange, array_equal, savez_compressed, memmap, load, zeros, concatenate
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.results import save_results, load_results, ResultWriter, ID_COLUMN
+
+
+def make_columns(n, seed=0):
+    rs = RandomState(seed)
+    return dict(F=rs.uniform(1, 10, n), F_err=rs.uniform(0, 0.1, n),
+                age=rs.uniform(10, 100, n), age_err=rs.uniform(0, 1, n))
+
+
+class ResultsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _path(self, name='results.npz'):
+        return os.path.join(self.root, name)
+
+    def _check(self, path, columns, identifiers=None):
+        for mmap in (True, False):
+            with load_results(path, mmap=mmap) as t:
+                self.assertEqual(len(t), len(columns['F']))
+                self.assertEqual(t.quantities, ['F', 'age'])
+                for k, v in columns.items():
+                    self.assertTrue(array_equal(t[k], v), k)
+                    if mmap:
+                        self.assertIsInstance(t[k], memmap)
+                if identifiers is not None:
+                    self.assertEqual(list(t[ID_COLUMN]), list(identifiers))
+
+                u = t.uvalue('age', 3)
+                self.assertEqual(u.nominal_value, columns['age'][3])
+                self.assertEqual(u.std_dev, columns['age_err'][3])
+
+    def test_save_results(self):
+        cols = make_columns(20)
+        ids = ['a{:03d}'.format(i) for i in range(20)]
+        path = self._path()
+        save_results(path, cols, identifiers=ids)
+        self._check(path, cols, ids)
+
+    def test_compressed(self):
+        cols = make_columns(20)
+        path = self._path()
+        savez_compressed(path, **cols)
+        for mmap in (True, False):
+            with load_results(path, mmap=mmap) as t:
+                for k, v in cols.items():
+                    self.assertTrue(array_equal(t[k], v), k)
+
+    def test_writer(self):
+        path = self._path()
+        chunks = [make_columns(n, seed=i) for i, n in enumerate((7, 0, 5, 9))]
+        with ResultWriter(path) as w:
+            i = 0
+            for c in chunks:
+                n = len(c['F'])
+                w.write(c, identifiers=['a{}'.format(j) for j in range(i, i + n)])
+                i += n
+
+        self.assertEqual(w.n, 21)
+        expected = dict((k, concatenate([c[k] for c in chunks])) for k in chunks[0])
+
+        self._check(path, expected, ['a{}'.format(j) for j in range(21)])
+        with load(path) as npz:
+            self.assertTrue(array_equal(npz['F'], expected['F']))
+
+    def test_writer_missing_column(self):
+        path = self._path()
+        w = ResultWriter(path)
+        w.write(dict(a=arange(3.), b=arange(3.)))
+        with self.assertRaises(ValueError):
+            w.write(dict(a=arange(3.)))
+        w.write(dict(a=arange(3., 6), b=arange(3., 6)))
+        w.close()
+
+        t = load_results(path)
+        self.assertTrue(array_equal(t['a'], arange(6.)))
+        self.assertTrue(array_equal(t['b'], arange(6.)))
+
+    def test_writer_extra_column(self):
+        w = ResultWriter(self._path())
+        w.write(dict(a=arange(3.)))
+        with self.assertRaises(ValueError):
+            w.write(dict(a=arange(3.), b=arange(3.)))
+        with self.assertRaises(ValueError):
+            w.write(dict(a=arange(3.)), identifiers=['x', 'y', 'z'])
+        w.close()
+        self.assertEqual(len(load_results(self._path())), 3)
+
+    def test_writer_length_mismatch(self):
+        path = self._path()
+        w = ResultWriter(path)
+        w.write(dict(a=arange(3.), b=arange(3.)))
+        # the first column is valid, nothing may be written before b is checked
+        with self.assertRaises(ValueError):
+            w.write(dict(a=arange(3.), b=arange(2.)))
+        with self.assertRaises(ValueError):
+            w.write(dict(a=arange(2.), b=arange(2.)), identifiers=['x'])
+        w.write(dict(a=arange(3., 6), b=arange(3., 6)))
+        w.close()
+
+        t = load_results(path)
+        self.assertTrue(array_equal(t['a'], arange(6.)))
+        self.assertTrue(array_equal(t['b'], arange(6.)))
+
+    def test_writer_empty_first_chunk(self):
+        path = self._path()
+        w = ResultWriter(path)
+        w.write(dict(a=zeros(0), b=zeros(0)))
+        w.write(dict(a=arange(3.)))
+        w.close()
+
+        t = load_results(path)
+        self.assertEqual(t.names, ['a'])
+        self.assertTrue(array_equal(t['a'], arange(3.)))
+
+    def test_writer_identifier_width(self):
+        w = ResultWriter(self._path(), id_width=4)
+        with self.assertRaises(ValueError):
+            w.write(dict(a=arange(1.)), identifiers=['toolong'])
+        w.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
@@ -0,0 +1,155 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import multiprocessing
+import sys
+import unittest
+
+from numpy import column_stack, allclose, linspace, concatenate, cumsum, array, array_equal
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.constants import ArArConstants
+from ararpy.interferences import compile_production_ratios
+
+PRODUCTION_RATIOS = dict(k4039=(0.01, 0.001), k3839=(0.012, 0), k3739=(0.0004, 0),
+                         ca3937=(0.0007, 0), ca3837=(0.00003, 0), ca3637=(0.00027, 0),
+                         cl3638=(250, 0))
+
+
+def make_isotopes(n, seed=0):
+    rs = RandomState(seed)
+    values = column_stack([rs.uniform(100, 200, n), rs.uniform(5, 10, n), rs.uniform(0.2, 0.5, n),
+                           rs.uniform(1, 30, n), rs.uniform(0.01, 0.1, n)])
+    return values, values * 0.01, rs.uniform(0, 100, n)
+
+
+def make_series(n, seed=0):
+    """
+        padded series of varying length. return xs, ys, mask, degrees
+    """
+    from ararpy.fitting import pad_series
+
+    rs = RandomState(seed)
+    xs, ys = [], []
+    for _ in range(n):
+        m = rs.randint(10, 40)
+        x = linspace(5, 200, m)
+        xs.append(x)
+        ys.append(rs.uniform(1, 100) - 0.02 * x + 1e-4 * x ** 2 + rs.normal(0, 0.05, m))
+    xs, ys, mask = pad_series(xs, ys)
+    return xs, ys, mask, rs.randint(0, 3, n)
+
+
+def make_spectra(n, seed=0):
+    """
+        spectra stored back to back. return ages, errors, signals, offsets
+    """
+    rs = RandomState(seed)
+    lens = rs.randint(1, 16, n)
+    m = lens.sum()
+    signals = rs.uniform(1, 5, m)
+    # a spectrum without signal has no plateau
+    signals[:lens[0]] = 0
+    offsets = concatenate(([0], cumsum(lens)))
+    return rs.normal(10, 0.2, m), rs.uniform(0.05, 0.3, m), signals, offsets
+
+
+@unittest.skipIf(sys.version_info < (3, 8), 'shared memory requires python 3.8+')
+class SharedMemoryExecutorTestCase(unittest.TestCase):
+    def _calculate_F(self, method, j=None):
+        from ararpy.shared import SharedMemoryExecutor
+
+        values, errors, dts = make_isotopes(50)
+        ctx = multiprocessing.get_context(method)
+        with SharedMemoryExecutor(max_workers=2, chunk_size=16, mp_context=ctx) as ex:
+            cols = ex.calculate_F(values, errors, dts, PRODUCTION_RATIOS, j=j)
+            cols = dict((k, v.copy()) for k, v in cols.items())
+
+        expected = compile_production_ratios(PRODUCTION_RATIOS, ArArConstants()).calculate_F(values, errors,
+                                                                                           dts)
+        for k, v in expected.items():
+            self.assertTrue(allclose(cols[k], v, rtol=1e-12, atol=0), k)
+        return cols
+
+    def test_calculate_F_spawn(self):
+        self._calculate_F('spawn')
+
+    @unittest.skipIf(sys.platform == 'win32', 'fork is not available')
+    def test_calculate_F_fork(self):
+        self._calculate_F('fork')
+
+    def test_calculate_ages_spawn(self):
+        from ararpy.arar import calculate_ages
+
+        j = [(0.002, 1e-6)] * 50
+        cols = self._calculate_F('spawn', j=j)
+        age, age_err = calculate_ages(0.002, 1e-6, cols['F'], cols['F_err'])
+        self.assertTrue(allclose(cols['age'], age, rtol=1e-12))
+        self.assertTrue(allclose(cols['age_err'], age_err, rtol=1e-12))
+
+    def _fit_intercepts(self, method):
+        from ararpy.fitting import batch_intercepts
+        from ararpy.shared import SharedMemoryExecutor
+
+        xs, ys, mask, degrees = make_series(60)
+        ctx = multiprocessing.get_context(method)
+        with SharedMemoryExecutor(max_workers=2, chunk_size=16, mp_context=ctx) as ex:
+            vs, es = ex.fit_intercepts(xs, ys, mask, degrees)
+            vs, es = vs.copy(), es.copy()
+
+        for i, d in enumerate(degrees):
+            v, e = batch_intercepts(xs[i:i + 1], ys[i:i + 1], mask[i:i + 1], int(d))
+            self.assertAlmostEqual(vs[i], v[0], delta=abs(v[0]) * 1e-12)
+            self.assertAlmostEqual(es[i], e[0], delta=e[0] * 1e-12)
+
+    def test_fit_intercepts_spawn(self):
+        self._fit_intercepts('spawn')
+
+    @unittest.skipIf(sys.platform == 'win32', 'fork is not available')
+    def test_fit_intercepts_fork(self):
+        self._fit_intercepts('fork')
+
+    def _find_plateaus(self, method, **kw):
+        from ararpy.kernels import find_plateau
+        from ararpy.shared import SharedMemoryExecutor
+
+        ages, errors, signals, offsets = make_spectra(40)
+        ctx = multiprocessing.get_context(method)
+        with SharedMemoryExecutor(max_workers=2, chunk_size=8, mp_context=ctx) as ex:
+            out = ex.find_plateaus(ages, errors, signals, offsets, **kw).copy()
+
+        expected = []
+        for a, b in zip(offsets[:-1], offsets[1:]):
+            pidx = find_plateau(ages[a:b], errors[a:b], signals[a:b], **kw)
+            expected.append(pidx if pidx else (-1, -1))
+
+        self.assertTrue(array_equal(out, array(expected)))
+        self.assertEqual(tuple(out[0]), (-1, -1))
+        self.assertTrue((out[:, 0] >= 0).any())
+
+    def test_find_plateaus_spawn(self):
+        self._find_plateaus('spawn')
+
+    @unittest.skipIf(sys.platform == 'win32', 'fork is not available')
+    def test_find_plateaus_fork(self):
+        self._find_plateaus('fork', nsteps=1, gas_fraction=30)
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
@@ -0,0 +1,78 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from uncertainties import ufloat
+# ============= local library imports  ==========================
+from ararpy.arar import age_equation
+from ararpy.spectrum import Spectrum
+
+FS = [10.5, 10.02, 10.0, 9.98, 10.01, 10.03, 9.5]
+F_ERRS = [0.05, 0.01, 0.01, 0.01, 0.01, 0.01, 0.05]
+K39 = [0.5, 1, 2, 3, 2, 1, 0.5]
+K39_ERRS = [0.01, 0.02, 0.02, 0.03, 0.02, 0.02, 0.01]
+J = (0.001, 1e-6)
+
+
+class SpectrumTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spectrum = Spectrum(FS, F_ERRS, K39, K39_ERRS, j=J)
+
+    def test_integrated_age_k39_error(self):
+        ks = [ufloat(k, e) for k, e in zip(K39, K39_ERRS)]
+        fs = [ufloat(f, e) for f, e in zip(FS, F_ERRS)]
+        f = sum(k * fi for k, fi in zip(ks, fs)) / sum(ks)
+        expected = age_equation(J, f, arar_constants=self.spectrum.arar_constants)
+
+        a = self.spectrum.integrated_age
+        self.assertAlmostEqual(a.nominal_value, expected.nominal_value, 9)
+        self.assertAlmostEqual(a.std_dev, expected.std_dev, 9)
+
+        no_k39_err = Spectrum(FS, F_ERRS, K39, j=J).integrated_age
+        self.assertGreater(a.std_dev, no_k39_err.std_dev)
+
+    def test_nsteps_invalidates_plateau(self):
+        s = self.spectrum
+        p = s.plateau
+        self.assertTrue(p)
+
+        s.nsteps = p[1] - p[0] + 1
+        self.assertIsNone(s.plateau)
+        self.assertIsNone(s.plateau_age)
+
+        s.nsteps = 3
+        self.assertEqual(s.plateau, p)
+
+    def test_overlap_sigma_invalidates_plateau(self):
+        s = self.spectrum
+        p = s.plateau
+        s.overlap_sigma = 20
+        self.assertNotEqual(s.plateau, p)
+        self.assertEqual(s.plateau, (0, s.n - 1))
+
+    def test_method_invalidates_plateau(self):
+        s = self.spectrum
+        s.plateau
+        s.plateau_method = 'mahon 1996'
+        self.assertNotIn('plateau', s._cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
+# ============= EOF =============================================
@@ -0,0 +1,187 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+import warnings
+
+from numpy import array, repeat, arange, diag, ones, column_stack, full
+from numpy.linalg import inv
+from numpy.random import RandomState
+# ============= local library imports  ==========================
+from ararpy.stats import calculate_weighted_mean, calculate_grouped_weighted_mean, calculate_mswd, \
+    validate_mswd, calculate_correlated_weighted_mean, shared_error_factor
+
+
+def make_groups(sizes, seed=0):
+    rs = RandomState(seed)
+    groups = repeat(arange(len(sizes)), sizes)
+    x = rs.normal(28.2, 0.1, len(groups)) + groups
+    errs = rs.uniform(0.02, 0.2, len(groups))
+    return x, errs, groups
+
+
+class WeightedMeanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.x = array([10.1, 10.3, 9.8, 10.6])
+        self.errs = array([0.1, 0.2, 0.1, 0.3])
+
+    def test_error(self):
+        wm, we = calculate_weighted_mean(self.x, self.errs)
+        w = 1 / self.errs ** 2
+        self.assertAlmostEqual(wm, (w * self.x).sum() / w.sum())
+        self.assertAlmostEqual(we, w.sum() ** -0.5)
+
+    def test_expand_mswd(self):
+        wm, we = calculate_weighted_mean(self.x, self.errs)
+        mswd = calculate_mswd(self.x, self.errs, wm=wm)
+        self.assertGreater(mswd, 1)
+
+        _, ewe = calculate_weighted_mean(self.x, self.errs, expand_mswd=True)
+        self.assertAlmostEqual(ewe, we * mswd ** 0.5)
+
+    def test_expand_mswd_below_one(self):
+        errs = self.errs * 10
+        _, we = calculate_weighted_mean(self.x, errs)
+        _, ewe = calculate_weighted_mean(self.x, errs, expand_mswd=True)
+        self.assertEqual(we, ewe)
+
+    def test_deprecated_error(self):
+        with warnings.catch_warnings(record=True) as ws:
+            warnings.simplefilter('always')
+            wm, we = calculate_weighted_mean(self.x, self.errs, error=1)
+
+        self.assertEqual(we, 1)
+        self.assertAlmostEqual(wm, calculate_weighted_mean(self.x, self.errs)[0])
+        self.assertTrue(any(issubclass(w.category, DeprecationWarning) for w in ws))
+
+    def test_invalid_error(self):
+        self.assertRaises(ValueError, calculate_weighted_mean, self.x, self.errs, error=2)
+
+    def test_deprecated_error_expand_mswd(self):
+        self.assertRaises(ValueError, calculate_weighted_mean, self.x, self.errs, error=1, expand_mswd=True)
+
+
+class GroupedWeightedMeanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sizes = (5, 1, 8, 3, 12)
+        self.x, self.errs, self.groups = make_groups(self.sizes)
+
+    def _group(self, g):
+        sel = self.groups == g
+        return self.x[sel], self.errs[sel]
+
+    def test_inverse_variance(self):
+        r = calculate_grouped_weighted_mean(self.x, self.errs, self.groups)
+        self.assertEqual(list(r['groups']), list(range(len(self.sizes))))
+        self.assertEqual(list(r['n']), list(self.sizes))
+
+        for i, g in enumerate(r['groups']):
+            x, errs = self._group(g)
+            wm, we = calculate_weighted_mean(x, errs)
+            self.assertAlmostEqual(r['mean'][i], wm, places=10)
+            self.assertAlmostEqual(r['error'][i], we, places=12)
+
+            mswd = calculate_mswd(x, errs, wm=wm)
+            self.assertAlmostEqual(r['mswd'][i], mswd, places=10)
+
+            _, ewe = calculate_weighted_mean(x, errs, expand_mswd=True)
+            self.assertAlmostEqual(r['expanded_error'][i], ewe, places=12)
+
+    def test_valid(self):
+        r = calculate_grouped_weighted_mean(self.x, self.errs, self.groups)
+        for i, n in enumerate(r['n']):
+            if n < 2:
+                self.assertFalse(r['valid'][i])
+            else:
+                self.assertEqual(bool(r['valid'][i]), bool(validate_mswd(r['mswd'][i], n)))
+
+    def test_unsorted_labels(self):
+        rs = RandomState(1)
+        idx = rs.permutation(len(self.x))
+        labels = array(['a', 'b', 'c', 'd', 'e'])[self.groups]
+        r = calculate_grouped_weighted_mean(self.x[idx], self.errs[idx], labels[idx])
+
+        for i, g in enumerate(range(len(self.sizes))):
+            self.assertEqual(r['groups'][i], labels[self.groups == g][0])
+            wm, we = calculate_weighted_mean(*self._group(g))
+            self.assertAlmostEqual(r['mean'][i], wm, places=10)
+            self.assertAlmostEqual(r['error'][i], we, places=12)
+
+    def test_invalid_kind(self):
+        self.assertRaises(ValueError, calculate_grouped_weighted_mean, self.x, self.errs, self.groups,
+                          kind='median')
+        self.assertRaises(ValueError, calculate_grouped_weighted_mean, self.x, self.errs, self.groups,
+                          kind='vol_fraction')
+
+
+def dense_gls(x, errs, u=None, k=1):
+    """
+        reference generalized least squares mean with the covariance formed explicitly
+    """
+    c = diag(errs ** 2)
+    if u is not None:
+        c = c + u.dot(u.T)
+    ci = inv(c)
+    one = ones(len(x))
+    sw = one.dot(ci).dot(one)
+    mean = one.dot(ci).dot(x) / sw
+    r = x - mean
+    return mean, sw ** -0.5, r.dot(ci).dot(r) / (len(x) - k)
+
+
+class CorrelatedWeightedMeanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.x, self.errs, self.groups = make_groups((4, 6, 3, 7), seed=2)
+
+    def _compare(self, u=None):
+        mean, error, mswd = calculate_correlated_weighted_mean(self.x, self.errs, u)
+        rmean, rerror, rmswd = dense_gls(self.x, self.errs, u)
+        self.assertAlmostEqual(mean, rmean, delta=abs(rmean) * 1e-12)
+        self.assertAlmostEqual(error, rerror, delta=rerror * 1e-10)
+        self.assertAlmostEqual(mswd, rmswd, delta=rmswd * 1e-10)
+
+    def test_uncorrelated(self):
+        self._compare()
+        mean, error, mswd = calculate_correlated_weighted_mean(self.x, self.errs)
+        wm, we = calculate_weighted_mean(self.x, self.errs)
+        self.assertAlmostEqual(mean, wm, places=10)
+        self.assertAlmostEqual(error, we, places=12)
+        self.assertAlmostEqual(mswd, calculate_mswd(self.x, self.errs, wm=wm), places=8)
+
+    def test_shared_error(self):
+        loadings = RandomState(3).uniform(0.05, 0.2, len(self.x))
+        u = shared_error_factor(self.groups, loadings)
+        self.assertEqual(u.shape, (len(self.x), 4))
+        self._compare(u)
+
+    def test_several_shared_errors(self):
+        rs = RandomState(4)
+        u = shared_error_factor(self.groups, rs.uniform(0.05, 0.2, len(self.x)))
+        # an error shared by every value, e.g. a decay constant
+        u = column_stack((u, full(len(self.x), 0.1)))
+        self._compare(u)
+
+    def test_dense_factor(self):
+        u = RandomState(5).normal(0, 0.05, (len(self.x), 3))
+        self._compare(u)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ============= EOF =============================================
@@ -0,0 +1,107 @@
+# ===============================================================================
+# Copyright 2015 Jake Ross
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+# ============= enthought library imports =======================
+# ============= standard library imports ========================
+import unittest
+
+from numpy import allclose, array
+# ============= local library imports  ==========================
+from ararpy.arar import calculate_ages
+from ararpy.constants import ArArConstants
+from ararpy.interferences import compile_production_ratios
+from ararpy.sweep import ParameterSweep
+from tests.test_shared import PRODUCTION_RATIOS, make_isotopes
+
+J = 0.002
+
+
+def compiled(values, dts, production_ratios=PRODUCTION_RATIOS, arar_constants=None):
+    """
+        F, k39 and age from the compiled reduction at one set of constants
+    """
+    cpr = compile_production_ratios(production_ratios, arar_constants)
+    cols = cpr.calculate_F(values, values * 0, dts)
+    ages, _ = calculate_ages(J, 0, cols['F'], 0, arar_constants=arar_constants)
+    return cols['F'], cols['k39'], ages
+
+
+class ParameterSweepTestCase(unittest.TestCase):
+    def setUp(self):
+        self.values, _, self.dts = make_isotopes(30)
+
+    def _compare(self, r, row, f, k39, age):
+        self.assertTrue(allclose(r['F'][row], f, rtol=1e-12, atol=0))
+        self.assertTrue(allclose(r['k39'][row], k39, rtol=1e-12, atol=0))
+        self.assertTrue(allclose(r['age'][row], age, rtol=1e-12, atol=0))
+
+    def test_defaults(self):
+        s = ParameterSweep(self.values, self.dts, J, PRODUCTION_RATIOS)
+        r = s.sweep()
+        self.assertEqual(r['F'].shape, (1, 30))
+        self._compare(r, 0, *compiled(self.values, self.dts))
+
+    def test_defaults_fixed_k3739(self):
+        ac = ArArConstants()
+        ac.k3739_mode = 'Fixed'
+        s = ParameterSweep(self.values, self.dts, J, PRODUCTION_RATIOS, ac)
+        self._compare(s.sweep(), 0, *compiled(self.values, self.dts, arar_constants=ac))
+
+    def test_default_grid(self):
+        """
+            sweeping every stage at its default value reproduces the compiled reduction
+        """
+        ac = ArArConstants()
+        s = ParameterSweep(self.values, self.dts, J, PRODUCTION_RATIOS, ac)
+        expected = compiled(self.values, self.dts)
+        for k, v in (('ca3637', PRODUCTION_RATIOS['ca3637'][0]),
+                     ('cl3638', PRODUCTION_RATIOS['cl3638'][0]),
+                     ('atm4036', ac.atm4036_v),
+                     ('k4039', PRODUCTION_RATIOS['k4039'][0]),
+                     ('lambda_b', ac.lambda_b_v)):
+            r = s.sweep(**{k: [v, v]})
+            self.assertEqual(r['F'].shape, (2, 30))
+            for row in (0, 1):
+                self._compare(r, row, *expected)
+
+    def test_sweep_production_ratios(self):
+        s = ParameterSweep(self.values, self.dts, J, PRODUCTION_RATIOS)
+        grid = array([0.0002, 0.00027, 0.0004])
+        r = s.sweep(ca3637=grid, k4039=grid * 30)
+        for i, v in enumerate(grid):
+            pr = dict(PRODUCTION_RATIOS, ca3637=(v, 0), k4039=(v * 30, 0))
+            self._compare(r, i, *compiled(self.values, self.dts, pr))
+
+    def test_sweep_constants(self):
+        s = ParameterSweep(self.values, self.dts, J, PRODUCTION_RATIOS)
+        r = s.sweep(atm4036=[295.5, 298.56], lambda_b=[4.962e-10, 4.9548e-10])
+        for i, (atm, lb) in enumerate(((295.5, 4.962e-10), (298.56, 4.9548e-10))):
+            ac = ArArConstants()
+            ac.atm4036_v = atm
+            ac.lambda_b_v = lb
+            self._compare(r, i, *compiled(self.values, self.dts, arar_constants=ac))
+
+    def test_invalid(self):
+        s = ParameterSweep(self.values, self.dts, J, PRODUCTION_RATIOS)
+        self.assertRaises(ValueError, s.sweep, atm4038x=[1])
+        self.assertRaises(ValueError, s.sweep, fixed_k3739=[0.01])
+        self.assertRaises(ValueError, s.sweep, k4039=[1, 2], ca3637=[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ============= EOF =============================================